@@ -7,18 +7,30 @@ This is meant to be invoked as a GithHub Actions workflow as defined in
 .github/workflows/bundle_builder.yml. You can run it manually as `make bundle`.
 
 CircuitPython library bundle zip files get cached in ~/.cache/circuitpython/
+along with a .sha256 file to verify them and a .index.json file listing the
+archive members for each library, so later builds don't have to download or
+scan the library bundle again.
+
+Builds are incremental: files in build/ only get written when their contents
+change, and files that are no longer part of the bundle get removed. The
+project bundle zip is written in-process with sorted entries, fixed
+permissions, and timestamps from the commit (or SOURCE_DATE_EPOCH), so the
+same inputs always make a byte-identical zip file.
 
 To customize the contents of your project bundle, edit bundle_manifest.cfg
 according to the comments in that file.
 """
 from configparser import ConfigParser
+import hashlib
+import json
 import os
 import os.path
-from os.path import abspath, basename, expanduser, isdir, isfile
+from os.path import abspath, basename, dirname, expanduser, isdir, isfile
 import re
-import shutil
 import subprocess
-from zipfile import ZipFile
+import time
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+import zlib
 
 
 MANIFEST = 'bundle_manifest.cfg'
@@ -33,9 +45,11 @@ config = ConfigParser(allow_no_value=True)
 config.read(MANIFEST)
 cfg = {
     '10.x': config.get('library_bundle', '10.x', fallback=None),
+    '10.x_sha256': config.get('library_bundle', '10.x_sha256', fallback=None),
     'guide_link': config.get('meta', 'guide_link', fallback=None),
     'lib': [k for (k, v) in config.items('lib')],
     'root': [k for (k, v) in config.items('root')],
+    'profile': config.getboolean('build', 'profile', fallback=True),
 }
 
 # Get repository url, name, and commit hash metadata from git
@@ -45,8 +59,11 @@ git_remote = re.sub(r'\.git$', '', git_remote)
 repo_name = run('basename `git rev-parse --show-toplevel`')
 try:
     commit = run('git rev-parse --short HEAD')
+    commit_time = int(run('git log -1 --format=%ct'))
 except subprocess.CalledProcessError:
     commit = "NO_COMMIT"
+    commit_time = 315532800    # 1980-01-01, the earliest zip timestamp
+commit_time = int(os.getenv('SOURCE_DATE_EPOCH', commit_time))
 
 # prepare file and directory paths
 files = {
@@ -65,61 +82,148 @@ for d in dirs.values():
     if not isdir(d):
         os.makedirs(d)
 
+# Paths of every file that belongs in the bundle, and write counts
+staged = set()
+counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+
+def unchanged(path, size, crc):
+    # Return True if the file at path has the given size and CRC-32
+    if not isfile(path) or os.path.getsize(path) != size:
+        return False
+    with open(path, 'rb') as f:
+        return zlib.crc32(f.read()) == crc
+
+def stage(dst, data):
+    # Add a file to the bundle tree, but only write it if it changed
+    staged.add(dst)
+    if unchanged(dst, len(data), zlib.crc32(data)):
+        counts['unchanged'] += 1
+        return
+    os.makedirs(dirname(dst), exist_ok=True)
+    with open(dst, 'wb') as f:
+        f.write(data)
+    counts['written'] += 1
+
+def read_root_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not cfg['profile'] and path.endswith('.py'):
+        # Compile out timing spans by turning off the _PROFILE const (see
+        # sb_stats.py)
+        data = re.sub(rb'(?m)^_PROFILE = const\(1\)', b'_PROFILE = const(0)',
+            data)
+    return data
+
 # Stage files into the zip archive directory tree
 for src in cfg['root']:
-    dst = dirs['10.x']
+    dst = os.path.join(dirs['10.x'], basename(src))
     if isfile(src):
-        shutil.copy2(src, dst)
+        stage(dst, read_root_file(src))
     elif isdir(src):
-        shutil.copytree(src, os.path.join(dst, basename(src)))
+        for (d, subdirs, names) in os.walk(src):
+            subdirs.sort()
+            for name in sorted(names):
+                path = os.path.join(d, name)
+                stage(os.path.join(dst, os.path.relpath(path, src)),
+                    read_root_file(path))
     else:
         raise FileNotFoundError(src)
 
-# Download library bundle archives with curl, use cache for local testing
-url10 = cfg['10.x']
-cache = dirs['cache']
-zip10path = os.path.join(cache, basename(url10))
-if not isfile(zip10path):
-    print("downloading", url10)
-    run(f"cd {cache} && curl -L -O {url10}")
-
-# Locate and extract mpy archive files for the specified library names.
-# This assumes that libraries may be a single .mpy file or a directory with
-# potentially many .mpy files.
-def extract_libs(zip_path, dst_dir, lib_names):
-    zf = ZipFile(zip_path)
-    info_list = zf.infolist()
-    # Step 1: find the source files (might be nested in a directory)
+def sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cached_download(url, expected=None):
+    # Return (path, sha256) of a verified copy of url in the cache. The hash
+    # gets checked against expected (from the manifest) if there is one,
+    # otherwise against the .sha256 file saved when it was downloaded. Bad
+    # or partial downloads get fetched again.
+    path = os.path.join(dirs['cache'], basename(url))
+    hash_path = path + '.sha256'
+    if isfile(path):
+        digest = sha256(path)
+        want = expected
+        if want is None and isfile(hash_path):
+            with open(hash_path) as f:
+                want = f.read().strip()
+        if want is None:
+            # Cached before hashes were saved, so check the zip CRCs once
+            with ZipFile(path) as zf:
+                if zf.testzip() is None:
+                    want = digest
+        if digest == want:
+            if not isfile(hash_path):
+                with open(hash_path, 'w') as f:
+                    print(digest, file=f)
+            return (path, digest)
+        print("cached", basename(path), "failed hash check")
+        os.remove(path)
+    print("downloading", url)
+    part = path + '.part'
+    run(f"curl -L -f -o '{part}' '{url}'")
+    digest = sha256(part)
+    if expected is not None and digest != expected:
+        os.remove(part)
+        raise ValueError(f'sha256 mismatch for {url}: {digest}')
+    os.replace(part, path)
+    with open(hash_path, 'w') as f:
+        print(digest, file=f)
+    return (path, digest)
+
+def archive_index(zip_path, digest):
+    # Map library names to their archive members as [name, CRC, size]. This
+    # assumes that libraries may be a single .mpy file or a directory with
+    # potentially many .mpy files. The index gets cached next to the archive
+    # and reused as long as the archive hash matches.
+    index_path = zip_path + '.index.json'
+    if isfile(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('sha256') == digest:
+            return index['libs']
     # For archive member paths like ".../lib/NAME.mpy" or ".../lib/NAME/...",
     # this regular expression should capture just the "NAME" part, which should
     # be a library name.
     lib_re = re.compile(r'^[^/]*/lib/(?:([^/]*).mpy|([^/]*)/)')
-    src_items = []
-    for i in info_list:
-        result = lib_re.match(i.filename)
-        if result:
-            captured_name = result[1] or result[2]
-            for lib in lib_names:
-                if lib == captured_name:
-                    src_items.append(i)
-    # Step 2: extract the matching files to the destination path ('.../lib/')
-    for i in src_items:
-        # The split > slice > join here is to remove the first two directories
-        # from filenames inside the zip archive. For example, starting with
-        # "adafruit-circuitpython-bundle-9.x-mpy-20240625/lib/adafruit_midi/note_on.mpy",
-        # the result would be "adafruit_midi/note_on.mpy"
-        dst_path = os.path.join(dst_dir, '/'.join(i.filename.split('/')[2:]))
-        # Ensure the full destination directory tree exists
-        (head, tail) = os.path.split(dst_path)
-        os.makedirs(head, exist_ok=True)
-        # Extract the file with open and write, because using extract() would
-        # create the prefix directories that we just went to all the trouble of
-        # identifying and removing
-        with zf.open(i, 'r') as f_src:
-            with open(dst_path, 'wb') as f_dst:
-                f_dst.write(f_src.read())
-
-extract_libs(zip10path, dirs['10_lib'], cfg['lib'])
+    libs = {}
+    with ZipFile(zip_path) as zf:
+        for i in zf.infolist():
+            if i.is_dir():
+                continue
+            if result := lib_re.match(i.filename):
+                libs.setdefault(result[1] or result[2], []).append(
+                    [i.filename, i.CRC, i.file_size])
+    with open(index_path, 'w') as f:
+        json.dump({'sha256': digest, 'libs': libs}, f, sort_keys=True)
+    return libs
+
+def extract_libs(zip_path, digest, dst_dir, lib_names):
+    # Stage the archive members for the specified library names, skipping
+    # files that are already up to date
+    index = archive_index(zip_path, digest)
+    with ZipFile(zip_path) as zf:
+        for lib in lib_names:
+            if lib not in index:
+                raise FileNotFoundError(
+                    f'{lib} is not in {basename(zip_path)}')
+            for (name, crc, size) in index[lib]:
+                # The split > slice > join here is to remove the first two
+                # directories from filenames inside the zip archive. For
+                # example, starting with
+                # "adafruit-circuitpython-bundle-9.x-mpy-20240625/lib/adafruit_midi/note_on.mpy",
+                # the result would be "adafruit_midi/note_on.mpy"
+                dst = os.path.join(dst_dir, *name.split('/')[2:])
+                if unchanged(dst, size, crc):
+                    staged.add(dst)
+                    counts['unchanged'] += 1
+                else:
+                    stage(dst, zf.read(name))
+
+(zip10path, zip10hash) = cached_download(cfg['10.x'], cfg['10.x_sha256'])
+extract_libs(zip10path, zip10hash, dirs['10_lib'], cfg['lib'])
 
 # Generate the README file
 readme = f"""
@@ -134,11 +238,60 @@ Libraries in '{repo_name}/CircuitPython 10.x/lib' came from:
 The rest of this project's code is from commit {commit} of git repo:
 {git_remote}
 """.strip()
-with open(files['readme'], 'w') as f:
-    print(readme, file=f)
+stage(files['readme'], (readme + '\n').encode('utf-8'))
+
+# Remove files left over from earlier builds (e.g. a library that got taken
+# out of the manifest), then any directories that ended up empty
+for (d, subdirs, names) in os.walk(dirs['root'], topdown=False):
+    for name in names:
+        if (path := os.path.join(d, name)) not in staged:
+            os.remove(path)
+            counts['removed'] += 1
+    if d != dirs['root'] and not os.listdir(d):
+        os.rmdir(d)
+
+def write_zip(zip_path, paths):
+    # Write the zip file deterministically: sorted entries (with directory
+    # entries like `zip -r` makes), one timestamp, and fixed permissions.
+    # Returns True if the zip file changed.
+    date_time = time.gmtime(max(commit_time, 315532800))[:6]
+    names = set()
+    for p in paths:
+        rel = os.path.relpath(p, 'build').replace(os.sep, '/')
+        names.add(rel)
+        while '/' in rel:
+            rel = rel.rsplit('/', 1)[0]
+            names.add(rel + '/')
+    part = zip_path + '.part'
+    with ZipFile(part, 'w') as zf:
+        for name in sorted(names):
+            zi = ZipInfo(name, date_time=date_time)
+            zi.create_system = 3    # unix, so the permissions below apply
+            if name.endswith('/'):
+                zi.external_attr = (0o40755 << 16) | 0x10
+                zf.writestr(zi, b'')
+            else:
+                zi.external_attr = 0o100644 << 16
+                zi.compress_type = ZIP_DEFLATED
+                with open(os.path.join('build', name), 'rb') as f:
+                    zf.writestr(zi, f.read(), compresslevel=9)
+    if isfile(zip_path) and sha256(zip_path) == sha256(part):
+        os.remove(part)
+        return False
+    os.replace(part, zip_path)
+    return True
 
 # Make the zip file
-run(f"cd build; zip -r {basename(files['zip'])} {basename(dirs['root'])}")
+changed = write_zip(files['zip'], staged)
 
-# Print an unzip listing for the Actions workflow log
-print(run(f"unzip -l {files['zip']}"))
+# Print a listing for the Actions workflow log
+with ZipFile(files['zip']) as zf:
+    total = 0
+    for i in zf.infolist():
+        print(f"{i.file_size:>9}  {i.filename}")
+        total += i.file_size
+    print(f"{total:>9}  {len(zf.infolist())} files")
+print(f"{files['zip']}: {'updated' if changed else 'unchanged'},",
+    f"sha256 {sha256(files['zip'])}")
+print("files: {written} written, {unchanged} unchanged,".format(**counts),
+    "{removed} removed".format(**counts))
@@ -3,15 +3,35 @@
 #
 # See NOTES.md for documentation links and pinout info.
 #
+import asyncio
 import board
-from microcontroller import cpu
+from microcontroller import cpu, nvm
 from micropython import const
 import os
 import time
 import wifi
 
-from sb_chardisplay import CharDisplay
-from sb_ircbot import IRCBot
+from sb_capture import CaptureRing, open_recorder
+from sb_chardisplay import CharDisplay, open_backend
+from sb_delta import TopicLines, parse_set
+from sb_history import TopicHistory
+from sb_power import (PowerPolicy, WAKE_DISPLAY, WAKE_KEEPALIVE, WAKE_PAGE,
+    WAKE_TOUCH)
+from sb_series import SeriesStore
+from sb_ircbot import (AsyncIRCBot, ERR_NICKNAMEINUSE, LINK_DEAD, LINK_LATE,
+    LINK_UP)
+from sb_stats import stats
+from sb_touch import (open_touch, Gestures, GESTURE_BACK, GESTURE_LIVE,
+    GESTURE_NONE, GESTURE_TAP)
+from sb_warmstart import WarmStart
+
+
+# Start time for measuring how long it takes to get a topic on the screen
+T0 = time.monotonic()
+
+
+def ms_since_start():
+    return int((time.monotonic() - T0) * 1000)
 
 
 # ---------------------------------------------------------------------------
@@ -19,7 +39,33 @@ from sb_ircbot import IRCBot
 # - `WIFI_SSID = "your ssid"` set the SSID to use for your wifi
 # - `WIFI_PASSWORD = "the password"` set password for your wifi
 # - `IRC_SERVER = "<some IP address>"` set IP address for your IRC server
+# - `IRC_SERVERS = "<IP>,<IP>:<port>"` (optional) servers in order of
+#   preference, with failover to the backups and back (overrides IRC_SERVER)
 # - `IRC_NICK = "<nickname>"` set nickname to use for your IRC server
+# - `IRC_CHAN = "<#channel>"` set channel to join
+# - `IRC_CHANS = "<#chan1>,<#chan2>"` (optional) join up to 4 channels, each
+#   with its own topic pane (overrides IRC_CHAN)
+# - `IRC_PING_MISSES = 2` (optional) unanswered keepalive PINGs in a row
+#   before the bot gives up on the connection and reconnects
+# - `TOPIC_PAGE_S = 4` (optional) seconds between pages of a long topic
+# - `TOPIC_MAX_PAGES = 4` (optional) max pages per topic, rest gets cut off
+# - `IRC_CAPTURE = "ram"` (optional) record received IRC bytes to a RAM ring
+#   (or "ram:<bytes>" to set its size, or a file path to record to a file)
+# - `IRC_CAPTURE_SAVE = "/capture.bin"` (optional) where a RAM capture gets
+#   saved each time a connection ends (needs a writable CIRCUITPY)
+# - `POWER_POLICY = "adaptive"` (optional) "adaptive" boosts the CPU clock
+#   while busy and waits on the socket until the next timer when idle,
+#   "fixed" keeps one clock speed and polls (see sb_power.py)
+# - `CPU_MHZ_IDLE = 80` (optional) CPU clock when idle (or always, for the
+#   fixed policy). ESP32-S3 supports 80, 160, and 240.
+# - `CPU_MHZ_BUSY = 240` (optional) CPU clock while busy (adaptive policy)
+# - `CPU_BOOST_MS = 250` (optional) how long the clock stays boosted after
+#   the last bit of work (adaptive policy)
+# - `DISPLAY_TYPE = "tft"` (optional) "tft" for the 2.8" TFT shield,
+#   "charlcd" for an HD44780 character LCD on the I2C backpack, or "term" for
+#   ANSI text on the serial console (see sb_textdisplay.py)
+# - `DISPLAY_COLS = 20` and `DISPLAY_ROWS = 4` (optional) size of the
+#   charlcd or term display
 #
 WIFI_SSID = None
 if (val := os.getenv("WIFI_SSID")) is not None:
@@ -30,12 +76,52 @@ if (val := os.getenv("WIFI_PASSWORD")) is not None:
 IRC_SERVER = None
 if (val := os.getenv("IRC_SERVER")) is not None:
     IRC_SERVER = str(val)
+if (val := os.getenv("IRC_SERVERS")) is not None:
+    IRC_SERVER = str(val)
 IRC_NICK = None
 if (val := os.getenv("IRC_NICK")) is not None:
     IRC_NICK = str(val)
 IRC_CHAN = None
 if (val := os.getenv("IRC_CHAN")) is not None:
     IRC_CHAN = str(val)
+if (val := os.getenv("IRC_CHANS")) is not None:
+    IRC_CHAN = str(val)
+IRC_PING_MISSES = 2
+if (val := os.getenv("IRC_PING_MISSES")) is not None:
+    IRC_PING_MISSES = int(val)
+TOPIC_PAGE_S = 4
+if (val := os.getenv("TOPIC_PAGE_S")) is not None:
+    TOPIC_PAGE_S = int(val)
+TOPIC_MAX_PAGES = 4
+if (val := os.getenv("TOPIC_MAX_PAGES")) is not None:
+    TOPIC_MAX_PAGES = int(val)
+IRC_CAPTURE = None
+if (val := os.getenv("IRC_CAPTURE")) is not None:
+    IRC_CAPTURE = str(val)
+IRC_CAPTURE_SAVE = "/capture.bin"
+if (val := os.getenv("IRC_CAPTURE_SAVE")) is not None:
+    IRC_CAPTURE_SAVE = str(val)
+POWER_POLICY = "adaptive"
+if (val := os.getenv("POWER_POLICY")) is not None:
+    POWER_POLICY = str(val)
+CPU_MHZ_IDLE = 80
+if (val := os.getenv("CPU_MHZ_IDLE")) is not None:
+    CPU_MHZ_IDLE = int(val)
+CPU_MHZ_BUSY = 240
+if (val := os.getenv("CPU_MHZ_BUSY")) is not None:
+    CPU_MHZ_BUSY = int(val)
+CPU_BOOST_MS = 250
+if (val := os.getenv("CPU_BOOST_MS")) is not None:
+    CPU_BOOST_MS = int(val)
+DISPLAY_TYPE = "tft"
+if (val := os.getenv("DISPLAY_TYPE")) is not None:
+    DISPLAY_TYPE = str(val)
+DISPLAY_COLS = 20
+if (val := os.getenv("DISPLAY_COLS")) is not None:
+    DISPLAY_COLS = int(val)
+DISPLAY_ROWS = 4
+if (val := os.getenv("DISPLAY_ROWS")) is not None:
+    DISPLAY_ROWS = int(val)
 # ---------------------------------------------------------------------------
 
 
@@ -47,160 +133,427 @@ def print_settings_banner():
     print(heading)
     print('# WIFI_SSID: [%s]' % (m if WIFI_SSID is None else 'ok'))
     print('# WIFI_PASSWORD: [%s]' % (m if WIFI_PASSWORD is None else 'ok'))
-    print('# IRC_SERVER: [%s]' % (m if IRC_SERVER is None else 'ok'))
+    print('# IRC_SERVER(S): [%s]' % (m if IRC_SERVER is None else 'ok'))
     print('# IRC_NICK: [%s]' % (m if IRC_NICK is None else 'ok'))
-    print('# IRC_CHAN: [%s]' % (m if IRC_CHAN is None else 'ok'))
+    print('# IRC_CHAN(S): [%s]' % (m if IRC_CHAN is None else 'ok'))
     print('# ' + ('=' * (len(heading)-2)))
 
 
-def wifi_connect():
-    # Try to connect to wifi
-    if WIFI_SSID and WIFI_PASSWORD:
+def wifi_connect(warm):
+    # Try to connect to wifi. If the warm start state has the channel and
+    # BSSID of the last access point, try those first to skip the scan.
+    if not (WIFI_SSID and WIFI_PASSWORD):
+        return None
+    (channel, bssid) = warm.wifi(WIFI_SSID)
+    while True:
         try:
-            wifi.radio.connect(ssid=WIFI_SSID, password=WIFI_PASSWORD)
-            ip = wifi.radio.ipv4_address
-            return ip
+            wifi.radio.connect(ssid=WIFI_SSID, password=WIFI_PASSWORD,
+                channel=channel, bssid=bssid)
+            if (ap := wifi.radio.ap_info) is not None:
+                warm.set_wifi(WIFI_SSID, ap.channel, ap.bssid)
+            return wifi.radio.ipv4_address
         except ConnectionError as e:
             print(e)
-    return None
+            if not channel:
+                return None
+            # The access point may have moved, so try again with a scan
+            (channel, bssid) = (0, None)
 
 
-def run():
-    # This has the main program logic. Putting these things inside a function
-    # helps force me to avoid spaghetti code. When lots of stuff lives in the
-    # global namespace, it's too easy to write functions that unintentionally
-    # reference global variables.
+# Port for IRC servers that don't have a `:port` in IRC_SERVERS
+IRC_PORT = const(6667)
 
-    print_settings_banner()
-    cd = CharDisplay()
-
-    # Reduce CPU frequency so the board runs cooler. The default ESP32-S3
-    # default frequency is 240 MHz. To avoid messing up time.monotonic(), don't
-    # attempt to set this below 80 MHz.
-    if 'esp32s3' in board.board_id:
-        cpu.frequency = 80_000_000
-
-    # Wrap the radio stuff in a big retry loop
-    RETRY_S = const(5)
-    RETRY_S_MAX = const(180)
-    WIFI_RETRY = const(20)
-    READ_TIME = const(0.8) # give me time to read the screen
-    irc_retry = RETRY_S
+# Timing options for the main loop tasks
+RETRY_S = const(5)          # IRC server backoff, which doubles with each
+RETRY_S_MAX = const(180)    # failure up to RETRY_S_MAX
+WIFI_RETRY = const(20)
+FRAME_S = const(0.1)        # minimum time between display refreshes
+STATS_S = const(60)         # how often to print stats to the serial console
+TOUCH_S = const(0.05)       # touch polling interval
+HISTORY_S = const(30)       # untouched time before scrollback goes live again
+
+# Topic history for touch scrollback: ring size in bytes and max topics (for
+# all panes together)
+HISTORY_BYTES = const(4096)
+HISTORY_SLOTS = const(32)
+
+# Series for `!kv` dashboard topics: max keys (for all panes together) and
+# samples kept per key
+KV_KEYS = const(32)
+KV_SAMPLES = const(256)
+
+
+async def network_task(cd, irc, warm, power):
+    # Connect to wifi and IRC with retries, then respond to IRC messages.
+    # The sleeps here are asyncio sleeps, so the display and keepalive tasks
+    # keep running while this task waits. Status messages don't wait to be
+    # read. Instead, the display gets refreshed right before each connect
+    # call, so the status shows while it blocks (or for IRC, while the
+    # connection attempts race).
+    radio = wifi.radio
     while True:
 
         # Ensure Wifi is up
-        if not wifi.radio.connected:
+        if not radio.connected:
             while True:
                 cd.set_status("WiFi Connect...")
-                time.sleep(READ_TIME)
-                ip = wifi_connect()
+                cd.refresh(force=True)
+                ip = wifi_connect(warm)
                 if ip:
                     cd.set_status('WiFi IP is %s' % ip)
-                    time.sleep(READ_TIME)
                     break
                 else:
                     # Wifi problem: sleep for a bit then try again
                     cd.set_status('Wifi Down')
-                    time.sleep(WIFI_RETRY)
+                    await asyncio.sleep(WIFI_RETRY)
                     continue
         else:
             cd.set_status("WiFi already connected")
-            time.sleep(READ_TIME)
 
         # Ensure IRC is up, then start responding to IRC messages
+        power.busy()
         cd.set_status("IRC Connect...")
-        time.sleep(READ_TIME)
-        radio = wifi.radio
-        with IRCBot(IRC_NICK, IRC_CHAN, IRC_SERVER, port=6667) as irc:
-            while radio.connected and not irc.connected:
-                # If initial connect failed, retry with exponential backoff
-                time.sleep(irc_retry)
-                irc_retry = min(RETRY_S_MAX, irc_retry * 2)
-                cd.set_status('IRC Connect Retry...')
-                time.sleep(READ_TIME)
-                irc.connect()
-
-            irc.register()
-
-            # Main IRC bot loop
-            last_rx = time.monotonic()
-            PING_TIMEOUT = const(200)
-            while radio.connected and irc.connected:
-                line = irc.recv_line()
-                if line is None:
-                    if time.monotonic() - last_rx > PING_TIMEOUT:
-                        # Something's wrong. It's too quiet. Close & reconnect
-                        cd.set_status('IRC: connection timeout')
-                        irc.close()
-                        time.sleep(irc_retry)
-                        irc_retry = min(RETRY_S_MAX, irc_retry * 2)
-                        break
-                    time.sleep(0.010)
-                    continue
-                last_rx = time.monotonic()
-                (prefix, cmd, params) = line
-                print(cmd, params)
-                if cmd == '433':
-                    # - 433 * <nick> :Nickname already in use
-                    cd.set_status('IRC: Nick in use')
-                    irc.close()
-                    time.sleep(irc_retry)
-                    irc_retry = min(RETRY_S_MAX, irc_retry * 2)
-                    break
-                elif cmd == 'PING':
-                    irc.pong(params)
-                elif cmd == 'JOIN':
-                    my_nick = ':%s!' % IRC_NICK
-                    if prefix and prefix.find(my_nick) == 0:
-                        # Set status line to channel name when I join. Ignore
-                        # join notifications about other users.
-                        cd.set_status(params[1:])  # slice off leading ':'
-                        # SUCCESS: Joined OK, so reset the retry interval
-                        irc_retry = RETRY_S
-                elif cmd == '332':
-                    # Channel topic notification for JOIN
-                    # Typical cmd+params format: `332 tftbot #sensors :!pre /`
-                    nickchan = '%s %s :' % (IRC_NICK, IRC_CHAN)
-                    pre = '!pre '
-                    if not params.startswith(nickchan):
-                        continue
-                    text = params[len(nickchan):]
-                    if text.startswith(pre):
-                        # bot mode for displaying preformatted text with
-                        # dynamically slectable line delimeters: first char of
-                        # first word after the `!pre` is the delimeter that
-                        # gets replaced with line breaks
-                        text = text[len(pre):]
-                        if len(text) >= 1:
-                            delim = text[0]
-                            text = text[1:].replace(delim, '\n')
-                            cd.set_topic(text, wrap='pre')
-                    else:
-                        # Default to hard wrapping lines
-                        cd.set_topic(text, wrap='hard')
-                elif cmd == 'TOPIC':
-                    # Channel topic notifiction after JOIN
-                    # Typical cmd+param format: `TOPIC #sensors :!pre /...`
-                    chan = '%s :' % IRC_CHAN
-                    pre = '!pre '
-                    if not params.startswith(chan):
-                        continue
-                    text = params[len(chan):]
-                    if text.startswith(pre):
-                        # bot mode for displaying preformatted text with
-                        # dynamically slectable line delimeters: first char of
-                        # first word after the `!pre` is the delimeter that
-                        # gets replaced with line breaks
-                        text = text[len(pre):]
-                        if len(text) >= 1:
-                            delim = text[0]
-                            text = text[1:].replace(delim, '\n')
-                            cd.set_topic(text, wrap='pre')
-                    else:
-                        # Default to hard wrapping lines
-                        cd.set_topic(text, wrap='hard')
+        cd.refresh(force=True)
+        await irc.connect()
+        while radio.connected and not irc.connected:
+            # None of the servers answered, so wait for the first one to
+            # come off its backoff (see ServerList in sb_ircbot.py)
+            await asyncio.sleep(irc.retry_delay())
+            cd.set_status('IRC Connect Retry...')
+            cd.refresh(force=True)
+            await irc.connect()
+
+        await irc.register()
+
+        # Main IRC bot loop. This doesn't await anything until rx_buf runs
+        # out of lines, so a burst of messages gets handled before the
+        # display task renders the end result. The handlers registered by
+        # add_handlers() do the actual work.
+        while radio.connected and irc.connected:
+            msg = await irc.recv_msg()
+            if msg is None:
+                continue
+            power.busy()
+            stats.mem()
+            irc.dispatch(msg)
+
+        # Connection ended (nick in use, dead link, or server hung up), so
+        # close it, which backs off from that server. If there's a backup
+        # that isn't backing off, that's right away. If the bot made it as
+        # far as joining the channel, the server's backoff starts over.
+        irc.close()
+        save_capture(irc)
+        if radio.connected:
+            await asyncio.sleep(irc.retry_delay())
+
+
+def save_capture(irc):
+    # Write a RAM capture ring out to IRC_CAPTURE_SAVE, so the traffic that
+    # led up to a dropped connection (or a crash) survives a reset and can
+    # be replayed on a host. This overwrites the last save. Without a
+    # writable CIRCUITPY (boot.py has to remount it for code.py), it only
+    # prints an error.
+    if not isinstance(irc.recorder, CaptureRing):
+        return
+    try:
+        irc.recorder.save(IRC_CAPTURE_SAVE)
+        print('capture: saved to %s' % IRC_CAPTURE_SAVE)
+    except OSError as e:
+        print('ERR capture save: "%s"' % e)
+
+
+def add_handlers(cd, irc, warm, history, back, lines):
+    # Register IRC message handlers. PING gets handled by the bot itself.
+    # To handle another command, register a handler for it here.
+
+    def nick_in_use(msg):
+        # - 433 * <nick> :Nickname already in use
+        cd.set_status('IRC: Nick in use')
+        irc.close()
+
+    chans = []
+
+    def joined(chan):
+        # Set status line to the names of the channels I've joined. Any
+        # `!set` patches that came while the bot was away are lost, so the
+        # channel's pane is out of sync until it gets all its lines again.
+        if chan not in chans:
+            chans.append(chan)
+        if chan in irc.chans and (i := irc.chans.index(chan)) < len(lines):
+            lines[i].desync()
+        link(irc.link, irc.rtt_ms)
+
+    def link(state, rtt_ms):
+        # Show the keepalive round trip time or link trouble after the
+        # channel names. The network task sets its own status when the link
+        # is down.
+        if state == LINK_DEAD:
+            cd.set_status('IRC: link dead')
+        elif state == LINK_LATE:
+            cd.set_status('%s (no reply)' % ' '.join(chans))
+        elif state == LINK_UP and chans:
+            text = ' '.join(chans)
+            if irc.server_i > 0:
+                # On a backup server
+                text = '%s @%s' % (text, irc.server)
+            if rtt_ms < 0:
+                cd.set_status(text)
+            else:
+                cd.set_status('%s %dms' % (text, rtt_ms))
+
+    first = True
+
+    def topic(i, text):
+        # Channel topic from 332 (on join) or TOPIC (topic change). Channel i
+        # goes in pane i. Remember it for scrollback and the next warm start.
+        # A `!set` topic patches lines of the pane's `!pre` topic, and the
+        # patched topic is what gets remembered.
+        nonlocal first
+        if i >= len(cd.panes):
+            return
+        changed = None
+        if text.startswith('!set '):
+            if (patches := parse_set(text[5:])) is None:
+                return
+            changed = lines[i].apply(patches)
+            t = (lines[i].text, 'pre')
+        elif (t := topic_layout(text)) is None:
+            return
+        elif t[1] == 'pre':
+            lines[i].load(t[0])
+        else:
+            lines[i].reset()
+        if t[1] == 'kv':
+            # Every live dashboard topic is a new sample, even if it's the
+            # same text as the last one
+            cd.series.scan(t[0], pane=i)
+        if history.push(i, *t) and back[i]:
+            # Pane i is showing an older topic, so keep showing that one
+            back[i] = min(back[i] + 1, history.count(i) - 1)
+        warm.set_topic(i, *t)
+        if not back[i]:
+            if changed is None:
+                cd.set_topic(t[0], wrap=t[1], pane=i)
+            else:
+                cd.patch_topic(lines[i], changed, pane=i,
+                    stale=not lines[i].synced)
+            if first:
+                first = False
+                print('live topic: %d ms after start' % ms_since_start())
+
+    irc.on(ERR_NICKNAMEINUSE, nick_in_use)
+    irc.on_join(joined)
+    irc.on_link(link)
+    irc.on_topic(topic)
+    irc.on_stats(lambda: stats_summary(irc))   # `!stats` or CTCP STATS
+
+
+def stats_summary(irc):
+    return '%s %s' % (stats.summary(), irc.rtt_summary())
+
+
+def topic_layout(text):
+    # Return (text, wrap) to show for channel topic text, checking for the
+    # `!pre` and `!kv` bot modes, or None if there's nothing to show
+    kv = '!kv '
+    if text.startswith(kv):
+        # bot mode for a dashboard of `key=value` fields with sparklines
+        if text := text[len(kv):].strip():
+            return (text, 'kv')
+        return None
+    pre = '!pre '
+    if text.startswith(pre):
+        # bot mode for displaying preformatted text with dynamically
+        # slectable line delimeters: first char of first word after the
+        # `!pre` is the delimeter that gets replaced with line breaks
+        text = text[len(pre):]
+        if len(text) >= 1:
+            delim = text[0]
+            return (text[1:].replace(delim, '\n'), 'pre')
+        return None
+    # Default to hard wrapping lines
+    return (text, 'hard')
+
+
+def stale_layout(text, wrap):
+    # Old `!kv` topics (scrollback or warm start) get shown as plain text,
+    # one field per line, since their sparklines would show the live series
+    if wrap == 'kv':
+        return (text.replace(' ', '\n'), 'pre')
+    return (text, wrap)
+
+
+def scroll(cd, history, back, pane, gesture):
+    # Step pane back or forward through its topic history, or back to live,
+    # and draw that topic (dimmed unless it's the live one). back[pane] is
+    # how many topics back from the newest the pane is showing.
+    n = history.count(pane)
+    if gesture == GESTURE_LIVE:
+        b = 0
+    elif gesture == GESTURE_BACK:
+        b = min(back[pane] + 1, n - 1)
+    else:
+        b = max(back[pane] - 1, 0)
+    if b < 0 or b == back[pane]:
+        return
+    back[pane] = b
+    (text, wrap) = history.get(pane, b)
+    if b > 0:
+        (text, wrap) = stale_layout(text, wrap)
+    cd.set_topic(text, wrap=wrap, pane=pane, stale=b > 0)
+    print('history: pane %d, %d of %d back' % (pane, b, n - 1))
+
+
+async def keepalive_task(irc, warm, power):
+    # Let the bot send keepalive PINGs when the connection goes quiet. If it
+    # decides the link is dead, it hangs up, and the network task notices
+    # that and reconnects. This also prints the stats summary every STATS_S
+    # seconds and saves warm start state when it changes (rate limited by
+    # WarmStart.save_s to spare the flash). It sleeps until the next of
+    # those is due.
+    next_stats = time.monotonic() + STATS_S
+    delay = 0
+    while True:
+        await power.sleep(WAKE_KEEPALIVE, delay)
+        now = time.monotonic()
+        if now >= next_stats:
+            next_stats += STATS_S
+            stats.mem()
+            print('stats:', stats_summary(irc))
+        warm.save()
+        delay = min(irc.keepalive(), next_stats - now)
+        if warm.dirty:
+            delay = min(delay, warm.last_save + warm.save_s - now)
+        delay = max(delay, 0.01)
+
+
+async def touch_task(cd, touch, history, back, power):
+    # Poll the touch controller and turn gestures into topic scrollback (see
+    # sb_touch.py). After HISTORY_S seconds without a touch, panes that are
+    # showing old topics go back to live.
+    gestures = Gestures()
+    last = time.monotonic()
+    while True:
+        await power.sleep(WAKE_TOUCH, TOUCH_S)
+        point = touch.touch_point
+        now = time.monotonic()
+        if point is not None:
+            last = now
+        if (g := gestures.update(point)) != GESTURE_NONE:
+            if (pane := cd.pane_at(gestures.x0, gestures.y0)) >= 0:
+                if g == GESTURE_TAP:
+                    p = cd.panes[pane]
+                    g = gestures.tap(p.x, p.w)
+                scroll(cd, history, back, pane, g)
+        elif now - last > HISTORY_S and any(back):
+            for (i, b) in enumerate(back):
+                if b:
+                    scroll(cd, history, back, i, GESTURE_LIVE)
+
+
+async def page_task(cd, paged, power):
+    # Flip to the next page of any topics that don't fit on one screen. When
+    # there's nothing to flip, wait for the display task to say there is,
+    # rather than waking up every TOPIC_PAGE_S to check.
+    while True:
+        if not cd.paged():
+            paged.clear()
+            await power.wait(WAKE_PAGE, paged)
+        await power.sleep(WAKE_PAGE, TOPIC_PAGE_S)
+        cd.flip_pages()
+
+
+async def display_task(cd, dirty, paged, power):
+    # Refresh the display once per batch of text changes. Waiting out the
+    # rest of the frame budget lets the network task drain its pending lines
+    # first, so a burst of updates only pushes its final state. This also
+    # wakes the page task when a topic needs paging.
+    sched = cd.scheduler
+    while True:
+        await power.wait(WAKE_DISPLAY, dirty)
+        dirty.clear()
+        if cd.paged():
+            power.wake(WAKE_PAGE, paged)
+        if (delay := sched.delay()) > 0:
+            await power.sleep(WAKE_DISPLAY, delay)
+        power.busy()
+        cd.refresh()
+
+
+async def run():
+    # This has the main program logic. Putting these things inside a function
+    # helps force me to avoid spaghetti code. When lots of stuff lives in the
+    # global namespace, it's too easy to write functions that unintentionally
+    # reference global variables.
+
+    print_settings_banner()
+    irc = AsyncIRCBot(IRC_NICK, IRC_CHAN or '', IRC_SERVER, port=IRC_PORT,
+        retry_s=RETRY_S, retry_max_s=RETRY_S_MAX)
+    irc.ping_misses = max(IRC_PING_MISSES, 1)
+    dirty = asyncio.Event()
+    paged = asyncio.Event()
+    if (panes := max(len(irc.chans), 1)) > 4:
+        print('WARNING: only the first 4 channels get topic panes')
+        panes = 4
+    backend = open_backend(DISPLAY_TYPE, max(DISPLAY_COLS, 8),
+        max(DISPLAY_ROWS, 2))
+    cd = CharDisplay(panes=panes, on_change=dirty.set, frame_s=FRAME_S,
+        max_pages=max(TOPIC_MAX_PAGES, 1),
+        series=SeriesStore(KV_KEYS, KV_SAMPLES), backend=backend)
+
+    # Warm start: draw the topics from before the last reset right away,
+    # dimmed to show they're stale, while wifi and IRC come up. They also
+    # start off the topic history.
+    history = TopicHistory(HISTORY_BYTES, HISTORY_SLOTS)
+    back = [0] * panes
+    lines = [TopicLines() for _ in range(panes)]
+    warm = WarmStart(nvm)
+    if warm.load():
+        for (i, t) in enumerate(warm.topics[:panes]):
+            if t is not None:
+                (text, wrap) = stale_layout(*t)
+                cd.set_topic(text, wrap=wrap, pane=i, stale=True)
+                history.push(i, *t)
+                if t[1] == 'pre':
+                    # `!set` patches can start from here, dimmed until
+                    # they've replaced every line
+                    lines[i].load(t[0])
+                    lines[i].desync()
+        cd.refresh(force=True)
+        print('stale topic: %d ms after start' % ms_since_start())
+
+    # Run at a low CPU clock when idle so the board runs cooler, and boost it
+    # when there's work (see sb_power.py). The default ESP32-S3 frequency is
+    # 240 MHz. To avoid messing up time.monotonic(), don't attempt to set
+    # this below 80 MHz.
+    power = PowerPolicy(cpu if 'esp32s3' in board.board_id else None,
+        POWER_POLICY, max(CPU_MHZ_IDLE, 80), max(CPU_MHZ_BUSY, 80),
+        CPU_BOOST_MS / 1000)
+    irc.on_idle(power.idle)
+    cd.on_change = lambda: power.wake(WAKE_DISPLAY, dirty)
+
+    if IRC_CAPTURE:
+        irc.recorder = open_recorder(IRC_CAPTURE)
+    add_handlers(cd, irc, warm, history, back, lines)
+    tasks = [
+        asyncio.create_task(network_task(cd, irc, warm, power)),
+        asyncio.create_task(keepalive_task(irc, warm, power)),
+        asyncio.create_task(display_task(cd, dirty, paged, power)),
+        asyncio.create_task(page_task(cd, paged, power)),
+    ]
+    if backend.touch and (touch := open_touch()) is not None:
+        # With the fixed power policy, the network task blocks in recv for up
+        # to idle_timeout at a time, so keep that short enough for the touch
+        # polling to keep up
+        irc.idle_timeout = TOUCH_S
+        tasks.append(asyncio.create_task(touch_task(cd, touch, history,
+            back, power)))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        save_capture(irc)
 
 # ---
 # Main entry point
 # ---
-run()
+asyncio.run(run())
@@ -0,0 +1,6 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the adafruit_character_lcd library. See
+# character_lcd_i2c.py.
+#
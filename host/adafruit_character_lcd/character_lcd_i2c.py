@@ -0,0 +1,97 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for adafruit_character_lcd.character_lcd_i2c. See the
+# "Running on a Linux Host" section of README.md.
+#
+# Character_LCD_I2C keeps the HD44780's display memory and counts the bytes
+# (commands and characters) that get sent to it. On the real I2C backpack,
+# the library sends each byte as about 15 MCP23008 register writes at 100
+# kHz, plus a 1 ms delay, so each byte here costs BYTE_S of simulated bus
+# time.
+#
+# Environment variables:
+# - HOST_LCD_TEXT: write what the LCD shows to this text file after each
+#   message
+# - HOST_SPI_SLEEP: set to 0 to skip sleeping for the simulated bus time
+#
+import os
+import time
+
+BYTE_S = 0.005
+CLEAR_S = 0.003            # the clear command takes longer
+
+# Display memory address of the start of each row
+_ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+
+class Character_LCD_I2C:
+    def __init__(self, i2c, columns, lines, address=None,
+            backlight_inverted=False):
+        self.columns = columns
+        self.lines = lines
+        self.column = 0
+        self.row = 0
+        self.backlight = True
+        self._message = None
+        self._ddram = bytearray(b' ' * 128)
+        self._addr = 0
+        # Bus statistics
+        self.bytes_sent = 0
+        self.commands = 0
+        self.bus_time = 0.0
+        self.text_path = os.getenv('HOST_LCD_TEXT')
+        self.sleep = os.getenv('HOST_SPI_SLEEP', '1') != '0'
+
+    def _send(self, n, seconds=0.0):
+        seconds += n * BYTE_S
+        self.bytes_sent += n
+        self.bus_time += seconds
+        if self.sleep:
+            time.sleep(seconds)
+
+    def clear(self):
+        self._ddram[:] = b' ' * 128
+        self._addr = 0
+        self.commands += 1
+        self._send(1, CLEAR_S)
+
+    def cursor_position(self, column, row):
+        row = min(row, self.lines - 1)
+        column = min(column, self.columns - 1)
+        self._addr = column + _ROW_OFFSETS[row]
+        self.commands += 1
+        self._send(1)
+        self.row = row
+        self.column = column
+
+    @property
+    def message(self):
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        # Like the real one, this starts with a cursor move to (column, row)
+        # and goes to the next row at a newline
+        self._message = message
+        line = self.row
+        self.cursor_position(self.column, line)
+        for c in message:
+            if c == '\n':
+                line += 1
+                self.cursor_position(0, line)
+                continue
+            self._ddram[self._addr & 0x7f] = ord(c) if ord(c) < 256 else 63
+            self._addr += 1
+            self._send(1)
+        self.column = 0
+        self.row = 0
+        if self.text_path:
+            with open(self.text_path, 'w') as f:
+                f.write(self.dump() + '\n')
+
+    def dump(self):
+        # Return what the LCD shows, one line per row
+        return '\n'.join(
+            self._ddram[o:o+self.columns].decode('latin-1').rstrip()
+            for o in _ROW_OFFSETS[:self.lines])
@@ -0,0 +1,12 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the adafruit_ili9341 library. See the "Running on a Linux
+# Host" section of README.md.
+#
+from busdisplay import BusDisplay
+
+
+class ILI9341(BusDisplay):
+    def __init__(self, bus, **kwargs):
+        super().__init__(bus, b'', **kwargs)
@@ -0,0 +1,52 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the adafruit_stmpe610 touch controller library. See the
+# "Running on a Linux Host" section of README.md.
+#
+# There's no touch screen on a host, so touch_point plays back strokes from
+# the HOST_TOUCH environment variable. It's a list of strokes separated by
+# semicolons, where each one is `seconds:x,y` for a tap or `seconds:x,y>x,y`
+# for a swipe, in display coordinates. Seconds count from when the touch
+# controller was opened. For example, `HOST_TOUCH='3:40,120;5:300,120>40,120'`
+# taps the left side of the screen after 3 seconds, then swipes left after 5.
+# Each stroke lasts STROKE_S seconds. Without HOST_TOUCH, nothing ever
+# touches the screen. With `HOST_TOUCH=off`, opening the controller fails
+# like it does on a shield without touch.
+#
+import os
+import time
+
+STROKE_S = 0.4
+
+
+class Adafruit_STMPE610_SPI:
+    def __init__(self, spi, cs, baudrate=1000000, *, calibration=None,
+            size=None, disp_rotation=0, touch_flip=(False, False)):
+        self._t0 = time.monotonic()
+        self._strokes = []
+        if (script := os.getenv('HOST_TOUCH', '')) == 'off':
+            raise RuntimeError('Failed to find STMPE610! Chip Version 0x0')
+        for stroke in script.split(';'):
+            if not stroke.strip():
+                continue
+            (t, points) = stroke.split(':')
+            ends = [tuple(int(v) for v in p.split(',')) for p in
+                points.split('>')]
+            self._strokes.append((float(t), ends[0], ends[-1]))
+
+    @property
+    def touched(self):
+        return self.touch_point is not None
+
+    @property
+    def touch_point(self):
+        # Return (x, y, pressure) for the stroke happening now, or None.
+        # Swipes move linearly from their start to end point.
+        now = time.monotonic() - self._t0
+        for (t, a, b) in self._strokes:
+            if t <= now < t + STROKE_S:
+                f = (now - t) / STROKE_S
+                return (int(a[0] + (b[0] - a[0]) * f),
+                    int(a[1] + (b[1] - a[1]) * f), 128)
+        return None
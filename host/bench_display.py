@@ -0,0 +1,418 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Benchmark for topic text updates in sb_chardisplay. See the "Benchmarks"
+# section of README.md.
+#
+# Usage: PYTHONPATH=host python3 host/bench_display.py [options]
+#
+# This plays a stream of typical sensor topics (a few readings where one or
+# two digits change each time) into the CellGrid renderer and into the
+# adafruit_display_text Label it replaced. For each, it reports the time per
+# update (not counting display.refresh()) and the heap churn per update,
+# measured as the peak traced bytes allocated during one update.
+#
+# The kv scenario plays `!kv` dashboard topics with --keys keys into a
+# SeriesStore and a full screen KVPane, for long enough to wrap every ring
+# several times. Besides time and churn, it reports the sparkline columns
+# written per update and the bytes still allocated after the run compared to
+# after the first update (the heap growth). Then it checks that two panes
+# whose topics have the same keys keep separate series: it plays `!kv`
+# topics into both panes of a two channel CharDisplay the way the topic
+# handler in code.py does, and counts updates where either pane's dashboard
+# shows the other's value. The rotate check renames one of a pane's sensors
+# every few updates, for many more keys than the SeriesStore has slots, and
+# counts updates where the dashboard is missing a key or a value, or where a
+# key's series has samples from before it appeared.
+#
+# The backend scenarios play the sensor topics through a whole CharDisplay
+# with each display backend: the TFT, a 20x4 character LCD on the I2C
+# backpack, and a 40x12 terminal. They report the bytes sent to the display
+# per update and the simulated bus time for them (without sleeping for it),
+# next to what rewriting every cell would cost.
+#
+# The patch scenarios play a six line `!pre` sensor topic where one reading
+# changes per update, once as full `!pre` topics and once as `!set` line
+# patches (see sb_delta.py), through a CharDisplay on the TFT. They report
+# the topic bytes on the wire and the time to parse and lay out each update
+# (without refreshing the display, which sends the same changed cells either
+# way). Results get appended to build/bench.jsonl.
+#
+# The Label scenario uses the real library, since there's no host stand-in
+# for it any more. Install it with:
+#
+#   pip install --no-deps --target build/pylib \
+#       adafruit-circuitpython-display-text
+#
+# Without it, the Label scenario gets skipped.
+#
+import argparse
+import contextlib
+import gc
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, '.')
+
+LABEL_LIB = os.path.join('build', 'pylib')
+
+from bench_util import print_table, write_results
+import board
+import displayio
+import terminalio
+from sb_chardisplay import (CellGrid, CharDisplay, KVPane, TFTBackend,
+    wrap_offsets)
+from sb_delta import TopicLines, parse_set
+from sb_series import SeriesStore
+from sb_textdisplay import CharLCDBackend, TermBackend
+from adafruit_character_lcd.character_lcd_i2c import (BYTE_S,
+    Character_LCD_I2C)
+
+
+def topics(n, rng):
+    # Make n topics shaped like the ones serial-sensor-bot sends, after
+    # topic_layout() in code.py strips the `!pre /` and splits lines. Each
+    # one changes one or two digits from the one before.
+    temp = 215
+    hum = 40
+    co2 = 612
+    out = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.6:
+            temp += rng.choice((-1, 1))
+        elif r < 0.8:
+            hum += rng.choice((-1, 1))
+        else:
+            co2 += rng.randint(-5, 5)
+        out.append('temp %d.%dC\nhum %d%%\nco2 %dppm' % (temp // 10,
+            temp % 10, hum, co2))
+    return out
+
+
+def kv_topics(n, keys, rng):
+    # Make n `!kv` topic bodies with the given number of keys, where each
+    # value does a random walk
+    vals = [rng.randint(0, 1000) for _ in range(keys)]
+    out = []
+    for _ in range(n):
+        for i in range(keys):
+            vals[i] += rng.randint(-20, 20)
+        out.append(' '.join('k%02d=%d.%d' % (i, v // 10, v % 10)
+            for (i, v) in enumerate(vals)))
+    return out
+
+
+def patch_topics(n, rng):
+    # Make n updates to a six line `!pre` sensor topic, changing one reading
+    # each time. Returns (full topic, `!set` topic) pairs, plus the first
+    # full topic.
+    names = ('temp', 'hum', 'co2', 'pm25', 'lux', 'db')
+    vals = [215, 40, 612, 12, 340, 45]
+    fmt = ('%d.%dC', '%d%%', '%dppm', '%dug', '%dlx', '%ddB')
+
+    def line(k):
+        v = vals[k]
+        return names[k] + ' ' + (fmt[k] % ((v // 10, v % 10) if k == 0
+            else v))
+
+    first = '!pre /' + '/'.join(line(k) for k in range(6))
+    out = []
+    for _ in range(n):
+        k = rng.randrange(6)
+        vals[k] += rng.choice((-1, 1))
+        out.append(('!pre /' + '/'.join(line(j) for j in range(6)),
+            '!set %d /%s' % (k + 1, line(k))))
+    return (first, out)
+
+
+def patches(first, updates):
+    # Play updates through a CharDisplay on the TFT as full `!pre` topics
+    # and as `!set` patches, the way the topic handler in code.py does, and
+    # return result rows
+    rows = []
+    for name in ('full', 'set'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            # With on_change set, it doesn't refresh on its own
+            cd = CharDisplay(on_change=lambda: None, backend=TFTBackend())
+            lines = TopicLines()
+            text = first[len('!pre /'):].replace('/', '\n')
+            lines.load(text)
+            cd.set_topic(text, wrap='pre')
+            wire = 0
+            secs = 0.0
+            for (full, patch) in updates:
+                t0 = time.perf_counter()
+                if name == 'full':
+                    wire += len(full)
+                    text = full[len('!pre /'):].replace('/', '\n')
+                    lines.load(text)
+                    cd.set_topic(text, wrap='pre')
+                else:
+                    wire += len(patch)
+                    changed = lines.apply(parse_set(patch[len('!set '):]))
+                    cd.patch_topic(lines, changed)
+                secs += time.perf_counter() - t0
+        n = len(updates)
+        rows.append({
+            'scenario': 'patch/' + name,
+            'updates': n,
+            'update_us': secs / n * 1e6,
+            'wire_bytes': wire / n,
+            'final_ok': cd.panes[0].pages[0].dump() == lines.text,
+        })
+    return rows
+
+
+def kv_panes(n, rng):
+    # Play n pairs of `!kv` topics with the same keys into the two panes of
+    # a CharDisplay, and return a result row with the number of updates
+    # where either pane showed a value that was sent to the other one
+    with contextlib.redirect_stdout(io.StringIO()):
+        cd = CharDisplay(panes=2, on_change=lambda: None,
+            backend=TFTBackend())
+    failures = 0
+    for _ in range(n):
+        sent = []
+        for i in range(2):
+            # Pane 0 gets temps from 10 to 19, and pane 1 from 30 to 39
+            text = 'temp=%d.%dC hum=%d%%' % (10 + 20 * i + rng.randrange(10),
+                rng.randrange(10), rng.randint(20, 70))
+            cd.series.scan(text, pane=i)
+            with contextlib.redirect_stdout(io.StringIO()):
+                cd.set_topic(text, wrap='kv', pane=i)
+            sent.append(text.split(' '))
+        for i in range(2):
+            kv = cd.panes[i].kv
+            got = ['%s=%s' % (cd.series.keys[kv.slots[k]],
+                cd.series.text[kv.slots[k]]) for k in range(kv.count)]
+            if got != sent[i]:
+                failures += 1
+                break
+    return {
+        'scenario': 'kv/two_panes',
+        'updates': n,
+        'slots': len(cd.series.keys),
+        'failures': failures,
+    }
+
+
+def kv_rotate(n, rng, per_topic=8, every=5):
+    # Play n `!kv` topics with per_topic keys into one pane, renaming one of
+    # the keys every few updates, and return a result row
+    with contextlib.redirect_stdout(io.StringIO()):
+        cd = CharDisplay(on_change=lambda: None, backend=TFTBackend())
+    store = cd.series
+    names = ['s%03d' % k for k in range(per_topic)]
+    age = dict.fromkeys(names, 0)    # topics each key has been in
+    made = per_topic
+    failures = 0
+    for u in range(n):
+        if u % every == every - 1:
+            k = rng.randrange(per_topic)
+            del age[names[k]]
+            names[k] = 's%03d' % made
+            age[names[k]] = 0
+            made += 1
+        text = ' '.join('%s=%d' % (k, rng.randint(0, 99)) for k in names)
+        store.scan(text, pane=0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            cd.set_topic(text, wrap='kv', pane=0)
+        for k in names:
+            age[k] += 1
+        kv = cd.panes[0].kv
+        slots = kv.slots[:kv.count]
+        got = ['%s=%s' % (store.keys[i], store.text[i]) for i in slots]
+        if got != text.split(' ') or any(store.counts[i] != age[store.keys[i]]
+                for i in slots):
+            failures += 1
+    return {
+        'scenario': 'kv/rotate',
+        'updates': n,
+        'keys': made,
+        'slots': store.max_keys,
+        'reused': store.reused,
+        'dropped': store.dropped,
+        'failures': failures,
+    }
+
+
+def run(update, texts):
+    # Return (microseconds per update, average and max peak bytes per update)
+    peaks = []
+    if started := not tracemalloc.is_tracing():
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    for txt in texts:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        update(txt)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    secs = time.perf_counter() - t0
+    if started:
+        tracemalloc.stop()
+    return (secs / len(texts) * 1e6, sum(peaks) / len(peaks), max(peaks))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--updates', type=int, default=500)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--keys', type=int, default=32)
+    ap.add_argument('--samples', type=int, default=256)
+    ap.add_argument('--kv-updates', type=int, default=1000)
+    ap.add_argument('--out', default=None)
+    args = ap.parse_args()
+    texts = topics(args.updates, random.Random(args.seed))
+    root = displayio.Group()
+    scenarios = []
+
+    # CellGrid sized like the one pane layout (16x6 at scale 3)
+    grid = CellGrid(16, 6, 8, 16, 3, 0xefef00)
+    root.append(grid.group)
+    changed = [0]
+
+    def grid_update(txt):
+        changed[0] += grid.set_lines(txt, wrap_offsets(txt, 16, 'pre'))
+
+    scenarios.append(('cellgrid', grid_update))
+
+    # The real Label, set up the way CharDisplay used to
+    label = None
+    if os.path.isdir(LABEL_LIB):
+        sys.path.insert(0, LABEL_LIB)
+        from adafruit_display_text import label
+    if label is not None:
+        lbl = label.Label(font=terminalio.FONT, scale=3, color=0xefef00)
+        lbl.anchor_point = (0, 0)
+        lbl.anchored_position = (8, 16)
+        lbl.line_spacing = 1.0
+        root.append(lbl)
+
+        def label_update(txt):
+            lbl.text = txt
+
+        scenarios.append(('label', label_update))
+    else:
+        print('label: skipped (install the real library in %s)' % LABEL_LIB)
+
+    rows = []
+    for (name, update) in scenarios:
+        update(texts[0])    # warm up, so both start from a drawn topic
+        changed[0] = 0
+        (us, peak_avg, peak_max) = run(update, texts[1:])
+        if name == 'cellgrid':
+            cells = changed[0] / (len(texts) - 1)
+        rows.append({
+            'scenario': 'topic/' + name,
+            'updates': len(texts) - 1,
+            'update_us': us,
+            'peak_avg_bytes': peak_avg,
+            'peak_max_bytes': peak_max,
+        })
+    print_table(rows, ('scenario', 'updates', 'update_us', 'peak_avg_bytes',
+        'peak_max_bytes'))
+    print('cellgrid: %.1f cells written per update (of 96)' % cells)
+
+    # Dashboard with lots of keys and enough updates to wrap the rings
+    store = SeriesStore(max_keys=args.keys, samples=args.samples)
+    kv = KVPane(TFTBackend(), 8, 16, 304, 224, 0xefef00, args.keys)
+    root.append(kv.group)
+    kv_texts = kv_topics(args.kv_updates, args.keys, random.Random(args.seed))
+    columns = [0]
+
+    def kv_update(txt):
+        store.scan(txt)
+        columns[0] += kv.show(store, txt)
+
+    tracemalloc.start()
+    kv_update(kv_texts[0])
+    columns[0] = 0
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    (us, peak_avg, peak_max) = run(kv_update, kv_texts[1:])
+    gc.collect()
+    growth = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    kv_rows = [{
+        'scenario': 'kv/%dkeys' % args.keys,
+        'updates': len(kv_texts) - 1,
+        'update_us': us,
+        'peak_avg_bytes': peak_avg,
+        'peak_max_bytes': peak_max,
+        'columns': columns[0] / (len(kv_texts) - 1),
+        'growth_bytes': growth,
+    }]
+    print_table(kv_rows, ('scenario', 'updates', 'update_us',
+        'peak_avg_bytes', 'columns', 'growth_bytes'))
+    print('kv: %d sparklines of %d columns on screen, %d samples per key'
+        % (len(kv.lines), kv.lines[0].width, args.samples))
+    kv_rows.append(kv_panes(100, random.Random(args.seed)))
+    print('kv: two panes with the same keys use %(slots)d slots, '
+        '%(failures)d of %(updates)d updates mixed them up' % kv_rows[-1])
+    kv_rows.append(kv_rotate(1000, random.Random(args.seed)))
+    print('kv: %(keys)d keys through %(slots)d slots, %(reused)d reused, '
+        '%(dropped)d dropped, %(failures)d of %(updates)d updates wrong'
+        % kv_rows[-1])
+    backend_rows = backends(texts)
+    print_table(backend_rows, ('scenario', 'updates', 'update_us',
+        'bus_bytes', 'bus_ms', 'full_bytes', 'full_ms'))
+    (first, updates) = patch_topics(args.updates, random.Random(args.seed))
+    patch_rows = patches(first, updates)
+    print_table(patch_rows, ('scenario', 'updates', 'update_us',
+        'wire_bytes', 'final_ok'))
+    write_results('display', rows + kv_rows + backend_rows + patch_rows,
+        *([args.out] if args.out else []))
+    return 1 if any(r.get('failures') for r in kv_rows) else 0
+
+
+def backends(texts):
+    # Play texts through a CharDisplay on each backend and return result
+    # rows with the bus traffic per update
+    os.environ['HOST_SPI_SLEEP'] = '0'
+    lcd = Character_LCD_I2C(board.I2C(), 20, 4)
+    term = TermBackend(40, 12)
+    tft = TFTBackend()
+    # Bytes and seconds sent so far, and for a rewrite of every cell: the
+    # whole screen for the TFT, or a cursor move plus each character of
+    # every row for the text displays
+    px = tft.display.width * tft.display.height * 2 + 12
+    bus = [
+        ('tft', tft, lambda: (tft.display.spi_bytes, tft.display.spi_time),
+            px, px * 8 / tft.display.bus.baudrate),
+        ('charlcd', CharLCDBackend(lcd, 20, 4),
+            lambda: (lcd.bytes_sent, lcd.bus_time),
+            4 * 21, 4 * 21 * BYTE_S),
+        ('term', term, lambda: (term.bytes, 0.0), 12 * (8 + 40), 0.0),
+    ]
+    rows = []
+    for (name, backend, sent, full_bytes, full_s) in bus:
+        # CharDisplay prints each topic and slow refresh, so keep that quiet
+        with contextlib.redirect_stdout(io.StringIO()):
+            cd = CharDisplay(backend=backend)
+            cd.set_topic(texts[0], wrap='pre')     # warm up
+            (b0, s0) = sent()
+            t0 = time.perf_counter()
+            for txt in texts[1:]:
+                cd.set_topic(txt, wrap='pre')
+            secs = time.perf_counter() - t0
+            (b1, s1) = sent()
+        n = len(texts) - 1
+        rows.append({
+            'scenario': 'backend/' + name,
+            'updates': n,
+            'update_us': secs / n * 1e6,
+            'bus_bytes': (b1 - b0) / n,
+            'bus_ms': (s1 - s0) / n * 1000,
+            'full_bytes': full_bytes,
+            'full_ms': full_s * 1000,
+        })
+    return rows
+
+
+if __name__ == '__main__':
+    sys.exit(main())
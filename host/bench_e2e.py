@@ -0,0 +1,317 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# End-to-end load and failure benchmark. See the "Benchmarks" section of
+# README.md.
+#
+# Usage: PYTHONPATH=host python3 host/bench_e2e.py [options]
+#
+# This runs code.py against the stand-in IRC server in ircd.py on
+# 127.0.0.1:6667 (so nothing else can be using that port), with a fresh bot
+# for each scenario:
+#
+# - storm: topic changes at each --storm-rates rate for --storm-s seconds.
+#   Reports percentiles of topic-to-render latency: the time from the server
+#   sending a TOPIC to the end of the first display refresh that started
+#   after it, from the host display's HOST_REFRESH_LOG.
+# - flood: PRIVMSGs to the bot's channel at rates that double from
+#   --flood-start, --flood-s seconds each, until the bot can't keep up. A
+#   rate counts as sustainable if the server could send at that rate (TCP
+#   backpressure slows it down when the bot falls behind), the bot's `!stats`
+#   line counter shows it handled every line, and the `!stats` reply after
+#   the flood comes back within a second.
+# - nick: the server refuses the bot's nick with 433 once.
+# - dead: the server goes silent, like a dead link, so the bot has to notice
+#   from its keepalive PINGs.
+# - drop: the server drops the connection with a TCP reset.
+# - outage: the server goes down for --outage-s seconds, refusing
+#   connections, then comes back up.
+# - failover: the same outage with a backup server on 127.0.0.1:6668 in
+#   IRC_SERVERS. failover-hang is the same, but the primary doesn't answer
+#   connection attempts at all while it's down, like a host that's off the
+#   network.
+#
+# For the failure scenarios, it reports how long the bot took to notice
+# (dead only), to join again (on any server), and to render the new topic it
+# gets on the new connection. For the outages, it also reports how long the
+# bot took to join the primary again after it came back up. Results get
+# appended to build/bench.jsonl, and each scenario is compared with its last
+# earlier result there.
+#
+import argparse
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from bench_util import (Bot, percentile, previous_results, print_compare,
+    print_table, render_ms, write_results)
+from ircd import IRCServer
+
+
+CHAN = '#sensors'
+FLOOD_LINE = b':hub!u@h PRIVMSG #sensors :temp 21.5C hum 40% co2 612ppm\r\n'
+
+
+def start(srv, topic):
+    # Start a bot with topic waiting for it. Returns the bot once it's
+    # joined and settled.
+    srv.topics[CHAN] = topic
+    bot = Bot()
+    if not srv.wait(lambda: CHAN in srv.chans, 20):
+        bot.stop()
+        raise TimeoutError('bot never joined')
+    srv.poll(time.monotonic() + 1.5)
+    return bot
+
+
+def storm(srv, args):
+    bot = start(srv, 'temp 20.0C')
+    sent = {}
+    n = 0
+    try:
+        for rate in args.storm_rates:
+            times = sent[rate] = []
+            t0 = time.monotonic()
+            while (now := time.monotonic()) < t0 + args.storm_s:
+                n += 1
+                times.append(now)
+                srv.topic(CHAN, 'temp %d.%dC n%d' % (20 + n % 10, n % 10, n))
+                srv.poll(t0 + len(times) / rate)
+            srv.poll(time.monotonic() + 1)
+    finally:
+        refreshes = bot.stop()
+    rows = []
+    for rate in args.storm_rates:
+        times = sent[rate]
+        lat = render_ms(times, refreshes)
+        rows.append({
+            'scenario': 'e2e/storm/%d' % rate,
+            'topics': len(times),
+            'renders': len([r for r in refreshes
+                if times[0] <= r[0] <= times[-1] + 1]),
+            'p50_ms': percentile(lat, 50),
+            'p90_ms': percentile(lat, 90),
+            'p99_ms': percentile(lat, 99),
+            'max_ms': percentile(lat, 100),
+            'final_ms': lat[-1] if lat else -1.0,
+        })
+    return rows
+
+
+def flood(srv, args):
+    bot = start(srv, 'temp 20.0C')
+    rows = []
+    try:
+        # One `!stats` per step, so its replies stay within the bot's flood
+        # control (a burst of 5, then one per 2 seconds)
+        if (before := srv.stats(CHAN)) is None:
+            raise TimeoutError('no !stats reply')
+        rate = args.flood_start
+        while rate <= args.flood_max:
+            t0 = time.monotonic()
+            sent = 0
+            while (now := time.monotonic()) < t0 + args.flood_s:
+                # Send in 10 ms ticks, catching up if the last send blocked
+                if (n := int((now - t0) * rate) - sent) > 0:
+                    srv.send(FLOOD_LINE * n)
+                    sent += n
+                srv.poll(now + 0.01)
+            elapsed = time.monotonic() - t0
+            asked = time.monotonic()
+            if (after := srv.stats(CHAN, 30)) is None:
+                lag = handled = -1
+                lines_per_s = -1.0
+            else:
+                lag = (after['at'] - asked) * 1000
+                # The `!stats` line counts too
+                handled = after['lines'] - before['lines'] - 1
+                lines_per_s = handled / (after['at'] - t0)
+            ok = (sent >= 0.95 * rate * elapsed and handled >= sent
+                and 0 <= lag < 1000)
+            rows.append({
+                'scenario': 'e2e/flood/%d' % rate,
+                'rate': rate,
+                'sent_per_s': sent / elapsed,
+                'handled': handled,
+                'lines_per_s': lines_per_s,
+                'lag_ms': lag,
+                'ok': ok,
+            })
+            if not ok:
+                break
+            before = after
+            rate *= 2
+    finally:
+        bot.stop()
+    good = [r['rate'] for r in rows if r['ok']]
+    rows.append({
+        'scenario': 'e2e/flood',
+        'rate': max(good) if good else 0,
+        'sent_per_s': max(r['sent_per_s'] for r in rows),
+        'handled': sum(max(r['handled'], 0) for r in rows),
+        'lines_per_s': max(r['lines_per_s'] for r in rows),
+        'lag_ms': max(r['lag_ms'] for r in rows),
+        'ok': bool(good),
+    })
+    return rows
+
+
+def recovery(srv, name):
+    # Run one failure scenario and return its result row
+    bot = start(srv, 'temp 20.0C')
+    detect = -1.0
+    try:
+        if name == 'nick':
+            # Make the next connection hit 433, then hang up on this one so
+            # the bot reconnects right into it
+            srv.nick_in_use = 1
+            srv.drop()
+            if not srv.wait(lambda: srv.refused_at > srv.connected_at, 20):
+                raise TimeoutError('bot never reconnected')
+            fault = srv.refused_at
+        elif name == 'dead':
+            fault = time.monotonic()
+            srv.silent = True
+            if not srv.wait(lambda: srv.closed_at > fault, 90):
+                raise TimeoutError('bot never noticed the dead link')
+            detect = srv.closed_at - fault
+        else:
+            fault = time.monotonic()
+            srv.drop()
+        srv.topics[CHAN] = 'temp 21.0C after %s' % name
+        if not srv.wait(lambda: srv.joined_at > fault and CHAN in srv.chans,
+                300):
+            raise TimeoutError('bot never joined again')
+        joined = srv.joined_at
+        srv.poll(time.monotonic() + 1.5)
+    finally:
+        refreshes = bot.stop()
+    lat = render_ms([joined], refreshes)
+    return {
+        'scenario': 'e2e/%s' % name,
+        'detect_s': detect,
+        'join_s': joined - fault,
+        'render_s': (joined - fault + lat[0] / 1000) if lat else -1.0,
+        'connects': srv.connects,
+    }
+
+
+def outage(srv, name, args):
+    # Take the primary down for args.outage_s seconds and return a result
+    # row. With a backup, the bot should move to it right away, then move
+    # back once the primary is up again.
+    backup = None
+    env = {}
+    if name != 'outage':
+        backup = IRCServer(port=6668, name='backup.local')
+        backup.topics[CHAN] = 'temp 21.0C on backup'
+        env['IRC_SERVERS'] = '127.0.0.1:6667,127.0.0.1:6668'
+    both = [s for s in (srv, backup) if s is not None]
+
+    def wait(cond, timeout):
+        # Like IRCServer.wait(), but for both servers
+        end = time.monotonic() + timeout
+        while not cond():
+            if time.monotonic() >= end:
+                return False
+            for s in both:
+                if s.connected:
+                    s.poll(time.monotonic() + 0.02)
+                else:
+                    s.accept(0.02)
+        return True
+
+    srv.topics[CHAN] = 'temp 20.0C'
+    bot = Bot(**env)
+    try:
+        if not wait(lambda: CHAN in srv.chans, 20):
+            raise TimeoutError('bot never joined')
+        wait(lambda: False, 1.5)
+        fault = time.monotonic()
+        srv.down(hang=name.endswith('-hang'))
+        srv.topics[CHAN] = 'temp 21.0C after %s' % name
+        joined = fault + 300
+        if backup is not None:
+            if not wait(lambda: CHAN in backup.chans, 60):
+                raise TimeoutError('bot never joined the backup')
+            joined = backup.joined_at
+        wait(lambda: False, fault + args.outage_s - time.monotonic())
+        restored = time.monotonic()
+        srv.up()
+        if not wait(lambda: CHAN in srv.chans, 300):
+            raise TimeoutError('bot never joined the primary again')
+        back = srv.joined_at
+        joined = min(joined, back)
+        wait(lambda: False, 1.5)
+    finally:
+        refreshes = bot.stop()
+        if backup is not None:
+            backup.close()
+            backup.lsock.close()
+    lat = render_ms([joined], refreshes)
+    return {
+        'scenario': 'e2e/%s' % name,
+        'detect_s': -1.0,
+        'join_s': joined - fault,
+        'render_s': (joined - fault + lat[0] / 1000) if lat else -1.0,
+        'connects': srv.connects + (backup.connects if backup else 0),
+        'back_s': back - restored,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--scenarios',
+        default='storm,flood,nick,dead,drop,outage,failover,failover-hang')
+    ap.add_argument('--storm-rates', default='10,50,200',
+        help='topic changes per second (comma separated)')
+    ap.add_argument('--storm-s', type=float, default=5)
+    ap.add_argument('--flood-start', type=int, default=1000,
+        help='first PRIVMSG rate in lines per second')
+    ap.add_argument('--flood-max', type=int, default=512000)
+    ap.add_argument('--flood-s', type=float, default=2)
+    ap.add_argument('--outage-s', type=float, default=30,
+        help='how long the primary server stays down')
+    ap.add_argument('--out', default=None)
+    args = ap.parse_args()
+    args.storm_rates = [int(r) for r in args.storm_rates.split(',')]
+    out = [args.out] if args.out else []
+    before = previous_results('e2e', *out)
+    srv = IRCServer()
+    storm_rows = []
+    flood_rows = []
+    rec_rows = []
+    for name in args.scenarios.split(','):
+        print('e2e: running %s...' % name)
+        srv.connects = 0
+        if name == 'storm':
+            storm_rows = storm(srv, args)
+        elif name == 'flood':
+            flood_rows = flood(srv, args)
+        elif name.startswith(('outage', 'failover')):
+            rec_rows.append(outage(srv, name, args))
+        else:
+            rec_rows.append(recovery(srv, name))
+        srv.close()
+    if storm_rows:
+        print_table(storm_rows, ('scenario', 'topics', 'renders', 'p50_ms',
+            'p90_ms', 'p99_ms', 'max_ms', 'final_ms'))
+    if flood_rows:
+        print_table(flood_rows, ('scenario', 'rate', 'sent_per_s', 'handled',
+            'lines_per_s', 'lag_ms', 'ok'))
+    if rec_rows:
+        for row in rec_rows:
+            row.setdefault('back_s', -1.0)
+        print_table(rec_rows, ('scenario', 'detect_s', 'join_s', 'render_s',
+            'back_s', 'connects'))
+    rows = storm_rows + flood_rows + rec_rows
+    print_compare(storm_rows, before, ('p50_ms', 'p99_ms'))
+    print_compare([r for r in flood_rows if r['scenario'] == 'e2e/flood'],
+        before, ('rate', 'lines_per_s'))
+    print_compare(rec_rows, before, ('join_s', 'render_s', 'back_s'))
+    write_results('e2e', rows, *out)
+
+
+if __name__ == '__main__':
+    main()
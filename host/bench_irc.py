@@ -0,0 +1,427 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Benchmark and fuzz suite for IRC line framing and parsing in sb_ircbot.
+# See the "Benchmarks" section of README.md.
+#
+# Usage: PYTHONPATH=host python3 host/bench_irc.py [options]
+#
+# This feeds a FakeSocket to IRCBot with various chunking patterns and
+# reports lines/sec, bytes/sec, and peak traced memory for each scenario. It
+# also compares IRCMessage.parse() against the old regex parser, and the
+# dispatch table against the old if/elif chain in code.py. The filter
+# scenarios run the whole receive path (framing, parse, decode, dispatch)
+# over a busy channel with the pre-filter off and on. It checks that the
+# heap doesn't grow with the number of lines received once the bot has
+# warmed up, and it fuzzes the framing with random lines and chunk sizes to
+# check for lost or corrupted lines. The tx scenarios flood the bot with
+# requests that each queue a reply, to check that the outbound queue merges
+# writes, applies flood control, and stays within its buffer when the link
+# is backed up. Results get appended to build/bench.jsonl.
+#
+# With --capture FILE, the benchmarks use the lines from an sb_capture
+# recording (e.g. a real ngircd session) instead of synthetic traffic, and
+# there is an extra framing scenario that uses the captured chunk sizes.
+#
+import argparse
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, '.')
+
+from bench_util import FakeSocket, measure, print_table, write_results
+from sb_capture import read_capture
+import sb_ircbot
+from sb_ircbot import (IRCBot, CMD_JOIN, CMD_PING, CMD_TOPIC,
+    ERR_NICKNAMEINUSE, RPL_TOPIC)
+from sb_stats import stats, CNT_TX_DROPS
+
+
+def session(n, rng, nick=b'tftbot', chan=b'#sensors'):
+    # Make n lines of ngircd-like traffic: registration numerics, MOTD, join
+    # burst, then channel chatter with the occasional topic change and PING
+    out = [
+        b':irc.local 001 %s :Welcome to the Internet Relay Network' % nick,
+        b':irc.local 002 %s :Your host is irc.local' % nick,
+        b':irc.local 003 %s :This server has been started today' % nick,
+        b':irc.local 004 %s irc.local ngircd-26 abBcCFiIoqrRswx abehiIklm'
+            % nick,
+        b':irc.local 005 %s CHANTYPES=#&+ PREFIX=(qaohv)~&@%%+ :are supported'
+            % nick,
+        b':irc.local 375 %s :- irc.local message of the day' % nick,
+    ]
+    out += [b':irc.local 372 %s :- %s' % (nick, b'x' * rng.randint(10, 70))
+        for _ in range(20)]
+    out += [
+        b':irc.local 376 %s :End of MOTD command' % nick,
+        b':%s!~%s@10.0.0.5 JOIN :%s' % (nick, nick, chan),
+        b':irc.local 353 %s = %s :%s @hub' % (nick, chan, nick),
+        b':irc.local 366 %s %s :End of NAMES list' % (nick, chan),
+        b':irc.local 332 %s %s :!pre /temp 21.5C/hum 40%%' % (nick, chan),
+        b':irc.local 333 %s %s hub 1760000000' % (nick, chan),
+    ]
+    while len(out) < n:
+        r = rng.random()
+        if r < 0.05:
+            out.append(b':hub!~hub@10.0.0.7 TOPIC %s :!pre /temp %d.%dC'
+                b'/hum %d%%' % (chan, rng.randint(15, 30), rng.randint(0, 9),
+                rng.randint(20, 70)))
+        elif r < 0.07:
+            out.append(b'PING :irc.local')
+        elif r < 0.10:
+            who = b'user%d' % rng.randint(1, 50)
+            verb = b'JOIN' if rng.random() < 0.5 else b'PART'
+            out.append(b':%s!~%s@10.0.0.9 %s %s' % (who, who, verb, chan))
+        else:
+            who = b'user%d' % rng.randint(1, 50)
+            out.append(b':%s!~%s@10.0.0.9 PRIVMSG %s :%s' % (who, who, chan,
+                b' '.join(b'w' * rng.randint(1, 8)
+                for _ in range(rng.randint(1, 20)))))
+    return out[:n]
+
+
+def make_bot(data, chunks):
+    bot = IRCBot('tftbot', '#sensors', '127.0.0.1')
+    bot.sock = FakeSocket(data, chunks)
+    bot.connected = True
+    return bot
+
+
+def frame_all(bot, keep=None):
+    # Pull every line through the framing layer. Returns (lines, bytes). If
+    # keep is a list, copies of the lines get appended to it.
+    lines = 0
+    nbytes = 0
+    while True:
+        while bot._frame():
+            lines += 1
+            nbytes += bot._line_end - bot._line_start
+            if keep is not None:
+                keep.append(bytes(bot.rx_mv[bot._line_start:bot._line_end]))
+        if bot._recv(1) == 0:
+            return (lines, nbytes)
+
+
+def bench_framing(lines, rng, capture=None):
+    data = b''.join(s + b'\r\n' for s in lines)
+    long_data = b''.join(b'L' * rng.randint(600, 1000) + b'\r\n'
+        for _ in range(len(lines) // 10))
+    short_data = b''.join(b'PING :%d\r\n' % i for i in range(len(lines)))
+    rand_chunks = [rng.randint(1, 1460) for _ in range(997)]
+    scenarios = [
+        ('chunk_1', data, 1),
+        ('chunk_7', data, 7),
+        ('chunk_64', data, 64),
+        ('chunk_536', data, 536),
+        ('chunk_1460', data, 1460),
+        ('chunk_random', data, rand_chunks),
+        ('long_lines', long_data, 1460),
+        ('many_per_packet', short_data, 1460),
+    ]
+    if capture:
+        # Replay the captured bytes with their original chunking
+        chunks = [len(d) for (_, d) in capture if d]
+        scenarios.append(('capture', b''.join(d for (_, d) in capture),
+            chunks))
+    rows = []
+    for (name, payload, chunks) in scenarios:
+        bot = make_bot(payload, chunks)
+        ((n, nbytes), secs, peak) = measure(frame_all, bot)
+        rows.append({
+            'scenario': 'framing/' + name,
+            'lines': n,
+            'lines_per_s': n / secs,
+            'bytes_per_s': len(payload) / secs,
+            'peak_bytes': peak,
+        })
+    return rows
+
+
+def bench_parse(lines):
+    # Compare the old decode + regex path against IRCMessage.parse()
+    irc_re = re.compile(
+        r'^((:\S+)\s+)?'      # optional prefix   (match group 2)
+        r'(\S+)\s*'           # command or number (match group 3)
+        r'(.*)'               # params            (match group 4)
+    )
+
+    def regex_path():
+        for s in lines:
+            m = irc_re.match(str(s, 'utf-8'))
+            (m.group(2), m.group(3), m.group(4))
+
+    msg = make_bot(b'', 1).msg
+
+    def parser_path():
+        for s in lines:
+            msg.parse(s).cmd
+
+    rows = []
+    for (name, fn) in (('regex', regex_path), ('parser', parser_path)):
+        (_, secs, peak) = measure(fn)
+        rows.append({
+            'scenario': 'parse/' + name,
+            'lines': len(lines),
+            'lines_per_s': len(lines) / secs,
+            'bytes_per_s': sum(len(s) for s in lines) / secs,
+            'peak_bytes': peak,
+        })
+    return rows
+
+
+def bench_dispatch(lines, repeat=9):
+    # Compare the if/elif chain from code.py network_task() just before the
+    # dispatch table went in (copied below with only the actions swapped
+    # out) against the bot's dispatch table. The actions are the same on
+    # both sides: PING queues a PONG, and our JOIN and topics for our
+    # channel call a no-op, so this measures routing and matching.
+    #
+    # Each path gets timed repeat times, alternating between them so any
+    # slowdown on the host hits both, and the best time counts. A single
+    # traced run gives the peak memory. Profiling spans are off, like in a
+    # bundle built with `profile: no`, since the chain never had one.
+    profile = sb_ircbot._PROFILE
+    sb_ircbot._PROFILE = 0
+    nick = 'tftbot'
+    chan = '#sensors'
+    bot = make_bot(b'', 1)
+    bot.send = lambda msg: True
+    bot.on(ERR_NICKNAMEINUSE, lambda msg: None)
+    bot.on_join(lambda chan: None)
+    bot.on_topic(lambda i, text: None)
+    msg = bot.msg
+    status = show_topic = lambda text: None
+
+    def chain_path():
+        for s in lines:
+            msg.parse(s)
+            cmd = msg.cmd
+            if cmd == ERR_NICKNAMEINUSE:
+                # - 433 * <nick> :Nickname already in use
+                status('IRC: Nick in use')
+            elif cmd == CMD_PING:
+                bot.send('PONG %s\r\n' % msg.params())
+            elif cmd == CMD_JOIN:
+                my_nick = (':%s!' % nick).encode()
+                if msg.prefix_startswith(my_nick):
+                    status(msg.params(1))
+            elif cmd == RPL_TOPIC:
+                nickchan = ('%s %s :' % (nick, chan)).encode()
+                if msg.params_startswith(nickchan):
+                    show_topic(msg.params(len(nickchan)))
+            elif cmd == CMD_TOPIC:
+                key = ('%s :' % chan).encode()
+                if msg.params_startswith(key):
+                    show_topic(msg.params(len(key)))
+
+    def table_path():
+        for s in lines:
+            bot.dispatch(msg.parse(s))
+
+    paths = (('chain', chain_path), ('table', table_path))
+    best = {}
+    for _ in range(repeat):
+        for (name, fn) in paths:
+            t0 = time.perf_counter()
+            fn()
+            secs = time.perf_counter() - t0
+            best[name] = min(secs, best.get(name, secs))
+    rows = []
+    for (name, fn) in paths:
+        (_, _, peak) = measure(fn)
+        rows.append({
+            'scenario': 'dispatch/' + name,
+            'lines': len(lines),
+            'lines_per_s': len(lines) / best[name],
+            'bytes_per_s': sum(len(s) for s in lines) / best[name],
+            'peak_bytes': peak,
+        })
+    sb_ircbot._PROFILE = profile
+    return rows
+
+
+def bench_filter(lines):
+    # Replay the traffic as fast as the bot can take it: decode each line
+    # that gets through (like the old per-line debug print), then dispatch.
+    # The handlers are the ones code.py registers, including on_stats(), so
+    # PRIVMSGs get through the filter only if they are stats requests. With
+    # the filter on, chatter gets dropped before the decode.
+    data = b''.join(s + b'\r\n' for s in lines)
+
+    def receive(bot):
+        n = 0
+        while True:
+            while (msg := bot._parse_next()) is not None:
+                n += 1
+                (msg.command(), msg.params())
+                bot.dispatch(msg)
+            if bot._recv(1) == 0:
+                return n
+
+    rows = []
+    for (name, on) in (('off', False), ('on', True)):
+        bot = make_bot(data, 1460)
+        bot.send = lambda msg: True
+        bot.on(ERR_NICKNAMEINUSE, lambda msg: None)
+        bot.on_join(lambda chan: None)
+        bot.on_topic(lambda i, text: None)
+        bot.on_stats(lambda: 'stats')
+        bot.filter = on
+        (n, secs, peak) = measure(receive, bot)
+        rows.append({
+            'scenario': 'filter/' + name,
+            'lines': len(lines),
+            'lines_per_s': len(lines) / secs,
+            'bytes_per_s': len(data) / secs,
+            'peak_bytes': peak,
+            'passed': n,
+            'dropped': sum(bot.drops.values()),
+        })
+    return rows
+
+
+def bench_tx(n):
+    # Flood the bot with n requests that each queue a reply: `!stats` in the
+    # channel with a link that keeps up, and server PINGs with a link whose
+    # send buffer is full. Reports socket writes, replies that made it out
+    # during the burst, replies dropped at the tx_buf cap, and peak traced
+    # memory.
+    summary = 'x' * 200
+    floods = (
+        ('stats', None, b':hub!~u@h PRIVMSG #sensors :!stats\r\n'),
+        ('stalled', 0, b'PING :irc.local\r\n'),
+    )
+    rows = []
+    for (name, limit, line) in floods:
+        bot = make_bot(line * n, 1460)
+        bot.filter = True       # like AsyncIRCBot in code.py
+        bot.registered = True
+        bot.sock.send_limit = limit
+        bot.on_stats(lambda: summary)
+        drops = stats.counts[CNT_TX_DROPS]
+
+        def receive(bot):
+            while True:
+                while (msg := bot._parse_next()) is not None:
+                    bot.dispatch(msg)
+                if bot._recv(0) == 0:
+                    return
+
+        (_, secs, peak) = measure(receive, bot)
+        rows.append({
+            'scenario': 'tx/' + name,
+            'requests': n,
+            'writes': bot.sock.writes,
+            'replies_sent': bot.sock.sent.count(b'\r\n'),
+            'dropped': stats.counts[CNT_TX_DROPS] - drops,
+            'queued_bytes': bot._tx_end - bot._tx_start,
+            'peak_bytes': peak,
+        })
+    return rows
+
+
+def check_alloc(lines, n=5000, slack=256):
+    # Once it has warmed up, the receive path should not allocate anything
+    # that outlives a line. Feed the bot a warm-up batch, then n and 2n more
+    # lines, and check that the traced heap grows by no more than slack
+    # bytes over each batch. (A few ints for counters and offsets can't be
+    # helped on CPython, but a leak of even one object per line would show
+    # up as tens of KB.) framing only runs _frame(), and parse also runs the
+    # parser and the pre-filter.
+    lines = lines * (1 + 2 * n // len(lines))
+    batches = [b''.join(s + b'\r\n' for s in lines[:k])
+        for k in (n, n, 2 * n)]
+    rows = []
+    for (name, step) in (('framing', '_frame'), ('parse', '_parse_next')):
+        bot = make_bot(b'', 1)
+        bot.filter = name == 'parse'
+        step = getattr(bot, step)
+        grew = []
+        tracemalloc.start()
+        for data in batches:
+            bot.sock = FakeSocket(data, (1460, 536, 97))
+            before = tracemalloc.get_traced_memory()[0]
+            while True:
+                while step():
+                    pass
+                if bot._recv(0) == 0:
+                    break
+            grew.append(tracemalloc.get_traced_memory()[0] - before)
+        tracemalloc.stop()
+        rows.append({
+            'scenario': 'alloc/' + name,
+            'lines': 4 * n,
+            'grew_n': grew[1],
+            'grew_2n': grew[2],
+            'failures': int(max(grew[1:]) > slack),
+        })
+    return rows
+
+
+def fuzz_framing(iterations, rng, max_line=512):
+    # Property: for any lines without an embedded CRLF and any chunking, the
+    # framing layer returns every line, in order, truncated to max_line
+    alphabet = b'ab :#!\r\n\t\x00\xff'
+    failures = 0
+    for i in range(iterations):
+        lines = []
+        for _ in range(rng.randint(1, 40)):
+            size = rng.choice((0, 1, 2, 50, 509, 510, 511, 512, 513,
+                rng.randint(0, 1200)))
+            s = bytes(rng.choice(alphabet) for _ in range(size))
+            while b'\r\n' in s:
+                s = s.replace(b'\r\n', b'\n\r')
+            lines.append(s)
+        data = b''.join(s + b'\r\n' for s in lines)
+        chunks = [rng.randint(1, 1500) for _ in range(rng.randint(1, 8))]
+        got = []
+        frame_all(make_bot(data, chunks), keep=got)
+        want = [s[:max_line] for s in lines]
+        if got != want:
+            failures += 1
+            print('FUZZ FAIL: iteration %d, chunks=%s' % (i, chunks))
+    return [{
+        'scenario': 'fuzz/framing',
+        'iterations': iterations,
+        'failures': failures,
+    }]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--lines', type=int, default=20000)
+    ap.add_argument('--fuzz', type=int, default=300)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--capture', default=None)
+    ap.add_argument('--out', default=None)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    capture = None
+    if args.capture:
+        capture = read_capture(args.capture)
+        lines = [s for s in b''.join(d for (_, d) in capture).split(b'\r\n')
+            if s]
+    else:
+        lines = session(args.lines, rng)
+    rows = (bench_framing(lines, rng, capture) + bench_parse(lines)
+        + bench_dispatch(lines) + bench_filter(lines))
+    print_table(rows, ('scenario', 'lines', 'lines_per_s', 'bytes_per_s',
+        'peak_bytes'))
+    tx = bench_tx(200)
+    print_table(tx, ('scenario', 'requests', 'writes', 'replies_sent',
+        'dropped', 'queued_bytes', 'peak_bytes'))
+    alloc = check_alloc(lines)
+    print_table(alloc, ('scenario', 'lines', 'grew_n', 'grew_2n',
+        'failures'))
+    fuzz = fuzz_framing(args.fuzz, rng)
+    print('fuzz: %(iterations)d iterations, %(failures)d failures' % fuzz[0])
+    write_results('irc', rows + tx + alloc + fuzz,
+        *([args.out] if args.out else []))
+    return 1 if any(r['failures'] for r in alloc + fuzz) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
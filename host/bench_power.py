@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Benchmark for the power policies in sb_power. See the "Benchmarks" section
+# of README.md.
+#
+# Usage: PYTHONPATH=host python3 host/bench_power.py [options]
+#
+# For each policy, with and without the touch controller (which has to be
+# polled), this runs code.py against the stand-in IRC server in ircd.py on
+# 127.0.0.1:6667 (so nothing else can be using that port). After the bot
+# joins, the server changes the topic at random intervals, the way a sensor
+# bot on a quiet channel would, and answers the bot's keepalive PINGs. It
+# asks for `!stats` at the start and end of the run to get the number of idle
+# wakeups (socket waits that ended without data) and clock boosts. Latency is
+# the time from the server sending a TOPIC to the end of the first display
+# refresh that started after that, taken from the HOST_REFRESH_LOG of the
+# host display. Results get appended to build/bench.jsonl.
+#
+# The host can't change its CPU clock, so this measures how the policies
+# schedule work, not how much faster a boosted ESP32-S3 renders.
+#
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from bench_util import Bot, percentile, print_table, render_ms, write_results
+from ircd import IRCServer
+
+
+CHAN = '#sensors'
+
+
+def run_policy(srv, policy, touch, seconds, gap, rng):
+    # Run the bot with policy for seconds of topic changes. Returns a result
+    # row for the table.
+    srv.topics[CHAN] = 'temp 20.0C'
+    bot = Bot(POWER_POLICY=policy, HOST_TOUCH='' if touch else 'off')
+    sent = []
+    try:
+        if not srv.wait(lambda: CHAN in srv.chans, 20):
+            raise TimeoutError('bot never joined')
+        srv.poll(time.monotonic() + 2)      # let the join settle
+        before = srv.stats(CHAN)
+        t0 = time.monotonic()
+        end = t0 + seconds
+        temp = 200
+        while (now := time.monotonic()) < end:
+            srv.poll(min(end, now + rng.uniform(gap / 2, gap * 3 / 2)))
+            if time.monotonic() >= end:
+                break
+            temp += rng.choice((-1, 1))
+            sent.append(time.monotonic())
+            srv.topic(CHAN, 'temp %d.%dC' % (temp // 10, temp % 10))
+        srv.poll(time.monotonic() + 1)      # let the last refresh finish
+        after = srv.stats(CHAN)
+        elapsed = time.monotonic() - t0
+    finally:
+        refreshes = bot.stop()
+        srv.close()
+    lat = render_ms(sent, refreshes)
+    per_min = 60 / elapsed
+    return {
+        'scenario': 'power/%s%s' % (policy, '/touch' if touch else ''),
+        'seconds': round(elapsed),
+        'topics': len(sent),
+        'wakes_min': (after['wakes'] - before['wakes']) * per_min,
+        'boosts_min': (after['boosts'] - before['boosts']) * per_min,
+        'lat_avg_ms': sum(lat) / len(lat) if lat else -1.0,
+        'lat_p50_ms': percentile(lat, 50),
+        'lat_max_ms': percentile(lat, 100),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--seconds', type=int, default=60,
+        help='length of the topic stream for each policy')
+    ap.add_argument('--gap', type=float, default=5,
+        help='average seconds between topic changes')
+    ap.add_argument('--policies', default='fixed,adaptive')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', default=None)
+    args = ap.parse_args()
+    srv = IRCServer()
+    rows = []
+    for touch in (False, True):
+        for policy in args.policies.split(','):
+            print('power: running %s%s for %ds...' % (policy,
+                ' with touch' if touch else '', args.seconds))
+            rows.append(run_policy(srv, policy, touch, args.seconds,
+                args.gap, random.Random(args.seed)))
+    print_table(rows, ('scenario', 'topics', 'wakes_min', 'boosts_min',
+        'lat_avg_ms', 'lat_p50_ms', 'lat_max_ms'))
+    write_results('power', rows, *([args.out] if args.out else []))
+
+
+if __name__ == '__main__':
+    main()
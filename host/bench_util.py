@@ -0,0 +1,183 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Shared helpers for the host benchmark scripts. See the "Benchmarks" section
+# of README.md.
+#
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from socketpool import EAGAIN, ETIMEDOUT
+
+RESULTS = os.path.join('build', 'bench.jsonl')
+
+
+class FakeSocket:
+    # Socket stand-in that feeds recv_into() from a bytes object, one chunk
+    # at a time. chunks can be an int (fixed chunk size) or a list of chunk
+    # sizes that gets cycled. Once the data runs out, recv_into() raises the
+    # same timeout error as a quiet socket.
+    def __init__(self, data, chunks=1460):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.chunks = [chunks] if isinstance(chunks, int) else list(chunks)
+        self.chunk_i = 0
+        self.timeout = None
+        self.sent = bytearray()
+        self.writes = 0
+        self.send_limit = None  # max bytes per send() (0 = always full)
+
+    def settimeout(self, value):
+        self.timeout = value
+
+    def recv_into(self, buffer, bufsize=0):
+        if self.pos >= len(self.data):
+            raise OSError(EAGAIN if self.timeout == 0 else ETIMEDOUT, 'idle')
+        n = self.chunks[self.chunk_i % len(self.chunks)]
+        self.chunk_i += 1
+        n = min(n, len(buffer), len(self.data) - self.pos)
+        if bufsize:
+            n = min(n, bufsize)
+        buffer[:n] = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def send(self, data):
+        if self.send_limit == 0:
+            raise OSError(EAGAIN, 'send buffer full')
+        n = len(data)
+        if self.send_limit is not None:
+            n = min(n, self.send_limit)
+        self.sent.extend(data[:n])
+        self.writes += 1
+        return n
+
+    def sendall(self, data):
+        self.sent.extend(data)
+
+    def close(self):
+        pass
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+            check=True, capture_output=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'NO_COMMIT'
+
+
+def measure(fn, *args):
+    # Run fn(*args) and return (result, seconds, peak traced bytes)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - t0
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, seconds, peak)
+
+
+def previous_results(bench, path=RESULTS):
+    # Return the latest earlier record for each scenario of bench, keyed by
+    # scenario, so a new run can be compared with the last one
+    out = {}
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                if (rec := json.loads(line)).get('bench') == bench:
+                    out[rec['scenario']] = rec
+    return out
+
+
+def print_compare(rows, before, columns):
+    # Print each row's columns next to the same scenario's previous values
+    print('%-24s %s' % ('compared to last run', '  '.join('%20s' % c
+        for c in columns)))
+    for row in rows:
+        if (old := before.get(row['scenario'])) is None:
+            continue
+        cells = []
+        for c in columns:
+            if isinstance(row.get(c), (int, float)) and c in old:
+                cells.append('%9.1f -> %8.1f' % (old[c], row[c]))
+            else:
+                cells.append('%20s' % '-')
+        print('%-24s %s' % (row['scenario'] + ' @' + old['commit'],
+            '  '.join(cells)))
+
+
+class Bot:
+    # Runs code.py in a subprocess with the host stand-ins, pointed at a
+    # local IRC server, with HOST_REFRESH_LOG going to a temp file. Extra
+    # keyword arguments become environment variables.
+
+    def __init__(self, **env):
+        (fd, self.log_path) = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        full = dict(os.environ, PYTHONPATH='host',
+            HOST_REFRESH_LOG=self.log_path, WIFI_SSID='host',
+            WIFI_PASSWORD='host', IRC_SERVER='127.0.0.1', IRC_NICK='tftbot',
+            IRC_CHAN='#sensors', HOST_TOUCH='off')
+        full.pop('HOST_NVM', None)
+        full.update(env)
+        self.proc = subprocess.Popen([sys.executable, 'code.py'], env=full,
+            stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+    def stop(self):
+        # Stop the bot and return its refreshes as (start, end) pairs
+        self.proc.terminate()
+        self.proc.wait()
+        with open(self.log_path) as f:
+            refreshes = [tuple(float(v) for v in line.split())
+                for line in f if line.strip()]
+        os.unlink(self.log_path)
+        return refreshes
+
+
+def render_ms(sent, refreshes):
+    # For each time in sent, return the milliseconds until the end of the
+    # first refresh that started after it (the first one that could show
+    # what was sent then), skipping any with no refresh after them
+    out = []
+    i = 0
+    for t in sorted(sent):
+        while i < len(refreshes) and refreshes[i][0] < t:
+            i += 1
+        if i < len(refreshes):
+            out.append((refreshes[i][1] - t) * 1000)
+    return out
+
+
+def percentile(values, p):
+    # Nearest rank percentile (p from 0 to 100), or -1 with no values
+    if not values:
+        return -1.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def write_results(bench, rows, path=RESULTS):
+    # Append one JSON record per scenario so runs at different commits can
+    # be compared with `jq` or a few lines of Python
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    commit = git_commit()
+    stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(path, 'a') as f:
+        for row in rows:
+            rec = {'bench': bench, 'commit': commit, 'time': stamp}
+            rec.update(row)
+            f.write(json.dumps(rec) + '\n')
+    print('wrote %d results to %s' % (len(rows), path))
+
+
+def print_table(rows, columns):
+    print('  '.join('%14s' % c for c in columns))
+    for row in rows:
+        print('  '.join(('%14.1f' if isinstance(row[c], float) else '%14s')
+            % row[c] for c in columns))
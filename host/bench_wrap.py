@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Benchmark for topic wrapping in sb_chardisplay. See the "Benchmarks"
+# section of README.md.
+#
+# Usage: PYTHONPATH=host python3 host/bench_wrap.py [options]
+#
+# For topic lengths from 16 characters up to the 512-byte IRC line limit,
+# this times the old nested-find word wrap against wrap_offsets() (uncached)
+# and WrapCache (a repeat topic, like a 332 after a rejoin). Results get
+# appended to build/bench.jsonl.
+#
+import argparse
+import random
+import sys
+import time
+
+sys.path.insert(0, '.')
+
+from bench_util import print_table, write_results
+from sb_chardisplay import WrapCache, join_lines, wrap_offsets
+
+
+def old_word_wrap(text, w):
+    # The word wrap from before wrap_offsets(), kept here as the baseline
+    lines = []
+    start = 0
+    for _ in range(len(text)):
+        space = text.find(' ', start)
+        if len(text) - start <= w:
+            lines.append(text[start:])
+            start = len(text)
+            break
+        elif space == -1 or space - start > w:
+            lines.append(text[start:start+w])
+            start += w
+        else:
+            for _ in range(len(text)):
+                next_space = text.find(' ', space + 1)
+                if next_space == -1:
+                    break
+                elif next_space - start <= w + 1:
+                    space = next_space
+                else:
+                    break
+            lines.append(text[start:space])
+            start = space + 1
+    if start < len(text):
+        lines.append(text[start:])
+    return '\n'.join(lines)
+
+
+def topic(n, rng):
+    words = []
+    while sum(len(w) + 1 for w in words) < n:
+        words.append('%s=%d.%d' % (rng.choice(('temp', 'hum', 'co2', 'lux')),
+            rng.randint(0, 999), rng.randint(0, 9)))
+    return ' '.join(words)[:n]
+
+
+def per_call_us(fn, reps):
+    t0 = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - t0) / reps * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('--reps', type=int, default=2000)
+    ap.add_argument('--width', type=int, default=16)
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', default=None)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    w = args.width
+    rows = []
+    for n in (16, 32, 64, 128, 256, 512):
+        text = topic(n, rng)
+        cache = WrapCache()
+        cache.get(text, w, 'word')
+        rows.append({
+            'scenario': 'wrap/%d' % n,
+            'old_word_us': per_call_us(lambda: old_word_wrap(text, w),
+                args.reps),
+            'word_us': per_call_us(lambda: join_lines(text,
+                wrap_offsets(text, w, 'word')), args.reps),
+            'hard_us': per_call_us(lambda: join_lines(text,
+                wrap_offsets(text, w, 'hard')), args.reps),
+            'cached_us': per_call_us(lambda: join_lines(text,
+                cache.get(text, w, 'word')), args.reps),
+        })
+    print_table(rows, ('scenario', 'old_word_us', 'word_us', 'hard_us',
+        'cached_us'))
+    write_results('wrap', rows, *([args.out] if args.out else []))
+
+
+if __name__ == '__main__':
+    main()
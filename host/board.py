@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython board module. See the "Running on a
+# Linux Host" section of README.md.
+#
+
+board_id = 'host_linux'
+
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'board.%s' % self.name
+
+
+D8 = Pin('D8')
+D9 = Pin('D9')
+D10 = Pin('D10')
+SCL = Pin('SCL')
+SDA = Pin('SDA')
+
+
+class _SPI:
+    def __init__(self):
+        self.frequency = 24_000_000
+
+
+_spi = None
+
+
+def SPI():
+    # Like the real board.SPI(), this returns the same singleton every time
+    global _spi
+    if _spi is None:
+        _spi = _SPI()
+    return _spi
+
+
+class _I2C:
+    def __init__(self):
+        self.frequency = 100_000
+
+
+_i2c = None
+
+
+def I2C():
+    # Like board.SPI(), this returns the same singleton every time
+    global _i2c
+    if _i2c is None:
+        _i2c = _I2C()
+    return _i2c
@@ -0,0 +1,145 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython busdisplay module. See the "Running on
+# a Linux Host" section of README.md.
+#
+# BusDisplay renders its root_group into an in-memory RGB framebuffer on each
+# refresh(). Like the real thing, it only sends the area that changed since
+# the previous refresh. The size of that area, at 16 bits per pixel plus
+# command overhead, gets converted to simulated SPI transfer time using the
+# bus baudrate.
+#
+# Environment variables:
+# - HOST_DISPLAY_PNG: write the framebuffer to this PNG file on each refresh
+# - HOST_DISPLAY_PPM: write the framebuffer to this PPM file on each refresh
+# - HOST_SPI_SLEEP: set to 0 to skip sleeping for the simulated SPI time
+# - HOST_REFRESH_LOG: append the time.monotonic() start and end times of
+#   each refresh (the end is after the simulated SPI time) to this file, one
+#   refresh per line
+#
+from array import array
+import os
+import struct
+import time
+import zlib
+
+import displayio
+
+
+class FrameBuffer:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = array('I', [0]) * (width * height)
+
+    def fill_rect(self, x, y, w, h, color):
+        x0 = max(0, x)
+        y0 = max(0, y)
+        x1 = min(self.width, x + w)
+        y1 = min(self.height, y + h)
+        px = self.pixels
+        for row in range(y0, y1):
+            base = row * self.width
+            for i in range(base + x0, base + x1):
+                px[i] = color
+
+    def rgb_bytes(self):
+        out = bytearray(self.width * self.height * 3)
+        for (i, c) in enumerate(self.pixels):
+            out[i*3] = (c >> 16) & 0xff
+            out[i*3+1] = (c >> 8) & 0xff
+            out[i*3+2] = c & 0xff
+        return out
+
+
+class BusDisplay:
+    def __init__(self, display_bus, init_sequence=b'', *, width, height,
+            rotation=0, auto_refresh=True, **kwargs):
+        self.bus = display_bus
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        self.auto_refresh = auto_refresh
+        self.root_group = None
+        self.fb = FrameBuffer(width, height)
+        # Refresh statistics
+        self.refreshes = 0
+        self.spi_bytes = 0
+        self.spi_time = 0.0      # simulated seconds spent on the SPI bus
+        self.last_area = 0       # pixels sent by the most recent refresh
+        self.png_path = os.getenv('HOST_DISPLAY_PNG')
+        self.ppm_path = os.getenv('HOST_DISPLAY_PPM')
+        self.spi_sleep = os.getenv('HOST_SPI_SLEEP', '1') != '0'
+        self.log_path = os.getenv('HOST_REFRESH_LOG')
+        displayio._displays.append(self)
+
+    def _dirty_area(self, old, new):
+        # Return the pixel count of the bounding box of changed pixels
+        w = self.width
+        rows = [r for r in range(self.height)
+            if old[r*w:(r+1)*w] != new[r*w:(r+1)*w]]
+        if not rows:
+            return 0
+        x0 = w
+        x1 = 0
+        for r in rows:
+            base = r * w
+            for x in range(w):
+                if old[base + x] != new[base + x]:
+                    x0 = min(x0, x)
+                    break
+            for x in range(w - 1, -1, -1):
+                if old[base + x] != new[base + x]:
+                    x1 = max(x1, x + 1)
+                    break
+        return (x1 - x0) * (rows[-1] - rows[0] + 1)
+
+    def refresh(self, *, target_frames_per_second=None,
+            minimum_frames_per_second=0):
+        start = time.monotonic()
+        fb = FrameBuffer(self.width, self.height)
+        if self.root_group is not None:
+            self.root_group._render(fb, 0, 0, 1)
+        area = self._dirty_area(self.fb.pixels, fb.pixels)
+        self.fb = fb
+        # 16 bits per pixel plus about a dozen bytes of CASET/RASET/RAMWR
+        nbytes = (area * 2 + 12) if area else 0
+        seconds = nbytes * 8 / getattr(self.bus, 'baudrate', 24_000_000)
+        self.refreshes += 1
+        self.spi_bytes += nbytes
+        self.spi_time += seconds
+        self.last_area = area
+        if self.spi_sleep and seconds:
+            time.sleep(seconds)
+        if self.png_path:
+            self.save_png(self.png_path)
+        if self.ppm_path:
+            self.save_ppm(self.ppm_path)
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                f.write('%.6f %.6f\n' % (start, time.monotonic()))
+        return True
+
+    def save_ppm(self, path):
+        with open(path, 'wb') as f:
+            f.write(b'P6\n%d %d\n255\n' % (self.width, self.height))
+            f.write(self.fb.rgb_bytes())
+
+    def save_png(self, path):
+        w = self.width
+        rgb = self.fb.rgb_bytes()
+        raw = b''.join(b'\x00' + rgb[r*w*3:(r+1)*w*3]
+            for r in range(self.height))
+
+        def chunk(kind, data):
+            body = kind + data
+            return (struct.pack('>I', len(data)) + body
+                + struct.pack('>I', zlib.crc32(body)))
+
+        with open(path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n')
+            f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', w, self.height,
+                8, 2, 0, 0, 0)))
+            f.write(chunk(b'IDAT', zlib.compress(raw)))
+            f.write(chunk(b'IEND', b''))
@@ -0,0 +1,20 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython digitalio module. See the "Running on
+# a Linux Host" section of README.md.
+#
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+
+    def switch_to_output(self, value=False, **kwargs):
+        self.value = value
+
+    def switch_to_input(self, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
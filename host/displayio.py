@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython displayio module. See the "Running on a
+# Linux Host" section of README.md.
+#
+# This covers the parts of the API that the bot uses: Bitmap, Palette,
+# TileGrid, and Group. Everything that can be shown has a _render() method
+# that draws into a busdisplay.FrameBuffer.
+#
+from array import array
+
+_displays = []
+
+
+def release_displays():
+    for d in _displays:
+        d.root_group = None
+    _displays.clear()
+
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        self.width = width
+        self.height = height
+        self.value_count = value_count
+        typecode = 'B' if value_count <= 256 else 'H'
+        self._data = array(typecode, bytes(width * height *
+            (1 if typecode == 'B' else 2)))
+
+    def _index(self, key):
+        if isinstance(key, tuple):
+            (x, y) = key
+            return y * self.width + x
+        return key
+
+    def __getitem__(self, key):
+        return self._data[self._index(key)]
+
+    def __setitem__(self, key, value):
+        self._data[self._index(key)] = value
+
+    def fill(self, value):
+        for i in range(len(self._data)):
+            self._data[i] = value
+
+
+class Palette:
+    def __init__(self, color_count, *, dither=False):
+        self._colors = [0] * color_count
+        self._transparent = [False] * color_count
+
+    def __len__(self):
+        return len(self._colors)
+
+    def __getitem__(self, index):
+        return self._colors[index]
+
+    def __setitem__(self, index, color):
+        self._colors[index] = color
+
+    def make_transparent(self, index):
+        self._transparent[index] = True
+
+    def make_opaque(self, index):
+        self._transparent[index] = False
+
+    def is_transparent(self, index):
+        return self._transparent[index]
+
+
+class TileGrid:
+    def __init__(self, bitmap, *, pixel_shader, width=1, height=1,
+            tile_width=None, tile_height=None, default_tile=0, x=0, y=0):
+        self.bitmap = bitmap
+        self.pixel_shader = pixel_shader
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width or bitmap.width
+        self.tile_height = tile_height or bitmap.height
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self._tiles = array('H', [default_tile] * (width * height))
+
+    def _index(self, key):
+        if isinstance(key, tuple):
+            (x, y) = key
+            return y * self.width + x
+        return key
+
+    def __getitem__(self, key):
+        return self._tiles[self._index(key)]
+
+    def __setitem__(self, key, tile):
+        self._tiles[self._index(key)] = tile
+
+    def _render(self, fb, ox, oy, scale):
+        if self.hidden:
+            return
+        bmp = self.bitmap
+        pal = self.pixel_shader
+        tw = self.tile_width
+        th = self.tile_height
+        per_row = bmp.width // tw
+        ox += self.x * scale
+        oy += self.y * scale
+        for ty in range(self.height):
+            for tx in range(self.width):
+                tile = self._tiles[ty * self.width + tx]
+                sx = (tile % per_row) * tw
+                sy = (tile // per_row) * th
+                for py in range(th):
+                    y = oy + (ty * th + py) * scale
+                    for px in range(tw):
+                        v = bmp[sx + px, sy + py]
+                        if pal.is_transparent(v):
+                            continue
+                        fb.fill_rect(ox + (tx * tw + px) * scale, y,
+                            scale, scale, pal[v])
+
+
+class Group:
+    def __init__(self, *, scale=1, x=0, y=0):
+        # Set _scale directly, like the C implementation does, so subclasses
+        # with their own scale property (e.g. the real Label) still work
+        self._scale = scale
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self._items = []
+
+    @property
+    def scale(self):
+        return self._scale
+
+    @scale.setter
+    def scale(self, value):
+        self._scale = value
+
+    def append(self, item):
+        self._items.append(item)
+
+    def insert(self, index, item):
+        self._items.insert(index, item)
+
+    def remove(self, item):
+        self._items.remove(item)
+
+    def pop(self, index=-1):
+        return self._items.pop(index)
+
+    def index(self, item):
+        return self._items.index(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __setitem__(self, index, item):
+        self._items[index] = item
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def _render(self, fb, ox, oy, scale):
+        if self.hidden:
+            return
+        ox += self.x * scale
+        oy += self.y * scale
+        for item in self._items:
+            item._render(fb, ox, oy, scale * self._scale)
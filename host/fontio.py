@@ -0,0 +1,12 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython fontio module. See the "Running on a
+# Linux Host" section of README.md.
+#
+# This is only here so the real adafruit_display_text library can be
+# imported on a host (its type hints refer to fontio.FontProtocol).
+#
+
+class FontProtocol:
+    pass
@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython fourwire module. See the "Running on a
+# Linux Host" section of README.md.
+#
+
+class FourWire:
+    def __init__(self, spi_bus, *, command=None, chip_select=None,
+            reset=None, baudrate=24_000_000, polarity=0, phase=0):
+        self.spi_bus = spi_bus
+        self.command = command
+        self.chip_select = chip_select
+        self.reset = reset
+        self.baudrate = baudrate
@@ -0,0 +1,288 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Stand-in IRC server for end-to-end tests and benchmarks on a Linux host.
+# See the "Running on a Linux Host" section of README.md.
+#
+# Usage: python3 host/ircd.py [options]
+#
+# This speaks just enough RFC 1459 for the bot: NICK/USER registration (with
+# the 001-004 welcome), JOIN (with 332 or 331, 353, and 366), TOPIC, PING and
+# PONG in both directions, PRIVMSG, NOTICE, and QUIT. It serves one client at
+# a time, which is all the bot needs, and it doesn't use threads: the caller
+# drives it with poll(), so a benchmark script can interleave its own sends
+# with handling the bot's lines. For testing failures, it can refuse the
+# bot's nick with 433, go silent like a dead link, drop the connection, or go
+# down and come back up (for failover between servers).
+#
+# Run on its own, it serves forever and changes each channel's topic to a
+# made up sensor reading every --topic-every seconds. That's handy with
+# `make host` when you don't have ngircd on your dev box.
+#
+import argparse
+import random
+import socket
+import struct
+import time
+
+
+class IRCServer:
+
+    def __init__(self, host='127.0.0.1', port=6667, name='irc.local'):
+        self.name = name
+        self.addr = (host, port)
+        self.lsock = self._listen(1)
+        self.filler = None     # connection that fills the backlog when hung
+        self.sock = None
+        self.buf = b''
+        self.topics = {}       # channel topics (set before or during a run)
+        self.nick_in_use = 0   # refuse this many registrations with 433
+        self.silent = False    # read the client's lines but never answer
+        # State and timestamps (time.monotonic()) for the current client
+        self.nick = None
+        self.user = False
+        self.registered = False
+        self.chans = []
+        self.connects = 0      # connections accepted
+        self.connected_at = 0
+        self.joined_at = 0     # last JOIN from the client
+        self.closed_at = 0     # last time the client hung up (or got dropped)
+        self.refused_at = 0    # last 433
+        self.pings = 0         # PINGs from the client
+        self.replies = []      # (time, text) of PRIVMSGs and NOTICEs
+
+    def _listen(self, backlog):
+        lsock = socket.socket()
+        lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        lsock.bind(self.addr)
+        lsock.listen(backlog)
+        return lsock
+
+    def accept(self, timeout=30):
+        # Wait for the client to connect. Returns True if it did.
+        if self.lsock is None or self.filler is not None:
+            # Down
+            time.sleep(timeout)
+            return False
+        self.lsock.settimeout(timeout)
+        try:
+            (sock, _) = self.lsock.accept()
+        except socket.timeout:
+            return False
+        self.close()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.buf = b''
+        self.nick = None
+        self.user = False
+        self.silent = False
+        self.connects += 1
+        self.connected_at = time.monotonic()
+        return True
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.closed_at = time.monotonic()
+        self.registered = False
+        self.chans = []
+
+    def drop(self):
+        # Hang up abruptly, with a TCP reset rather than a clean close
+        if self.sock is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                struct.pack('ii', 1, 0))
+            self.close()
+
+    def down(self, hang=False):
+        # Go down like a crashed server: drop the client and refuse new
+        # connections. With hang=True, new connections get no answer at
+        # all, like a server that's off the network. (Linux drops SYNs once
+        # the listen backlog is full, so that's a backlog of 1 with one
+        # connection in it that never gets accepted.)
+        self.drop()
+        self.lsock.close()
+        self.lsock = None
+        if hang:
+            self.lsock = self._listen(0)
+            self.filler = socket.create_connection(self.addr)
+
+    def up(self):
+        # Come back up after down()
+        if self.filler is not None:
+            self.filler.close()
+            self.filler = None
+        if self.lsock is not None:
+            self.lsock.close()
+        self.lsock = self._listen(1)
+
+    def send(self, data):
+        # Send a line (str, without CRLF) or several lines of raw bytes.
+        # Blocks while the client's receive window is full, so the time this
+        # takes shows how fast the client is reading.
+        if self.sock is None:
+            return
+        if isinstance(data, str):
+            data = data.encode() + b'\r\n'
+        try:
+            self.sock.settimeout(10)
+            self.sock.sendall(data)
+        except OSError:
+            self.close()
+
+    def reply(self, code, text):
+        self.send(':%s %s %s %s' % (self.name, code, self.nick or '*', text))
+
+    def topic(self, chan, text, setter='hub'):
+        # Change a channel topic, telling the client if it's in there
+        self.topics[chan] = text
+        if chan in self.chans:
+            self.send(':%s!u@h TOPIC %s :%s' % (setter, chan, text))
+
+    def privmsg(self, chan, text, sender='hub'):
+        self.send(':%s!u@h PRIVMSG %s :%s' % (sender, chan, text))
+
+    def poll(self, until):
+        # Handle the client's lines until time.monotonic() reaches until or
+        # the client hangs up
+        while self.sock is not None:
+            while b'\r\n' in self.buf:
+                (line, self.buf) = self.buf.split(b'\r\n', 1)
+                if not self.silent:
+                    self._line(line.decode('utf-8', 'replace'))
+            if (left := until - time.monotonic()) <= 0:
+                return
+            try:
+                self.sock.settimeout(min(left, 0.05))
+                if not (data := self.sock.recv(65536)):
+                    self.close()
+                    return
+                self.buf += data
+            except socket.timeout:
+                pass
+            except OSError:
+                self.close()
+
+    def wait(self, cond, timeout=30):
+        # Poll until cond() is true. Returns False on timeout.
+        end = time.monotonic() + timeout
+        while not cond():
+            if time.monotonic() >= end:
+                return False
+            if self.sock is None:
+                if not self.accept(end - time.monotonic()):
+                    return False
+            self.poll(min(end, time.monotonic() + 0.05))
+        return True
+
+    def _line(self, line):
+        (cmd, _, rest) = line.partition(' ')
+        cmd = cmd.upper()
+        text = rest.split(' :', 1)[1] if ' :' in rest else ''
+        if cmd == 'NICK':
+            if self.nick_in_use > 0:
+                self.nick_in_use -= 1
+                self.refused_at = time.monotonic()
+                self.send(':%s 433 * %s :Nickname is already in use'
+                    % (self.name, rest.strip()))
+                return
+            self.nick = rest.strip().lstrip(':')
+            self._welcome()
+        elif cmd == 'USER':
+            self.user = True
+            self._welcome()
+        elif cmd == 'PING':
+            self.pings += 1
+            self.send(':%s PONG %s %s' % (self.name, self.name, rest))
+        elif not self.registered:
+            if cmd not in ('PONG', 'QUIT'):
+                self.reply('451', ':You have not registered')
+        elif cmd == 'JOIN':
+            for chan in rest.strip().lstrip(':').split(','):
+                self._join(chan)
+        elif cmd == 'TOPIC' and ' :' in rest:
+            self.topic(rest.split(' ', 1)[0], text, self.nick)
+        elif cmd in ('PRIVMSG', 'NOTICE'):
+            self.replies.append((time.monotonic(), text))
+        elif cmd == 'QUIT':
+            self.close()
+
+    def _welcome(self):
+        if self.registered or not (self.nick and self.user):
+            return
+        self.registered = True
+        self.reply('001', ':Welcome to the stand-in IRC network %s'
+            % self.nick)
+        self.reply('002', ':Your host is %s' % self.name)
+        self.reply('003', ':This server was created just now')
+        self.reply('004', '%s host-ircd o o' % self.name)
+
+    def _join(self, chan):
+        if chan not in self.chans:
+            self.chans.append(chan)
+        self.joined_at = time.monotonic()
+        self.send(':%s!%s@h JOIN :%s' % (self.nick, self.nick, chan))
+        if (text := self.topics.get(chan)):
+            self.reply('332', '%s :%s' % (chan, text))
+        else:
+            self.reply('331', '%s :No topic is set' % chan)
+        self.reply('353', '= %s :%s hub' % (chan, self.nick))
+        self.reply('366', '%s :End of /NAMES list' % chan)
+
+    def stats(self, chan, timeout=5):
+        # Ask the client for `!stats` in chan and return the counters from
+        # its reply as a dict (with its arrival time as 'at'), or None
+        n = len(self.replies)
+        self.privmsg(chan, '!stats')
+        if not self.wait(lambda: len(self.replies) > n, timeout):
+            return None
+        (at, text) = self.replies[n]
+        words = text.split()
+        out = {'at': at}
+        for (i, w) in enumerate(words[:-1]):
+            if words[i+1].isdigit():
+                out[w] = int(words[i+1])
+        return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Stand-in IRC server')
+    ap.add_argument('--port', type=int, default=6667)
+    ap.add_argument('--chan', default='#sensors',
+        help='channels to make up topics for (comma separated)')
+    ap.add_argument('--topic-every', type=float, default=10,
+        help='seconds between topic changes (0 for never)')
+    args = ap.parse_args()
+    srv = IRCServer(port=args.port)
+    chans = args.chan.split(',')
+    rng = random.Random()
+    temp = 215
+
+    def change():
+        nonlocal temp
+        temp += rng.choice((-1, 1))
+        for chan in chans:
+            srv.topic(chan, 'temp %d.%dC' % (temp // 10, temp % 10))
+
+    change()
+    print('ircd: listening on port %d' % args.port)
+    while True:
+        if srv.accept(3600):
+            print('ircd: client connected')
+        next_topic = time.monotonic() + args.topic_every
+        while srv.connected:
+            srv.poll(next_topic if args.topic_every else
+                time.monotonic() + 1)
+            if args.topic_every and time.monotonic() >= next_topic:
+                next_topic += args.topic_every
+                change()
+        print('ircd: client hung up')
+
+
+if __name__ == '__main__':
+    main()
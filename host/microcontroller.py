@@ -0,0 +1,51 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython microcontroller module. See the
+# "Running on a Linux Host" section of README.md.
+#
+# If the HOST_NVM environment variable is set to a file path, nvm gets loaded
+# from that file and every write gets saved back to it, so nvm contents
+# survive a restart like they would on the board.
+#
+import os
+import sys
+
+
+class Processor:
+    def __init__(self):
+        self.frequency = 240_000_000
+        self.temperature = 25.0
+        self.voltage = 3.3
+
+
+class ByteArray:
+    # Non-volatile memory stand-in with the same slicing API as the real one
+    def __init__(self, size=8192, path=None):
+        self._data = bytearray(b'\xff' * size)
+        self._path = path
+        if path and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                saved = f.read(size)
+            self._data[:len(saved)] = saved
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, index):
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        self._data[index] = value
+        if self._path:
+            with open(self._path, 'wb') as f:
+                f.write(self._data)
+
+
+cpu = Processor()
+nvm = ByteArray(path=os.getenv('HOST_NVM'))
+
+
+def reset():
+    # The closest host equivalent of a hard reset is to exit
+    sys.exit(1)
@@ -0,0 +1,11 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython micropython module. See the "Running on
+# a Linux Host" section of README.md.
+#
+
+def const(value):
+    # On the board, const() values get folded in at compile time. On the
+    # host, it's just the identity function.
+    return value
@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython socketpool module. See the "Running on
+# a Linux Host" section of README.md.
+#
+# Sockets are real TCP sockets. The only translation is for errors, which
+# get the errno values that the ESP32-S3 port raises, so the bot's error
+# handling takes the same paths on the host as it does on the board.
+#
+# If the HOST_REPLAY environment variable is set to a capture file path (see
+# sb_capture.py), sockets replay that capture instead of using the network.
+# HOST_REPLAY_SPEED sets the replay speed: 1 (default) for the original
+# timing, N for N times faster, or 0 for as fast as possible.
+#
+import errno
+import os
+import socket
+
+AF_INET = socket.AF_INET
+SOCK_STREAM = socket.SOCK_STREAM
+EAGAIN = 11
+ETIMEDOUT = 116
+
+# Linux errno -> ESP32 errno, for the ones that differ (ESP32 uses newlib's
+# numbering). ECONNRESET and ECONNREFUSED are the same on both.
+_ERRNO = {
+    errno.EAGAIN: EAGAIN,
+    errno.ETIMEDOUT: ETIMEDOUT,
+    errno.EHOSTUNREACH: 118,
+    errno.EINPROGRESS: 119,
+    errno.EALREADY: 120,
+    errno.EISCONN: 127,
+    errno.ENOTCONN: 128,
+}
+
+
+class Socket:
+    def __init__(self, sock):
+        self._sock = sock
+
+    def _call(self, fn, *args):
+        try:
+            return fn(*args)
+        except TimeoutError:
+            raise OSError(ETIMEDOUT, 'ETIMEDOUT') from None
+        except OSError as e:
+            if (n := _ERRNO.get(e.errno)) is None:
+                raise
+            raise OSError(n, errno.errorcode[e.errno]) from None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def settimeout(self, value):
+        self._sock.settimeout(value)
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def connect(self, address):
+        self._call(self._sock.connect, address)
+
+    def recv_into(self, buffer, bufsize=0):
+        return self._call(self._sock.recv_into, buffer, bufsize)
+
+    def send(self, data):
+        return self._call(self._sock.send, data)
+
+    def sendall(self, data):
+        self._call(self._sock.sendall, data)
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class SocketPool:
+    AF_INET = AF_INET
+    SOCK_STREAM = SOCK_STREAM
+
+    def __init__(self, radio):
+        self.radio = radio
+        self.replay = None
+        if (path := os.getenv('HOST_REPLAY')):
+            from sb_capture import ReplayPool, read_capture
+            speed = float(os.getenv('HOST_REPLAY_SPEED', '1'))
+            self.replay = ReplayPool(read_capture(path), speed)
+
+    def socket(self, family=AF_INET, type=SOCK_STREAM):
+        if self.replay:
+            return self.replay.socket(family, type)
+        return Socket(socket.socket(family, type))
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        return socket.getaddrinfo(host, port, family, type, proto, flags)
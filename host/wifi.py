@@ -0,0 +1,44 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Host stand-in for the CircuitPython wifi module. See the "Running on a
+# Linux Host" section of README.md.
+#
+# The host's own network is always up, so connect() just records the
+# settings it was given and marks the radio as connected. To make boot
+# timing more like a board, set HOST_WIFI_SCAN_S to the number of seconds a
+# connect() without a channel and BSSID should take to scan for the network.
+#
+import os
+import time
+
+
+class Network:
+    def __init__(self, ssid, bssid, channel, rssi=-40):
+        self.ssid = ssid
+        self.bssid = bssid
+        self.channel = channel
+        self.rssi = rssi
+
+
+class Radio:
+    def __init__(self):
+        self.enabled = True
+        self.connected = False
+        self.ipv4_address = None
+        self.hostname = 'host'
+        self.ap_info = None
+
+    def connect(self, ssid, password='', *, channel=0, bssid=None,
+            timeout=None):
+        if not ssid:
+            raise ConnectionError('No network with that ssid')
+        if not (channel and bssid):
+            time.sleep(float(os.getenv('HOST_WIFI_SCAN_S', '0')))
+        self.connected = True
+        self.ipv4_address = '127.0.0.1'
+        self.ap_info = Network(ssid, bssid or b'\x02\x00\x00\x00\x00\x01',
+            channel or 6)
+
+
+radio = Radio()
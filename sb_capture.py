@@ -0,0 +1,232 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# Record and replay raw IRC byte streams.
+#
+# A capture is a sequence of records, each with a 6-byte header (uint32
+# milliseconds since the start of recording, uint16 length, little-endian)
+# followed by the bytes that one Socket.recv_into() call returned. A record
+# with length 0 marks the start of a new connection. Capture files start
+# with the 8-byte MAGIC string.
+#
+from micropython import const
+import struct
+import time
+
+
+MAGIC = b'IRCCAP\x01\n'
+_HDR = '<IH'
+_HDR_LEN = const(6)
+_MAX_DATA = const(0xffff)
+_EAGAIN = const(11)
+_ECONNREFUSED = const(111)
+_ETIMEDOUT = const(116)
+
+
+def open_recorder(spec):
+    # Make a recorder from a settings string: 'ram' or 'ram:<bytes>' for a
+    # size-capped RAM ring, otherwise a file path. CAUTION: To record to a
+    # file on CIRCUITPY, boot.py has to remount the filesystem as writable
+    # for code.py.
+    if spec == 'ram':
+        return CaptureRing()
+    if spec.startswith('ram:'):
+        return CaptureRing(int(spec[4:]))
+    return CaptureFile(spec)
+
+
+class CaptureFile:
+    # Append capture records to a file as they arrive. Each record gets
+    # flushed right away so a capture survives a crash or reset.
+
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+        self.t0 = time.monotonic_ns()
+
+    def write(self, data):
+        n = min(len(data), _MAX_DATA)
+        ms = (time.monotonic_ns() - self.t0) // 1_000_000
+        self.f.write(struct.pack(_HDR, ms & 0xffffffff, n))
+        if n:
+            self.f.write(data[:n])
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class CaptureRing:
+    # Keep the most recent capture records in one preallocated bytearray.
+    # When the ring fills up, the oldest records get dropped to make room,
+    # so memory use stays fixed no matter how long the bot records. Call
+    # save() to write the ring out in the capture file format.
+    #
+    # Records are stored whole (never split across the end of the ring).
+    # When a record won't fit at the end, the valid data region ends at
+    # self.wrap and the record goes at the front.
+
+    def __init__(self, size=16384):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.t0 = time.monotonic_ns()
+        self.head = 0          # where the next record goes
+        self.tail = 0          # oldest record
+        self.wrap = size       # end of valid data when wrapped
+        self.wrapped = False
+        self.dropped = 0       # records dropped to make room
+
+    def _drop(self):
+        # Drop the oldest record
+        (_, n) = struct.unpack_from(_HDR, self.buf, self.tail)
+        self.tail += _HDR_LEN + n
+        self.dropped += 1
+        if self.tail >= self.wrap:
+            self.tail = 0
+            self.wrapped = False
+
+    def write(self, data):
+        size = len(self.buf)
+        n = min(len(data), size // 2 - _HDR_LEN)
+        need = _HDR_LEN + n
+        while True:
+            if not self.wrapped:
+                if self.head + need <= size:
+                    break
+                if self.tail == self.head:
+                    # Ring is empty, so start over at the front
+                    self.head = self.tail = 0
+                    break
+                self.wrap = self.head
+                self.head = 0
+                self.wrapped = True
+            while self.wrapped and self.tail - self.head < need:
+                self._drop()
+            if self.wrapped:
+                break
+        ms = (time.monotonic_ns() - self.t0) // 1_000_000
+        struct.pack_into(_HDR, self.buf, self.head, ms & 0xffffffff, n)
+        self.mv[self.head+_HDR_LEN:self.head+need] = data[:n]
+        self.head += need
+
+    def records(self):
+        # Yield (ms, memoryview) for each record, oldest first
+        spans = [(self.tail, self.wrap), (0, self.head)] if self.wrapped \
+            else [(self.tail, self.head)]
+        for (i, end) in spans:
+            while i < end:
+                (ms, n) = struct.unpack_from(_HDR, self.buf, i)
+                yield (ms, self.mv[i+_HDR_LEN:i+_HDR_LEN+n])
+                i += _HDR_LEN + n
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            for (ms, data) in self.records():
+                f.write(struct.pack(_HDR, ms, len(data)))
+                f.write(data)
+
+    def close(self):
+        pass
+
+
+def read_capture(path):
+    # Return a list of (ms, bytes) records from a capture file
+    with open(path, 'rb') as f:
+        blob = f.read()
+    if blob[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a capture file: %s' % path)
+    records = []
+    i = len(MAGIC)
+    while i + _HDR_LEN <= len(blob):
+        (ms, n) = struct.unpack_from(_HDR, blob, i)
+        i += _HDR_LEN
+        records.append((ms, blob[i:i+n]))
+        i += n
+    return records
+
+
+class ReplaySocket:
+    # Socket stand-in that plays back the records of one captured connection
+    # through recv_into(). With speed=1.0, data arrives with the original
+    # timing, speed=N plays N times faster, and speed=0 plays as fast as
+    # possible. Timeouts work like a real socket: if the next record isn't
+    # due yet, recv_into() raises ETIMEDOUT after the timeout, or EAGAIN
+    # right away for a non-blocking socket. Once the records run out, the
+    # socket acts like the server hung up.
+
+    def __init__(self, records, speed=1.0):
+        self.records = records
+        self.speed = speed
+        self.i = 0
+        self.offset = 0
+        self.timeout = None
+        self.t0 = None
+        self.ms0 = records[0][0] if records else 0
+        self.sent = bytearray()
+
+    def settimeout(self, value):
+        self.timeout = value
+
+    def setblocking(self, flag):
+        self.timeout = None if flag else 0
+
+    def connect(self, address):
+        if not self.records:
+            raise OSError(_ECONNREFUSED, 'ECONNREFUSED')
+        self.t0 = time.monotonic()
+
+    def recv_into(self, buffer, bufsize=0):
+        while self.i < len(self.records) and not self.records[self.i][1]:
+            self.i += 1
+        if self.i >= len(self.records):
+            return 0
+        (ms, data) = self.records[self.i]
+        if self.speed and self.offset == 0:
+            wait = (self.t0 + (ms - self.ms0) / 1000 / self.speed
+                - time.monotonic())
+            if wait > 0:
+                if self.timeout == 0:
+                    raise OSError(_EAGAIN, 'EAGAIN')
+                if self.timeout is not None and wait > self.timeout:
+                    time.sleep(self.timeout)
+                    raise OSError(_ETIMEDOUT, 'ETIMEDOUT')
+                time.sleep(wait)
+        n = min(len(data) - self.offset, len(buffer))
+        if bufsize:
+            n = min(n, bufsize)
+        buffer[:n] = data[self.offset:self.offset+n]
+        self.offset += n
+        if self.offset >= len(data):
+            self.i += 1
+            self.offset = 0
+        return n
+
+    def send(self, data):
+        self.sent.extend(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.sent.extend(data)
+
+    def close(self):
+        pass
+
+
+class ReplayPool:
+    # SocketPool stand-in that hands out one ReplaySocket per captured
+    # connection, in order. After the last one, connect() gets refused.
+
+    def __init__(self, records, speed=1.0):
+        self.speed = speed
+        self.conns = []
+        for (ms, data) in records:
+            if not data or not self.conns:
+                self.conns.append([])
+            self.conns[-1].append((ms, data))
+
+    def socket(self, family=None, type=None):
+        records = self.conns.pop(0) if self.conns else []
+        return ReplaySocket(records, self.speed)
@@ -3,19 +3,430 @@
 #
 # See NOTES.md for documentation links and pinout info.
 #
+from array import array
 import atexit
 import board
 import displayio
 from fourwire import FourWire
+from micropython import const
 import terminalio
+import time
 
-from adafruit_display_text import label
 from adafruit_ili9341 import ILI9341
 
+from sb_series import SeriesStore
+from sb_stats import stats, CNT_REFRESHES, SPAN_LABEL, SPAN_REFRESH, SPAN_WRAP
 
-class CharDisplay:
-    def __init__(self, width=16):
-        # Try to initialize 2.8" TFT display shield with ILI9341 chip
+
+# Build flag for timing spans (see sb_stats.py). 0 compiles them out.
+_PROFILE = const(1)
+
+
+# Topic pane layouts for 1 to 4 panes. Each pane is (x, y, width, height,
+# scale) in pixels, inside the 304x224 area below the status line. The wrap
+# width and row count for each pane come from its size and font scale.
+LAYOUTS = {
+    1: ((8, 16, 304, 224, 3),),
+    2: ((8, 16, 304, 112, 2), (8, 128, 304, 112, 2)),
+    3: ((8, 16, 304, 74, 2), (8, 90, 304, 74, 2), (8, 164, 304, 74, 2)),
+    4: ((8, 16, 148, 112, 2), (164, 16, 148, 112, 2),
+        (8, 128, 148, 112, 2), (164, 128, 148, 112, 2)),
+}
+# Alternating colors make it easier to tell neighboring panes apart
+PANE_COLORS = (0xefef00, 0x00dfef, 0xefef00, 0x00dfef)
+STALE_COLOR = 0x606060    # for topics restored from a warm start
+
+
+def wrap_offsets(text, width, mode):
+    # Lay out text in lines of at most width characters in one pass. Returns
+    # an array of [start, end, start, end, ...] offsets into text, one pair
+    # per line, rather than building new strings. Modes:
+    # - 'hard': break every width characters
+    # - 'word': break at the last space that fits, else hard wrap
+    # - 'pre': break only at '\n' (long lines are left for the display to clip)
+    out = array('H')
+    n = len(text)
+    start = 0
+    if mode == 'pre':
+        while (nl := text.find('\n', start)) > -1:
+            out.append(start)
+            out.append(nl)
+            start = nl + 1
+    elif mode == 'hard':
+        while n - start > width:
+            out.append(start)
+            out.append(start + width)
+            start += width
+    else:
+        while n - start > width:
+            # Only search the window that can fit on this line, so each
+            # character gets looked at about once
+            space = text.rfind(' ', start, start + width + 1)
+            if space == -1:
+                # No space in the first width characters, so hard wrap
+                out.append(start)
+                out.append(start + width)
+                start += width
+            else:
+                out.append(start)
+                out.append(space)
+                start = space + 1
+    if start < n or mode == 'pre':
+        out.append(start)
+        out.append(n)
+    return out
+
+
+def join_lines(text, offsets):
+    # Build a newline separated string from text and wrap_offsets() output
+    return '\n'.join([text[offsets[i]:offsets[i+1]]
+        for i in range(0, len(offsets), 2)])
+
+
+class WrapCache:
+    # Small bounded cache of wrap_offsets() results, keyed by (text hash,
+    # width, mode). When it fills up, the least recently used entry gets
+    # evicted. Hits compare the full text too, so a hash collision can only
+    # cost a miss, never a wrong layout.
+
+    def __init__(self, size=8):
+        self.size = size
+        self.keys = []         # least recently used first
+        self.entries = {}      # key -> (text, offsets)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, width, mode):
+        key = (hash(text), width, mode)
+        if (entry := self.entries.get(key)) is not None and entry[0] == text:
+            self.hits += 1
+            if self.keys[-1] != key:
+                self.keys.remove(key)
+                self.keys.append(key)
+            return entry[1]
+        self.misses += 1
+        offsets = wrap_offsets(text, width, mode)
+        if entry is None:
+            if len(self.keys) >= self.size:
+                del self.entries[self.keys.pop(0)]
+            self.keys.append(key)
+        self.entries[key] = (text, offsets)
+        return offsets
+
+
+class RefreshScheduler:
+    # This coalesces text changes into as few display refreshes as possible.
+    # Text setters call mark() to say the display is dirty. The owner of the
+    # scheduler then calls refresh() once it has drained its pending work.
+    # Refreshes are rate-limited to one per frame_s seconds, so any changes
+    # that arrive during the wait get merged into the next refresh.
+
+    def __init__(self, display, frame_s=0.1):
+        self.display = display
+        self.frame_s = frame_s
+        self.dirty = False
+        self.last_refresh = time.monotonic() - frame_s
+        self.marks = 0         # text changes that needed a refresh
+        self.refreshes = 0     # refreshes actually pushed to the display
+        self.skipped = 0       # text updates skipped because of no change
+        self.refresh_ms = 0    # duration of the most recent refresh
+        self.refresh_ms_max = 0
+
+    def mark(self):
+        self.dirty = True
+        self.marks += 1
+
+    def delay(self):
+        # Return seconds until the frame budget allows the next refresh
+        return max(0, self.last_refresh + self.frame_s - time.monotonic())
+
+    def saved(self):
+        # Return how many refreshes got merged away or skipped
+        return self.marks + self.skipped - self.refreshes
+
+    def refresh(self, force=False):
+        # Push pending changes if the display is dirty and the frame budget
+        # allows it (or if force=True). Returns True if it refreshed.
+        if not self.dirty or (not force and self.delay() > 0):
+            return False
+        t0 = time.monotonic_ns()
+        self.display.refresh()
+        if _PROFILE:
+            stats.span(SPAN_REFRESH, t0)
+        stats.count(CNT_REFRESHES)
+        ms = (time.monotonic_ns() - t0) // 1_000_000
+        self.last_refresh = time.monotonic()
+        self.dirty = False
+        self.refreshes += 1
+        self.refresh_ms = ms
+        self.refresh_ms_max = max(ms, self.refresh_ms_max)
+        if ms > self.frame_s * 1000:
+            # Only log refreshes that blow the frame budget. The `!stats`
+            # summary has the refresh count and times.
+            print('refresh: %d ms over %d ms budget (max %d ms), saved %d' %
+                (ms, self.frame_s * 1000, self.refresh_ms_max, self.saved()))
+        return True
+
+
+class CellGrid:
+    # Fixed grid of character cells drawn with one TileGrid over the
+    # terminalio.FONT glyph sheet. Each cell is one tile, so writing a
+    # character is a single tile index write. The tile indexes currently on
+    # screen are kept in a shadow array, and updates only write the cells
+    # that differ, so a one digit change only dirties one cell.
+
+    def __init__(self, cols, rows, x, y, scale, color):
+        font = terminalio.FONT
+        (cell_w, cell_h) = font.get_bounding_box()
+        self.cols = cols
+        self.rows = rows
+        # Tile index lookup table for ASCII (anything else goes through
+        # get_glyph() with a fallback to '?')
+        self.unknown = self._glyph_tile(ord('?'), 0)
+        self.lut = array('H', [self._glyph_tile(c, self.unknown)
+            for c in range(128)])
+        self.blank = self.lut[32]
+        self.palette = displayio.Palette(2)
+        self.palette[0] = 0x000000
+        self.palette[1] = color
+        self.grid = displayio.TileGrid(font.bitmap,
+            pixel_shader=self.palette, width=cols, height=rows,
+            tile_width=cell_w, tile_height=cell_h, default_tile=self.blank)
+        self.tiles = array('H', [self.blank] * (cols * rows))
+        self.group = displayio.Group(scale=scale, x=x, y=y)
+        self.group.append(self.grid)
+
+    def _glyph_tile(self, codepoint, default):
+        glyph = terminalio.FONT.get_glyph(codepoint)
+        return default if glyph is None else glyph.tile_index
+
+    def _tile(self, codepoint):
+        if codepoint < 128:
+            return self.lut[codepoint]
+        return self._glyph_tile(codepoint, self.unknown)
+
+    @property
+    def hidden(self):
+        return self.group.hidden
+
+    @hidden.setter
+    def hidden(self, value):
+        self.group.hidden = value
+
+    @property
+    def color(self):
+        return self.palette[1]
+
+    @color.setter
+    def color(self, value):
+        # Recoloring is a palette write, not a redraw of every cell
+        self.palette[1] = value
+
+    def set_lines(self, text, offsets, first=0, align_right=False,
+            rows=None):
+        # Show text lines first, first+1, ... given wrap_offsets() style
+        # [start, end, ...] pairs. Lines get clipped to the grid width and
+        # cells past the end of a line get blanked. rows can be a (top,
+        # bottom) range of rows to write, leaving the others alone. Returns
+        # the number of cells that changed.
+        data = text.encode()
+        ascii_only = len(data) == len(text)
+        tiles = self.tiles
+        grid = self.grid
+        lut = self.lut
+        blank = self.blank
+        cols = self.cols
+        (top, bottom) = rows or (0, self.rows)
+        changed = 0
+        i = top * cols
+        for row in range(top, bottom):
+            k = 2 * (first + row)
+            if k + 1 < len(offsets):
+                a = offsets[k]
+                b = min(offsets[k+1], a + cols)
+            else:
+                a = b = 0
+            pad = cols - (b - a) if align_right else 0
+            for col in range(cols):
+                pos = a + col - pad
+                if col < pad or pos >= b:
+                    t = blank
+                elif ascii_only:
+                    t = lut[data[pos]]
+                else:
+                    t = self._tile(ord(text[pos]))
+                if tiles[i] != t:
+                    tiles[i] = t
+                    grid[i] = t
+                    changed += 1
+                i += 1
+        return changed
+
+    def set_text(self, text, align_right=False):
+        # Show text on the first row, with the other rows blank
+        n = len(text)
+        return self.set_lines(text, (max(0, n - self.cols) if align_right
+            else 0, n), align_right=align_right)
+
+    def set_row(self, row, text):
+        # Show text on one row, leaving the other rows alone
+        return self.set_lines(text, (0, len(text)), -row, rows=(row, row + 1))
+
+    def dump(self):
+        # Return what the grid is showing, one line per row (for debugging)
+        inv = {t: chr(c) for (c, t) in enumerate(self.lut) if c >= 32}
+        rows = []
+        for r in range(self.rows):
+            row = self.tiles[r*self.cols:(r+1)*self.cols]
+            rows.append(''.join(inv.get(t, '?') for t in row).rstrip())
+        return '\n'.join(rows)
+
+
+class Sparkline:
+    # One row sparkline in a 2 color Bitmap. Instead of scrolling, samples
+    # get drawn as a sweep: each new sample goes in the column after the last
+    # one, wrapping at the right edge, with a blank gap column ahead of it.
+    # So a new sample only changes two columns. Each column is a vertical
+    # segment from the previous sample's y to this one's, and the drawn
+    # segments are kept in shadow arrays so a column can be cleared without
+    # reading the bitmap. The y scale only changes (which redraws every
+    # column) when a sample falls outside it, or when the sweep wraps and the
+    # range may have shrunk. The scale gets some headroom past the samples'
+    # range, so a series that drifts doesn't need a redraw for each new high.
+
+    def __init__(self, width, height, x, y, color):
+        self.width = width
+        self.height = height
+        self.bitmap = displayio.Bitmap(width, height, 2)
+        self.palette = displayio.Palette(2)
+        self.palette[0] = 0x000000
+        self.palette[1] = color
+        self.grid = displayio.TileGrid(self.bitmap,
+            pixel_shader=self.palette, x=x, y=y)
+        self.top = bytearray(width)      # drawn segment rows per column,
+        self.bottom = bytearray(width)   # with top > bottom meaning empty
+        for col in range(width):
+            self.top[col] = 1
+        self.slot = -1         # series slot being shown
+        self.key = None        # its key (a new key may take over the slot)
+        self.drawn = 0         # sample count when last drawn
+        self.lo = 0.0          # y scale
+        self.hi = 0.0
+        self.columns = 0       # columns written (for benchmarks)
+
+    def _y(self, v):
+        # Row for value v in the current scale (0 is the top)
+        if self.hi <= self.lo:
+            return self.height // 2
+        return (self.height - 1) - int((v - self.lo) * (self.height - 1)
+            / (self.hi - self.lo))
+
+    def _column(self, col, top, bottom):
+        # Replace the segment in col with rows top..bottom (empty if top is
+        # greater than bottom)
+        bmp = self.bitmap
+        old_top = self.top[col]
+        old_bottom = self.bottom[col]
+        if old_top == top and old_bottom == bottom:
+            return
+        for y in range(old_top, old_bottom + 1):
+            if not top <= y <= bottom:
+                bmp[col, y] = 0
+        for y in range(top, bottom + 1):
+            if not old_top <= y <= old_bottom:
+                bmp[col, y] = 1
+        self.top[col] = top
+        self.bottom[col] = bottom
+        self.columns += 1
+
+    def _sample(self, store, k, first):
+        # Draw sample k in its column, connected to sample k-1 if that's
+        # still on screen
+        y = self._y(store.value(self.slot, k))
+        prev = self._y(store.value(self.slot, k - 1)) if k > first else y
+        self._column(k % self.width, min(y, prev), max(y, prev))
+
+    def _scale(self, store, slot, first, end):
+        # Return the (lo, hi) scale for samples first..end-1, which is their
+        # range plus 1/8 of it on each side. Rounding the headroom to a power
+        # of 2 keeps the scale the same when the range only changes a bit.
+        (lo, hi) = store.range(slot, first, end)
+        if (span := hi - lo) <= 0:
+            return (lo, hi)
+        pad = 1.0
+        while pad < span / 8:
+            pad *= 2
+        while pad >= span / 4:
+            pad /= 2
+        return ((lo // pad - 1) * pad, (hi // pad + 2) * pad)
+
+    def clear(self):
+        self.slot = -1
+        self.key = None
+        for col in range(self.width):
+            self._column(col, 1, 0)
+
+    def draw(self, store, slot):
+        # Bring the sparkline up to date with the samples for slot in store.
+        # Returns the number of columns that changed.
+        before = self.columns
+        n = store.counts[slot]
+        same = slot == self.slot and store.keys[slot] is self.key
+        if same and n == self.drawn:
+            return 0
+        w = self.width
+        # The last w-1 samples are on screen (minus any that aren't in the
+        # store's ring any more)
+        first = max(0, n - (w - 1), n - store.samples)
+        full = not same or n - self.drawn >= w - 1
+        if n > first and not full:
+            new = store.range(slot, max(first, self.drawn), n)
+            wrapped = self.drawn // w != n // w
+            if new[0] < self.lo or new[1] > self.hi or wrapped:
+                # Rescale, but only redraw if the scale really changed
+                (lo, hi) = self._scale(store, slot, first, n)
+                full = (lo, hi) != (self.lo, self.hi)
+        if full:
+            self.slot = slot
+            self.key = store.keys[slot]
+            if n > first:
+                (self.lo, self.hi) = self._scale(store, slot, first, n)
+            for col in range(w):
+                # Latest sample that goes in col, if it's on screen
+                k = n - 1 - ((n - 1 - col) % w)
+                if first <= k < n:
+                    self._sample(store, k, first)
+                else:
+                    self._column(col, 1, 0)
+        else:
+            for k in range(max(first, self.drawn), n):
+                self._sample(store, k, first)
+            self._column(n % w, 1, 0)
+        self.drawn = n
+        return self.columns - before
+
+
+class TFTBackend:
+    # Display backend for the 2.8" TFT shield (ILI9341 over SPI). Backends
+    # give CharDisplay its layouts and the grids and groups to build panes
+    # from, then push the changes to the display on refresh():
+    # - cell: (width, height) of a character cell in layout units
+    # - layouts: pane layouts like LAYOUTS, in layout units
+    # - status: (cols, x, y) of the status line
+    # - root: group that CharDisplay puts everything in
+    # - group(), grid(), sparkline(): make a group, a CellGrid-like grid, or a
+    #   Sparkline (or None if the backend can't draw them)
+    # - refresh(): send what changed since the last refresh
+    # - release(): let go of the display when code.py ends
+    # - touch: True if the display may have a touch panel
+    # Here, grids are CellGrids, which only write the tiles that changed,
+    # and displayio sends just the area around those. See sb_textdisplay.py
+    # for the character LCD and terminal backends.
+    touch = True
+    layouts = LAYOUTS
+    status = (52, 4, 4)
+
+    def __init__(self):
         displayio.release_displays()
         spi = board.SPI()
         tft_cs = board.D10
@@ -23,89 +434,421 @@ class CharDisplay:
         display_bus = FourWire(spi, command=tft_dc, chip_select=tft_cs)
         display = ILI9341(display_bus, width=320, height=240,
             rotation=180, auto_refresh=False)
-        group = displayio.Group()
-        display.root_group = group
+        self.root = displayio.Group()
+        display.root_group = self.root
         display.refresh()
-        # System status textbox: scale=1, one line, very top of display
-        status = label.Label(font=terminalio.FONT, scale=1, color=0x80ef00)
-        status.anchor_point = (1, 0)
-        status.anchored_position = (316, 4)
-        status.line_spacing = 1.0  # default is 1.25
-        group.append(status)
-        # IRC topic textbox: scale=3, 6 lines, this is for IRC notifications
-        topic = label.Label(font=terminalio.FONT, scale=3, color=0xefef00)
-        topic.anchor_point = (0, 0)
-        topic.anchored_position = (8, 16)
-        topic.line_spacing = 1.0  # default is 1.25
-        group.append(topic)
+        self.display = display
+        self.cell = terminalio.FONT.get_bounding_box()
+
+    def group(self):
+        return displayio.Group()
+
+    def grid(self, cols, rows, x, y, scale, color):
+        return CellGrid(cols, rows, x, y, scale, color)
+
+    def sparkline(self, width, height, x, y, color):
+        return Sparkline(width, height, x, y, color)
+
+    def refresh(self):
+        return self.display.refresh()
+
+    def release(self):
+        displayio.release_displays()
+
+
+def open_backend(kind='tft', cols=20, rows=4):
+    # Return the display backend for kind: 'tft' for the TFT shield,
+    # 'charlcd' for a cols x rows HD44780 character LCD on the I2C backpack,
+    # or 'term' for a cols x rows ANSI text screen on the serial console.
+    # If the character LCD isn't there, this falls back to the console.
+    if kind == 'charlcd':
+        try:
+            from adafruit_character_lcd.character_lcd_i2c import (
+                Character_LCD_I2C)
+            from sb_textdisplay import CharLCDBackend
+            return CharLCDBackend(Character_LCD_I2C(board.I2C(), cols, rows),
+                cols, rows)
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            print('charlcd: not available (%s), using term' % e)
+            kind = 'term'
+    if kind == 'term':
+        import sys
+        from sb_textdisplay import TermBackend
+        return TermBackend(cols, rows, sys.stdout)
+    if kind != 'tft':
+        print('display: unknown kind %s, using tft' % kind)
+    return TFTBackend()
+
+
+class KVPane:
+    # Dashboard view of a pane for `!kv` topics: one row per key with its
+    # name, latest value, and a sparkline of its recent values (if the
+    # backend can draw them). The keys go in the order they appear in the
+    # topic. If there are more keys than rows, they get split into pages that
+    # flip like long topics do.
+
+    def __init__(self, backend, x, y, w, h, color, max_keys=32):
+        (cell_w, cell_h) = backend.cell
+        self.rows = max(1, h // cell_h)
+        # Name and value take up to 16 characters, split evenly
+        cols = max(2, min(16, w // cell_w))
+        name_w = cols // 2
+        self.name_w = name_w
+        self.value_w = cols - name_w
+        self.fmt = '%%-%ds%%%ds\n' % (name_w, cols - name_w)
+        self.text = backend.grid(cols, self.rows, x, y, 1, color)
+        self.group = backend.group()
+        self.group.append(self.text.group)
+        # Sparklines go to the right of the name and value
+        spark_x = x + cols * cell_w + 4
+        self.lines = []
+        if (spark_w := x + w - spark_x) >= 8:
+            for r in range(self.rows):
+                line = backend.sparkline(spark_w, cell_h - 2, spark_x,
+                    y + r * cell_h + 1, color)
+                if line is None:
+                    break
+                self.group.append(line.grid)
+                self.lines.append(line)
+        # Each text row is cols characters plus a newline
+        self.offsets = array('H')
+        for r in range(self.rows):
+            self.offsets.append(r * (cols + 1))
+            self.offsets.append(r * (cols + 1) + cols)
+        self.slots = array('B', bytes(max_keys))   # keys in display order
+        self.count = 0
+        self.store = None
+        self.page = 0
+        self.page_count = 1
+
+    def set_color(self, color):
+        self.text.color = color
+        for line in self.lines:
+            line.palette[1] = color
+
+    def show(self, store, text, pane=0):
+        # Show the keys in topic text with their latest values from pane's
+        # slots in store
+        self.store = store
+        self.count = store.scan(text, self.slots, add=False, pane=pane)
+        self.page_count = max(1, (self.count + self.rows - 1) // self.rows)
+        if self.page >= self.page_count:
+            self.page = 0
+        return self.draw()
+
+    def draw(self):
+        # Draw the current page. Returns the number of sparkline columns
+        # that changed.
+        store = self.store
+        rows = []
+        columns = 0
+        for r in range(self.rows):
+            i = self.page * self.rows + r
+            if i < self.count:
+                slot = self.slots[i]
+                rows.append(self.fmt % (store.keys[slot][:self.name_w],
+                    store.text[slot][:self.value_w]))
+                if r < len(self.lines):
+                    columns += self.lines[r].draw(store, slot)
+            else:
+                rows.append(self.fmt % ('', ''))
+                if r < len(self.lines) and self.lines[r].slot >= 0:
+                    self.lines[r].clear()
+        self.text.set_lines(''.join(rows), self.offsets)
+        return columns
+
+    def flip(self):
+        if self.page_count < 2:
+            return False
+        self.page = (self.page + 1) % self.page_count
+        self.draw()
+        return True
+
+
+class TopicPane:
+    # One topic textbox. Each pane has its own cell grids, so changing one
+    # topic only dirties that pane's part of the screen.
+    #
+    # Topics too long for one screen get split into pages when they arrive.
+    # Each page is its own CellGrid, laid out once, and flipping pages just
+    # changes which one is hidden. Page grids get created as needed and
+    # reused, up to max_pages, so memory is bounded.
+
+    def __init__(self, backend, x, y, w, h, scale, color, max_pages=4):
+        (cell_w, cell_h) = backend.cell
+        self.backend = backend
+        self.width = w // (cell_w * scale)     # characters per line
+        self.rows = h // (cell_h * scale)      # lines
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.scale = scale
+        self.key = None                        # (text, wrap) last shown
+        self.color = color
+        self.stale = False
+        self.max_pages = max_pages
+        self.group = backend.group()           # holds the page grids
+        self.kv = None                         # KVPane, made when needed
+        self.pages = []                        # page grids made so far
+        self.page_count = 0                    # pages in the current topic
+        self.page = 0                          # page being shown
+        self._page_grid(0)
+
+    def _page_grid(self, i):
+        # Return the cell grid for page i, making it if needed
+        while len(self.pages) <= i:
+            grid = self.backend.grid(self.width, self.rows, self.x, self.y,
+                self.scale, STALE_COLOR if self.stale else self.color)
+            grid.hidden = len(self.pages) > 0
+            self.group.append(grid.group)
+            self.pages.append(grid)
+        return self.pages[i]
+
+    def set_color(self, color):
+        for grid in self.pages:
+            grid.color = color
+        if self.kv is not None:
+            self.kv.set_color(color)
+
+    def set_kv(self, store, text, pane=0):
+        # Switch to the dashboard view (see KVPane) for a `!kv` topic, where
+        # pane is this pane's index for its slots in store
+        if self.kv is None:
+            self.kv = KVPane(self.backend, self.x, self.y, self.w, self.h,
+                STALE_COLOR if self.stale else self.color, store.max_keys)
+            self.group.append(self.kv.group)
+        for grid in self.pages:
+            grid.hidden = True
+        self.kv.group.hidden = False
+        self.page_count = 0
+        self.kv.show(store, text, pane)
+
+    def set_pages(self, text, offsets):
+        # Lay out a new topic from its wrap_offsets() pairs, rows lines per
+        # page, then show the first page. Only cells that differ from what
+        # each page showed before get written. Leftover pages from a longer
+        # topic get blanked.
+        if self.kv is not None:
+            self.kv.group.hidden = True
+            self.kv.page_count = 0
+        lines = len(offsets) // 2
+        count = max(1, min(self.max_pages, (lines + self.rows - 1)
+            // self.rows))
+        for i in range(count):
+            grid = self._page_grid(i)
+            grid.set_lines(text, offsets, i * self.rows)
+            grid.hidden = i > 0
+        for grid in self.pages[count:]:
+            grid.set_lines('', ())
+            grid.hidden = True
+        self.page_count = count
+        self.page = 0
+
+    def patch(self, lines, changed):
+        # Rewrite just the rows of a `!pre` topic (lines is a list of its
+        # lines) for the line indexes in changed, leaving the rest of the
+        # pages alone. Returns False if the topic needs a different number of
+        # pages, in which case nothing changed and it needs set_pages().
+        rows = self.rows
+        count = max(1, min(self.max_pages, (len(lines) + rows - 1) // rows))
+        if count != self.page_count:
+            return False
+        for k in changed:
+            # Lines past the last page get cut off, same as set_pages()
+            if k < count * rows:
+                self.pages[k // rows].set_row(k % rows, lines[k])
+        return True
+
+    def flip(self):
+        # Show the next page. Returns True if anything changed.
+        if self.kv is not None and self.kv.page_count:
+            return self.kv.flip()
+        if self.page_count < 2:
+            return False
+        self.pages[self.page].hidden = True
+        self.page = (self.page + 1) % self.page_count
+        self.pages[self.page].hidden = False
+        return True
+
+
+class CharDisplay:
+    def __init__(self, panes=1, on_change=None, frame_s=0.1, max_pages=4,
+            series=None, backend=None):
+        # panes is the number of topic panes (1 to 4, see LAYOUTS), one per
+        # channel. Each pane can page through up to max_pages screens of
+        # topic text (see flip_pages()).
+        # backend is the display to draw on (see TFTBackend and
+        # open_backend()). The default is the TFT shield.
+        # series is the SeriesStore that `!kv` dashboard topics get their
+        # values and sparklines from. The caller adds samples to it, with
+        # the pane index so each pane has its own series.
+        # If on_change is None, set_status() and set_topic() refresh the
+        # display right away. Otherwise, they call on_change() and leave it
+        # up to the caller to schedule a call to refresh(), which merges
+        # changes according to the frame_s refresh budget.
+        if backend is None:
+            backend = TFTBackend()
+        group = backend.root
+        # System status textbox: one line, right aligned at the very top of
+        # display (52 characters at scale=1 on the TFT)
+        (cols, x, y) = backend.status
+        status = backend.grid(cols, 1, x, y, 1, 0x80ef00)
+        group.append(status.group)
+        # IRC topic textboxes, these are for IRC notifications. With one
+        # pane on the TFT, it's scale=3, 16 characters by 6 lines.
+        topics = [TopicPane(backend, *xywhs, PANE_COLORS[i],
+            max_pages=max_pages)
+            for (i, xywhs) in enumerate(backend.layouts[panes])]
+        for pane in topics:
+            group.append(pane.group)
         # Set an atexit handler to release the display once code.py
         # ends. This is an aesthetic filter to prevent CircuitPython's
         # supervisor from hijacking the display to show its own stuff.
         def atexit_shutdown_display():
             try:
-                status.text = 'OFFLINE'
-                display.refresh()
-                displayio.release_displays()
+                status.set_text('OFFLINE', align_right=True)
+                backend.refresh()
+                backend.release()
             except AttributeError:
                 pass
 
         atexit.register(atexit_shutdown_display)
-        self.display = display
+        self.backend = backend
         self.status = status
-        self.topic = topic
-        self.width = width
+        self.status_text = ''
+        self.panes = topics
+        self.on_change = on_change
+        self.scheduler = RefreshScheduler(backend, frame_s=frame_s)
+        self.wrap_cache = WrapCache(size=max(8, 2 * panes))
+        self.series = SeriesStore() if series is None else series
 
-    def hard_wrap(self, text):
-        w = self.width
-        return '\n'.join([text[i:i+w] for i in range(0, len(text), w)])
+    def hard_wrap(self, text, pane=0):
+        # Format a string to fit on a narrow pane by breaking every width
+        # characters
+        w = self.panes[pane].width
+        return join_lines(text, self.wrap_cache.get(text, w, 'hard'))
 
-    def word_wrap(self, text):
-        # Format a string to fit on a narrow screen by word-wrapping at spaces
-        w = self.width
-        lines = []
-        start = 0
-        prev_space = 0
-        for _ in range(len(text)):
-            space = text.find(' ', start)
-            if len(text) - start <= w:
-                # All the remaining text fits in one line without breaking
-                lines.append(text[start:])
-                start = len(text)
-                break
-            elif space == -1 or space - start > w:
-                # No space in the first width characters, so hard wrap
-                lines.append(text[start:start+w])
-                start += w
-            else:
-                # There's at least one space suitable for a line break
-                for _ in range(len(text)):
-                    next_space = text.find(' ', space + 1)
-                    if next_space == -1:
-                        break
-                    elif next_space - start <= w + 1:
-                        space = next_space
-                    else:
-                        break
-                lines.append(text[start:space])
-                start = space + 1
-        if start < len(text):
-            lines.append(text[start:])
-        return '\n'.join(lines)
+    def word_wrap(self, text, pane=0):
+        # Format a string to fit on a narrow pane by word-wrapping at spaces
+        w = self.panes[pane].width
+        return join_lines(text, self.wrap_cache.get(text, w, 'word'))
 
     def set_status(self, txt):
         # Show the message text the top status line
+        if txt == self.status_text:
+            self.scheduler.skipped += 1
+            return
         print("status =", txt)
-        self.status.text = txt
-        self.display.refresh()
+        self.status_text = txt
+        if _PROFILE:
+            t = time.monotonic_ns()
+        self.status.set_text(txt, align_right=True)
+        if _PROFILE:
+            stats.span(SPAN_LABEL, t)
+        self._changed()
 
-    def set_topic(self, txt, wrap=None):
-        # Show the message text in the 6x16 character display IRC topic area
-        print("topic =", txt)
-        if wrap == 'hard':
-            wrapped = self.hard_wrap(txt)
-        elif wrap == 'word' or wrap is None:
-            wrapped = self.word_wrap(txt)
-        elif wrap == 'pre':
-            wrapped = txt
-        self.topic.text = wrapped
-        self.display.refresh()
+    def set_topic(self, txt, wrap=None, pane=0, stale=False):
+        # Show the message text in one of the IRC topic panes. Other panes
+        # are left alone, so only this pane's area gets redrawn. Stale topics
+        # (e.g. from before a reset) get drawn in a dim color until a live
+        # topic replaces them. With wrap='kv', the pane shows a dashboard of
+        # the keys in txt, and it gets redrawn even if txt is the same as
+        # before, since the series may have new samples.
+        p = self.panes[pane]
+        kv = wrap == 'kv'
+        if stale != p.stale:
+            p.stale = stale
+            p.set_color(STALE_COLOR if stale else p.color)
+            if (txt, wrap) == p.key and not kv:
+                # Live topic matches the stale one, so only the color changed
+                self._changed()
+                return
+        if (txt, wrap) == p.key and not kv:
+            # Same topic as before (e.g. a 332 after a rejoin), so skip it
+            self.scheduler.skipped += 1
+            return
+        p.key = (txt, wrap)
+        print("topic %d =" % pane, txt)
+        if kv:
+            if _PROFILE:
+                t = time.monotonic_ns()
+            p.set_kv(self.series, txt, pane)
+            if _PROFILE:
+                stats.span(SPAN_LABEL, t)
+            self._changed()
+            return
+        if wrap is None:
+            wrap = 'word'
+        if _PROFILE:
+            t = time.monotonic_ns()
+        offsets = self.wrap_cache.get(txt, p.width, wrap)
+        if _PROFILE:
+            t = stats.span(SPAN_WRAP, t)
+        p.set_pages(txt, offsets)
+        if _PROFILE:
+            stats.span(SPAN_LABEL, t)
+        self._changed()
+
+    def patch_topic(self, lines, changed, pane=0, stale=False):
+        # Show a `!pre` topic that got patched with `!set`, where lines is
+        # the pane's sb_delta.TopicLines and changed has the indexes of the
+        # lines that changed. If the pane is showing the topic from before
+        # the patch, only the rows of those lines get laid out and written.
+        # Otherwise (e.g. it's showing something else, or the page count
+        # changed), this falls back to set_topic() for the whole thing.
+        p = self.panes[pane]
+        if stale != p.stale or p.key != (lines.prev, 'pre'):
+            self.set_topic(lines.text, 'pre', pane, stale)
+            return
+        if not changed:
+            self.scheduler.skipped += 1
+            return
+        if _PROFILE:
+            t = time.monotonic_ns()
+        if not p.patch(lines.lines, changed):
+            self.set_topic(lines.text, 'pre', pane, stale)
+            return
+        if _PROFILE:
+            stats.span(SPAN_LABEL, t)
+        p.key = (lines.text, 'pre')
+        print("topic %d lines %s =" % (pane, ','.join([str(k + 1)
+            for k in changed])), ' / '.join([lines.lines[k] for k in changed]))
+        self._changed()
+
+    def pane_at(self, x, y):
+        # Return the index of the pane that contains display point (x, y),
+        # or -1 if it's not in one (e.g. on the status line)
+        for (i, p) in enumerate(self.panes):
+            if p.x <= x < p.x + p.w and p.y <= y < p.y + p.h:
+                return i
+        return -1
+
+    def paged(self):
+        # Return True if any pane has more than one page to flip through
+        for p in self.panes:
+            if p.page_count > 1 or (p.kv is not None and p.kv.page_count > 1):
+                return True
+        return False
+
+    def flip_pages(self):
+        # Show the next page of every pane that has more than one. This only
+        # changes which page grids are hidden, so no text gets laid out.
+        changed = False
+        for p in self.panes:
+            changed = p.flip() or changed
+        if changed:
+            self._changed()
+        return changed
+
+    def _changed(self):
+        self.scheduler.mark()
+        if self.on_change is None:
+            self.scheduler.refresh(force=True)
+        else:
+            self.on_change()
+
+    def refresh(self, force=False):
+        # Push pending text changes to the display, if the frame budget
+        # allows it (or if force=True). Returns True if it refreshed.
+        return self.scheduler.refresh(force)
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# Line patches for `!pre` topics. Rather than sending the whole `!pre` topic
+# again when one reading changes, a sensor hub can send a `!set` topic with
+# just the lines that changed, in one of two forms (line numbers start at 1):
+#
+# - `!set 3 /new text`: replace line 3. Like `!pre`, the first character
+#   after the number is the line delimiter, so `!set 3 /a/b` replaces lines
+#   3 and 4.
+# - `!set /1=temp 21.6C/3=co2 615ppm`: replace each numbered line. The first
+#   character is the delimiter between patches.
+#
+# TopicLines keeps the lines of the last `!pre` topic for a pane so patches
+# can be applied to it. The channel topic on the server only holds the last
+# patch, so after a reconnect (or a reset, with the lines from the warm
+# start) the bot can't know what it missed. desync() marks every line as
+# unsure, and until patches have replaced each of them or a full `!pre`
+# topic arrives, the pane is out of sync and gets drawn dimmed.
+#
+
+
+def _line_number(s):
+    # Return s as a line number, or 0 if it isn't one. Only ASCII digits
+    # count, since str.isdigit() is also True for characters like '²' that
+    # int() rejects.
+    n = 0
+    for c in s:
+        if not '0' <= c <= '9':
+            return 0
+        n = n * 10 + ord(c) - 0x30
+    return n
+
+
+def parse_set(body):
+    # Parse the part of a `!set` topic after `!set `. Returns a list of
+    # (line index, text) patches with indexes starting at 0, or None if
+    # there aren't any.
+    if not body:
+        return None
+    out = []
+    if '0' <= body[0] <= '9':
+        (n, _, rest) = body.partition(' ')
+        if not ((n := _line_number(n)) and rest):
+            return None
+        first = n - 1
+        for (k, line) in enumerate(rest[1:].split(rest[0])):
+            out.append((first + k, line))
+        return out
+    for part in body[1:].split(body[0]):
+        (n, eq, line) = part.partition('=')
+        if eq and (n := _line_number(n)):
+            out.append((n - 1, line))
+    return out or None
+
+
+class TopicLines:
+    # Lines of a pane's `!pre` topic, with patches applied. text is the
+    # lines joined with '\n' (the form CharDisplay, TopicHistory, and
+    # WarmStart use), and prev is text before the last apply().
+
+    def __init__(self, max_lines=24):
+        # Patches for lines past max_lines get ignored, so a bad line
+        # number can't use up the heap. The default is enough for a one pane
+        # topic at the maximum of 4 pages.
+        self.max_lines = max_lines
+        self.lines = []
+        self.text = ''
+        self.prev = ''
+        self.synced = False
+        self.unsure = 0        # bit k set = line k may be out of date
+
+    def reset(self):
+        # The pane moved on to another kind of topic, so forget the lines
+        self.lines = []
+        self.text = self.prev = ''
+        self.synced = False
+        self.unsure = 0
+
+    def load(self, text):
+        # Start over from a full `!pre` topic
+        self.lines = text.split('\n')
+        self.prev = self.text
+        self.text = text
+        self.synced = True
+        self.unsure = 0
+
+    def desync(self):
+        # Patches may have been missed (see comment at top)
+        self.synced = False
+        self.unsure = (1 << len(self.lines)) - 1
+
+    def apply(self, patches):
+        # Apply (line index, text) patches. Returns the indexes of the lines
+        # that changed.
+        lines = self.lines
+        changed = []
+        for (k, line) in patches:
+            if k >= self.max_lines:
+                continue
+            while len(lines) <= k:
+                # Lines in between are blank, or unknown if out of sync
+                if not self.synced:
+                    self.unsure |= 1 << len(lines)
+                lines.append('')
+            self.unsure &= ~(1 << k)
+            if lines[k] != line:
+                lines[k] = line
+                if k not in changed:
+                    changed.append(k)
+        if not self.synced and not self.unsure:
+            self.synced = True
+        self.prev = self.text
+        if changed:
+            self.text = '\n'.join(lines)
+        return changed
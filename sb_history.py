@@ -0,0 +1,105 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# History of recent topics for touch scrollback. Topic text is stored as
+# UTF-8 in one preallocated bytearray ring, with a fixed size index of
+# (offset, length, pane, wrap mode) for each entry. Pushing a topic copies
+# its bytes into the ring and evicts the oldest entries that are in the way,
+# so memory use stays the same no matter how many topics arrive. Strings only
+# get made when an entry is read back for drawing.
+#
+from array import array
+
+
+# Wrap modes by index (same order as sb_warmstart)
+_WRAPS = (None, 'word', 'hard', 'pre', 'kv')
+
+
+class TopicHistory:
+
+    def __init__(self, size=4096, slots=32):
+        # size is the ring size in bytes (at most 65535), and slots is the
+        # most entries it can index. Topics longer than size/2 bytes get
+        # truncated.
+        self.buf = bytearray(size)
+        self.starts = array('H', [0] * slots)
+        self.lens = array('H', [0] * slots)
+        self.meta = array('B', [0] * slots)   # pane << 3 | wrap mode index
+        self.slots = slots
+        self.head = 0          # slot for the next entry
+        self.n = 0             # entries in use
+        self.pos = 0           # ring offset for the next entry's bytes
+
+    def _slot(self, age):
+        # Slot of the entry age steps back from the newest (0 = newest)
+        return (self.head - 1 - age) % self.slots
+
+    def push(self, pane, text, wrap):
+        # Add a topic for pane, unless it's the same as the newest one there
+        data = text.encode()
+        n = len(data)
+        size = len(self.buf)
+        if n > size // 2:
+            # Truncate, but not in the middle of a UTF-8 sequence
+            n = size // 2
+            while n and (data[n] & 0xc0) == 0x80:
+                n -= 1
+        meta = (pane << 3) | _WRAPS.index(wrap)
+        if (age := self._find(pane, 0)) >= 0:
+            s = self._slot(age)
+            if (self.meta[s] == meta and self.lens[s] == n
+                    and self.buf[self.starts[s]:self.starts[s]+n] == data[:n]):
+                return False
+        # Entries are stored contiguously, so if this one doesn't fit before
+        # the end of the ring, it starts over at 0 and the tail goes unused
+        pos = self.pos
+        need = n
+        if pos + n > size:
+            need += size - pos
+        # Evict the oldest entries until there's room. Entries are in age
+        # order around the ring starting at pos, so the oldest entry's
+        # distance ahead of pos is the free space.
+        while self.n and ((self.n == self.slots) or
+                (self.starts[self._slot(self.n - 1)] - pos) % size < need):
+            self.n -= 1
+        if pos + n > size:
+            pos = 0
+        self.buf[pos:pos+n] = data[:n] if n < len(data) else data
+        s = self.head
+        self.starts[s] = pos
+        self.lens[s] = n
+        self.meta[s] = meta
+        self.head = (s + 1) % self.slots
+        self.n += 1
+        self.pos = (pos + n) % size
+        return True
+
+    def _find(self, pane, back):
+        # Return the age of the entry for pane that is back steps before its
+        # newest one, or -1 if there isn't one
+        for age in range(self.n):
+            if self.meta[self._slot(age)] >> 3 == pane:
+                if back == 0:
+                    return age
+                back -= 1
+        return -1
+
+    def count(self, pane):
+        # Number of entries for pane
+        k = 0
+        for age in range(self.n):
+            if self.meta[self._slot(age)] >> 3 == pane:
+                k += 1
+        return k
+
+    def get(self, pane, back=0):
+        # Return (text, wrap) for pane, back steps before its newest entry,
+        # or None if there aren't that many
+        if (age := self._find(pane, back)) < 0:
+            return None
+        s = self._slot(age)
+        start = self.starts[s]
+        text = str(self.buf[start:start+self.lens[s]], 'utf-8')
+        return (text, _WRAPS[self.meta[s] & 7])
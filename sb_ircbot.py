@@ -3,162 +3,1104 @@
 #
 # See NOTES.md for documentation links and pinout info.
 #
-import re
+from array import array
+import asyncio
+from micropython import const
+import random
 import socketpool
+import time
 import wifi
 
+from sb_stats import (stats, CNT_BYTES, CNT_CONNECTS, CNT_DROPS, CNT_LINES,
+    CNT_MISSES, CNT_PINGS, CNT_SENT, CNT_TX_DROPS, CNT_WAKES, SPAN_DISPATCH,
+    SPAN_FRAME, SPAN_PARSE, SPAN_RECV)
 
-class IRCBot:
-    def __init__(self, nick, chan, server, port=6667):
-        self.rx_buf = bytearray(512)
-        self.line_buf = bytearray(512)
-        self.pool = socketpool.SocketPool(wifi.radio)
-        self.sock = self.pool.socket()     # defaults to IP + TCP
+
+# Build flag for timing spans (see sb_stats.py). 0 compiles them out.
+_PROFILE = const(1)
+
+# IRC command codes for IRCMessage.cmd. Numeric replies use their own number
+# as their code, and verbs get codes above the 3-digit numeric range.
+CMD_UNKNOWN = const(0)
+RPL_TOPIC = const(332)
+ERR_NICKNAMEINUSE = const(433)
+CMD_PING = const(1001)
+CMD_PONG = const(1002)
+CMD_JOIN = const(1003)
+CMD_PART = const(1004)
+CMD_QUIT = const(1005)
+CMD_NICK = const(1006)
+CMD_MODE = const(1007)
+CMD_TOPIC = const(1008)
+CMD_PRIVMSG = const(1009)
+CMD_NOTICE = const(1010)
+CMD_ERROR = const(1011)
+
+
+# Link states for on_link() handlers
+LINK_DOWN = const(0)    # not connected and registered
+LINK_UP = const(1)      # registered, and PINGs are getting answered
+LINK_LATE = const(2)    # the last PING went unanswered
+LINK_DEAD = const(3)    # too many PINGs went unanswered, so it hung up
+LINK_NAMES = ('down', 'up', 'late', 'dead')
+
+# Upper bounds (ms) of the PING round trip time histogram buckets. The last
+# bucket is for everything slower.
+RTT_BOUNDS = (10, 20, 50, 100, 200, 500, 1000)
+
+# Longest blocking read (seconds) while there are still messages to send
+_TX_POLL_S = 0.05
+
+# How often (seconds) to check on connection attempts in progress
+_CONNECT_POLL_S = 0.02
+
+# errno values (ESP32 port) from connect() on a non-blocking socket while
+# the connection is still on its way: EAGAIN, ETIMEDOUT, EINPROGRESS, and
+# EALREADY. Once it's up, connect() returns or raises EISCONN.
+_CONNECTING = (11, 116, 119, 120)
+_EISCONN = const(127)
+
+# Commands that always pass the pre-filter (for JOIN, only our own joins)
+_ALWAYS_ALLOW = (CMD_PING, CMD_PONG, ERR_NICKNAMEINUSE, RPL_TOPIC, CMD_TOPIC,
+    CMD_JOIN)
+
+
+def _find_space(buf, start, end):
+    # Return the index of the first space in buf[start:end], or end if there
+    # isn't one. Use the C find() for bytes and bytearray, but memoryview has
+    # no find(), so it gets a loop.
+    if isinstance(buf, memoryview):
+        while start < end and buf[start] != 0x20:
+            start += 1
+        return start
+    i = buf.find(b' ', start, end)
+    return end if i < 0 else i
+
+
+# Verb lookup table: (first byte << 4) + length -> [(code, verb), ...]. This
+# key can be computed from the line buffer without slicing it.
+_VERBS = {}
+for (_code, _verb) in (
+        (CMD_PING, b'PING'), (CMD_PONG, b'PONG'), (CMD_JOIN, b'JOIN'),
+        (CMD_PART, b'PART'), (CMD_QUIT, b'QUIT'), (CMD_NICK, b'NICK'),
+        (CMD_MODE, b'MODE'), (CMD_TOPIC, b'TOPIC'),
+        (CMD_PRIVMSG, b'PRIVMSG'), (CMD_NOTICE, b'NOTICE'),
+        (CMD_ERROR, b'ERROR')):
+    _VERBS.setdefault((_verb[0] << 4) + len(_verb), []).append((_code, _verb))
+del _code, _verb
+
+
+class IRCMessage:
+    # This is a fixed-shape parse result for one IRC line. The parser only
+    # records offsets into buf, so nothing gets sliced or decoded unless a
+    # handler asks for it with prefix(), command(), or params().
+    #
+    # The point of this is to avoid heap allocations, not speed. Parsing a
+    # line the old way took a decoded str, a match object, and a str per
+    # group, which adds up to a lot of garbage on a busy channel. On
+    # CPython, the regex runs in C and is faster than this byte by byte
+    # scan (see bench_irc.py).
+    #
+    # CAUTION!!! When buf is IRCBot.rx_buf, the offsets are only valid until
+    # the next call to IRCBot.recv_msg().
+    #
+    def __init__(self):
+        self.buf = None
+        self.cmd = CMD_UNKNOWN
+        self.prefix_start = 0   # prefix includes its leading ':'
+        self.prefix_end = 0     # prefix_end == prefix_start means no prefix
+        self.cmd_start = 0
+        self.cmd_end = 0
+        self.params_start = 0
+        self.params_end = 0
+
+    def parse(self, buf, start=0, end=-1):
+        # Parse an IRC line (no CRLF) from buf[start:end], where buf can be
+        # bytes, bytearray, or memoryview. This works like the old regex,
+        # `^((:\S+)\s+)?(\S+)\s*(.*)`, except that only spaces separate
+        # fields (RFC 1459 2.3.1). Returns self, or None if there is no
+        # command.
+        if end < 0:
+            end = len(buf)
+        i = start
+        # Optional prefix
+        p_end = start
+        if i < end and buf[i] == 0x3a:      # ':'
+            p_end = _find_space(buf, i, end)
+            i = p_end
+            while i < end and buf[i] == 0x20:
+                i += 1
+            if p_end - start < 2 or i == p_end or i == end:
+                # Empty prefix or prefix with nothing after it is really
+                # the command
+                i = p_end = start
+        # Command or number
+        c_start = i
+        c_end = i = _find_space(buf, i, end)
+        if c_end == c_start:
+            return None
+        while i < end and buf[i] == 0x20:
+            i += 1
+        # Intern the command as an integer code
+        code = CMD_UNKNOWN
+        n = c_end - c_start
+        if n == 3 and (0x30 <= buf[c_start] <= 0x39
+                and 0x30 <= buf[c_start+1] <= 0x39
+                and 0x30 <= buf[c_start+2] <= 0x39):
+            code = ((buf[c_start] - 0x30) * 100
+                + (buf[c_start+1] - 0x30) * 10 + (buf[c_start+2] - 0x30))
+        elif n < 16 and (hits := _VERBS.get((buf[c_start] << 4) + n)):
+            for (hit_code, verb) in hits:
+                if self._match(buf, c_start, verb):
+                    code = hit_code
+                    break
+        self.buf = buf
+        self.cmd = code
+        self.prefix_start = start
+        self.prefix_end = p_end
+        self.cmd_start = c_start
+        self.cmd_end = c_end
+        self.params_start = i
+        self.params_end = end
+        return self
+
+    @staticmethod
+    def _match(buf, start, pattern):
+        # Compare pattern (bytes) against buf at start without slicing
+        end = start + len(pattern)
+        if end > len(buf):
+            return False
+        if not isinstance(buf, memoryview):
+            return buf.find(pattern, start, end) == start
+        for (i, c) in enumerate(pattern):
+            if buf[start+i] != c:
+                return False
+        return True
+
+    def prefix_startswith(self, pattern):
+        # Check if prefix starts with pattern (type bytes)
+        if self.prefix_end - self.prefix_start < len(pattern):
+            return False
+        return self._match(self.buf, self.prefix_start, pattern)
+
+    def params_startswith(self, pattern, offset=0):
+        # Check if params (skipping offset bytes) starts with pattern (bytes)
+        start = self.params_start + offset
+        if self.params_end - start < len(pattern):
+            return False
+        return self._match(self.buf, start, pattern)
+
+    def params_endswith(self, pattern):
+        # Check if params ends with pattern (bytes)
+        start = self.params_end - len(pattern)
+        if start < self.params_start:
+            return False
+        return self._match(self.buf, start, pattern)
+
+    def prefix(self):
+        # Return prefix as a string, or None if there was no prefix
+        if self.prefix_end == self.prefix_start:
+            return None
+        return str(self.buf[self.prefix_start:self.prefix_end], 'utf-8')
+
+    def command(self):
+        # Return the command or numeric reply as a string
+        return str(self.buf[self.cmd_start:self.cmd_end], 'utf-8')
+
+    def params(self, offset=0):
+        # Return params as a string, optionally skipping offset bytes
+        start = min(self.params_start + offset, self.params_end)
+        return str(self.buf[start:self.params_end], 'utf-8')
+
+
+class ServerList:
+    # IRC servers in order of preference, each with its own exponential
+    # backoff. A server that fails gets retried after retry_s seconds,
+    # doubling with each failure up to retry_max_s. Every backoff gets up to
+    # a jitter fraction added or taken off, so a room full of displays that
+    # lost the same server don't all come back to it at the same moment.
+
+    def __init__(self, servers, port=6667, retry_s=5, retry_max_s=180,
+            jitter=0.25):
+        # servers can be a comma separated string or a list of `host` or
+        # `host:port` entries. port is for the ones without a port.
+        if isinstance(servers, str):
+            servers = servers.split(',')
+        self.addrs = []
+        for s in servers:
+            if s := s.strip():
+                (host, _, p) = s.partition(':')
+                self.addrs.append((host, int(p) if p else port))
+        self.retry_s = retry_s
+        self.retry_max_s = retry_max_s
+        self.jitter = jitter
+        self.retry = [retry_s] * len(self.addrs)    # next backoff
+        self.due = [0] * len(self.addrs)            # time of next try
+
+    def ready(self, now, end=None):
+        # Return the indexes of the servers before end (default all of them)
+        # whose backoff has run out, most preferred first
+        due = self.due
+        return [i for i in range(len(due) if end is None else end)
+            if due[i] <= now]
+
+    def delay(self, now, end=None):
+        # Seconds until one of the servers before end can be tried
+        if not (due := self.due[:end]):
+            return self.retry_max_s
+        return max(0, min(due) - now)
+
+    def failed(self, i, now):
+        # Back off from server i
+        r = self.retry[i]
+        self.due[i] = now + r * (1 + random.uniform(-self.jitter,
+            self.jitter))
+        self.retry[i] = min(self.retry_max_s, r * 2)
+
+    def worked(self, i):
+        # Server i got as far as joining, so its backoff starts over
+        self.retry[i] = self.retry_s
+
+
+class _IRCBotBase:
+    # This has the connection state, line framing, and parsing that are
+    # shared by AsyncIRCBot and IRCBot. The subclasses only differ in how
+    # they wait for the socket.
+
+    def __init__(self, nick, chans, server, port=6667, pool=None,
+            retry_s=5, retry_max_s=180):
+        # chans can be one channel name, a comma separated string of channel
+        # names, or a list of them. They all get joined over the same
+        # connection. server can be one server or a list of them in order of
+        # preference (see ServerList), port is the default port, and
+        # retry_s and retry_max_s set each server's backoff. pool can be any
+        # object with a socketpool.SocketPool style socket() method (e.g.
+        # sb_capture.ReplayPool). The default is the wifi pool.
+        self.rx_buf = bytearray(1024)      # ring buffer for line framing
+        self.rx_mv = memoryview(self.rx_buf)
+        self.max_line = 512
+        if pool is None:
+            pool = socketpool.SocketPool(wifi.radio)
+        self.pool = pool
+        self.recorder = None    # set to an sb_capture recorder to record
+        self.sock = None
         self.nick = nick
-        self.chan = chan
-        self.server = server
-        self.port = port
+        if isinstance(chans, str):
+            chans = chans.split(',')
+        self.chans = [c.strip() for c in chans if c.strip()]
+        # Failover: connect() races connections to the servers whose backoff
+        # has run out, starting one every stagger_s seconds in order of
+        # preference, and the first to connect wins. While connected to a
+        # backup, keepalive() tries the more preferred servers as their
+        # backoff runs out and switches back to the first one that answers.
+        self.servers = ServerList(server or '', port, retry_s, retry_max_s)
+        self.server_i = -1      # index in servers of the current server
+        (self.server, self.port) = (self.servers.addrs or [(None, port)])[0]
+        self.stagger_s = 0.25
+        self._pending = []      # [server index, socket, connected] attempts
+        self._order = []        # servers left to try in this race
+        self._next_try = 0
+        self._race_end = 0
         self.connected = False
         self.registered = False
         self.connect_timeout = 10
-        self._recv_line_iterator = None
-        self.irc_re = re.compile(
-            br'^((:\S+)\s+)?'      # optional prefix   (match group 2)
-            br'(\S+)\s*'           # command or number (match group 3)
-            br'(.*)'               # params            (match group 4)
-        )
+        self.last_rx = time.monotonic()
+        self.msg = IRCMessage()
+        self.joined = False
+        self._timeout = None
+        self._rx_reset()
+        # Outbound queue: send() copies messages into tx_buf, then flush()
+        # writes them out with non-blocking send() calls from the receive
+        # path, so several queued messages go out in one write. tx_buf is a
+        # hard cap on queued bytes. When the link backs up, new messages get
+        # dropped rather than growing the heap. Flood control is a token
+        # bucket of whole messages: bursts of up to tx_burst, then tx_rate
+        # messages per second.
+        self.tx_buf = bytearray(1024)
+        self.tx_mv = memoryview(self.tx_buf)
+        self.tx_burst = 5
+        self.tx_rate = 0.5
+        self._tx_reset()
+        # Keepalive: when the link has been quiet for ping_s seconds, the bot
+        # sends its own PING. ping_s starts at ping_min_s and doubles with
+        # each answered PING up to ping_max_s, then drops back to ping_min_s
+        # after a miss. A PING counts as missed if nothing at all arrives
+        # within a few round trip times, and ping_misses misses in a row
+        # means the link is dead.
+        self.ping_min_s = 10
+        self.ping_max_s = 30
+        self.ping_misses = 2
+        self.ping_s = self.ping_min_s
+        self.misses = 0
+        self.link = LINK_DOWN
+        self.rtt_ms = -1        # last PING round trip time (-1 = none yet)
+        self.srtt_ms = -1       # smoothed round trip time
+        self.rtt_hist = array('L', [0] * (len(RTT_BOUNDS) + 1))
+        self._ping_seq = 0
+        self._ping_key = b''    # end of the expected PONG params
+        self._ping_sent = 0     # time.monotonic() of unanswered PING, or 0
+        self._ping_ns = 0
+        self._link_handler = None
+        # Command dispatch table: command code -> handler(msg)
+        self.handlers = {CMD_PING: self._on_ping, CMD_PONG: self._on_pong}
+        # Pre-filter: when filter is True, only messages with commands in
+        # allowed (plus _ALWAYS_ALLOW) get past the framing layer. Others
+        # get counted in drops (command code -> count) without ever being
+        # decoded. IRCBot turns it off (see IRCBot.__init__()).
+        self.filter = True
+        self.allowed = set()
+        self.drops = {}
+        self._join_handler = None
+        self._topic_handler = None
+        self._stats_handler = None
+        self._privmsg_handler = None
+        self._idle_handler = None
+        self._make_keys()
+
+    def _rx_reset(self):
+        self._rx_start = 0     # start of oldest unconsumed line
+        self._rx_scan = 0      # where to resume searching for CRLF
+        self._rx_end = 0       # end of received data
+        self._rx_skip = False  # True while discarding an over-long line
+        self._line_start = 0   # bounds of the most recently framed line
+        self._line_end = 0
+
+    def _tx_reset(self):
+        self._tx_start = 0     # start of unsent bytes
+        self._tx_paid = 0      # end of messages that flood control allowed
+        self._tx_end = 0       # end of queued bytes
+        self._tokens = self.tx_burst
+        self._tokens_t = time.monotonic()
+
+    def _settimeout(self, timeout):
+        # Only change the socket timeout when it actually changes
+        if timeout != self._timeout:
+            self.sock.settimeout(timeout)
+            self._timeout = timeout
+
+    def _make_keys(self):
+        # Precompute the byte strings that handlers match against, so nothing
+        # gets formatted per message. This runs again at each connect in case
+        # nick or chans changed. The topic keys are lists in the same order
+        # as chans.
+        self.key_nick = (':%s!' % self.nick).encode()        # JOIN prefix
+        self.key_332 = [('%s %s :' % (self.nick, c)).encode()
+            for c in self.chans]
+        self.key_topic = [('%s :' % c).encode() for c in self.chans]
+        self.key_stats = [k + b'!stats' for k in self.key_topic]  # PRIVMSG
+        self.key_ctcp_stats = ('%s :\x01STATS' % self.nick).encode()
+
+    def on(self, code, handler):
+        # Register handler(msg) for an IRCMessage command code. To handle a
+        # new command, register a handler rather than adding to the main loop.
+        # A CMD_PRIVMSG handler works alongside on_stats(): it gets every
+        # PRIVMSG that isn't a stats request.
+        if code == CMD_PRIVMSG:
+            self._privmsg_handler = handler
+            if self._stats_handler is not None:
+                handler = self._on_privmsg
+        self.handlers[code] = handler
+        self.allowed.add(code)
+
+    def allow(self, *codes):
+        # Let more command codes through the pre-filter
+        for code in codes:
+            self.allowed.add(code)
+
+    def _allow(self, msg):
+        # Pre-filter check using only the parsed offsets (no decoding)
+        code = msg.cmd
+        if code in self.allowed:
+            return True
+        if code == CMD_PRIVMSG and self._stats_handler is not None:
+            # Only stats requests, not the rest of the channel chatter
+            return self._stats_key(msg) >= 0
+        if code in _ALWAYS_ALLOW:
+            return code != CMD_JOIN or msg.prefix_startswith(self.key_nick)
+        return False
+
+    def on_join(self, handler):
+        # Register handler(chan) for when this bot joins a channel. Joins by
+        # other users get ignored without decoding anything.
+        self._join_handler = handler
+        self.handlers[CMD_JOIN] = self._on_join
+
+    def on_topic(self, handler):
+        # Register handler(i, text) for topic text from 332 (topic on join)
+        # or TOPIC (topic change), where i is the index of the channel in
+        # chans. Topics for other channels get ignored without decoding
+        # anything.
+        self._topic_handler = handler
+        self.handlers[RPL_TOPIC] = self._on_rpl_topic
+        self.handlers[CMD_TOPIC] = self._on_topic
+
+    def on_stats(self, handler):
+        # Register handler() for `!stats` in one of our channels, or a CTCP
+        # STATS request to our nick. handler() returns a one line summary,
+        # which goes back to where the request came from. Other PRIVMSGs get
+        # dropped by the pre-filter without decoding anything, unless there
+        # is also an on() handler for CMD_PRIVMSG, which then gets them.
+        self._stats_handler = handler
+        self.handlers[CMD_PRIVMSG] = self._on_privmsg
+
+    def on_link(self, handler):
+        # Register handler(state, rtt_ms) for link state changes and new
+        # round trip times. state is one of the LINK_* codes, and rtt_ms is
+        # the last round trip time (-1 if there isn't one yet).
+        self._link_handler = handler
+
+    def on_idle(self, handler):
+        # Register handler() to call when AsyncIRCBot runs out of received
+        # lines and is about to block on the socket. handler() returns the
+        # seconds to block for, or None for idle_timeout. (The power policy
+        # in sb_power.py uses this to drop the CPU clock and to wake up in
+        # time for the next timer task.)
+        self._idle_handler = handler
+
+    def _set_link(self, state, rtt_changed=False):
+        if state != self.link or rtt_changed:
+            self.link = state
+            if self._link_handler is not None:
+                self._link_handler(state, self.rtt_ms)
+
+    def dispatch(self, msg):
+        # Call the handler for msg, if there is one
+        if (handler := self.handlers.get(msg.cmd)) is not None:
+            if _PROFILE:
+                t = time.monotonic_ns()
+            handler(msg)
+            if _PROFILE:
+                stats.span(SPAN_DISPATCH, t)
+
+    def _on_ping(self, msg):
+        # Auto-PONG to keep the connection alive
+        self.send('PONG %s\r\n' % msg.params())
+
+    def _on_pong(self, msg):
+        # Typical format: `:irc.local PONG irc.local :sb12`. Only the reply
+        # to the latest PING gives a round trip time.
+        if not self._ping_sent or not msg.params_endswith(self._ping_key):
+            return
+        ms = (time.monotonic_ns() - self._ping_ns) // 1000000
+        self._ping_sent = 0
+        self.misses = 0
+        self.rtt_ms = ms
+        self.srtt_ms = ms if self.srtt_ms < 0 else (7 * self.srtt_ms + ms) >> 3
+        i = 0
+        while i < len(RTT_BOUNDS) and ms >= RTT_BOUNDS[i]:
+            i += 1
+        self.rtt_hist[i] += 1
+        self.ping_s = min(self.ping_max_s, self.ping_s * 2)
+        self._set_link(LINK_UP, rtt_changed=True)
+
+    def _rto(self):
+        # Seconds to wait for a PONG: 4 smoothed round trips, but at least 2
+        # seconds (5 before the first sample) and at most 10
+        if self.srtt_ms < 0:
+            return 5
+        return min(max(self.srtt_ms * 4, 2000), 10000) / 1000
+
+    def _ping(self, now):
+        # Send a PING with a fresh token. Returns seconds to wait for the
+        # PONG, or ping_min_s if the link got closed because the outbound
+        # queue is full.
+        self._ping_seq = (self._ping_seq + 1) & 0xffff
+        token = 'sb%d' % self._ping_seq
+        self._ping_key = (':' + token).encode()
+        self._ping_sent = now
+        self._ping_ns = time.monotonic_ns()
+        stats.count(CNT_PINGS)
+        if not self.send('PING :%s\r\n' % token):
+            self._set_link(LINK_DEAD)
+            self.close()
+            return self.ping_min_s
+        # Flush now rather than waiting for the receive path, so the round
+        # trip time doesn't include the wait
+        self.flush()
+        return self._rto()
+
+    def keepalive(self):
+        # Call this periodically. It sends a PING when the link has been
+        # quiet for ping_s seconds and hangs up after ping_misses unanswered
+        # PINGs in a row, so the caller can reconnect. On a backup server,
+        # it also tries to get back to a more preferred one. Returns the
+        # number of seconds until it needs to be called again.
+        delay = self._keepalive()
+        if self.registered and self.server_i > 0:
+            delay = min(delay, self._failback())
+        return delay
+
+    def _keepalive(self):
+        if not self.registered:
+            return self.ping_min_s
+        now = time.monotonic()
+        if sent := self._ping_sent:
+            if (due := sent + self._rto()) > now:
+                return due - now
+            self._ping_sent = 0
+            if self.last_rx > sent:
+                # Other traffic got through, so the link is alive even
+                # though the PONG is slow
+                self.misses = 0
+            else:
+                self.misses += 1
+                stats.count(CNT_MISSES)
+                self.ping_s = self.ping_min_s
+                if self.misses >= self.ping_misses:
+                    print('IRC link dead: %d PINGs unanswered' % self.misses)
+                    self._set_link(LINK_DEAD)
+                    self.close()
+                    return self.ping_min_s
+                # Try again right away
+                self._set_link(LINK_LATE)
+                return self._ping(now)
+        if (idle := now - self.last_rx) < self.ping_s:
+            return self.ping_s - idle
+        return self._ping(now)
+
+    def rtt_summary(self):
+        # One line summary of PING round trips: last and smoothed time (ms),
+        # then the histogram counts for each RTT_BOUNDS bucket
+        return 'rtt %d/%dms %s' % (self.rtt_ms, self.srtt_ms,
+            ','.join([str(n) for n in self.rtt_hist]))
+
+    def _on_join(self, msg):
+        # Typical prefix+cmd+params format: `:tftbot!~u@host JOIN :#sensors`
+        if msg.prefix_startswith(self.key_nick):
+            self.joined = True
+            self._join_handler(msg.params(1))    # skip leading ':'
+
+    def _on_rpl_topic(self, msg):
+        # Typical cmd+params format: `332 tftbot #sensors :!pre /...`
+        for (i, key) in enumerate(self.key_332):
+            if msg.params_startswith(key):
+                self._topic_handler(i, msg.params(len(key)))
+                return
+
+    def _on_topic(self, msg):
+        # Typical cmd+params format: `TOPIC #sensors :!pre /...`
+        for (i, key) in enumerate(self.key_topic):
+            if msg.params_startswith(key):
+                self._topic_handler(i, msg.params(len(key)))
+                return
+
+    def _stats_key(self, msg):
+        # Match a PRIVMSG against the stats request keys. Returns the index
+        # in chans for `!stats` in a channel, len(chans) for CTCP STATS, or
+        # -1 if it isn't a stats request. The key has to be a whole word, so
+        # `!statsfoo` doesn't count.
+        for (i, key) in enumerate(self.key_stats):
+            if msg.params_startswith(key) and self._word_end(msg, len(key)):
+                return i
+        key = self.key_ctcp_stats
+        if msg.params_startswith(key) and self._word_end(msg, len(key)):
+            return len(self.chans)
+        return -1
+
+    @staticmethod
+    def _word_end(msg, offset):
+        # Check if params ends at offset or has a space (or the \x01 that
+        # closes a CTCP request) there
+        i = msg.params_start + offset
+        return i == msg.params_end or msg.buf[i] in (0x20, 0x01)
+
+    def _on_privmsg(self, msg):
+        # Typical formats: `:hub!~u@host PRIVMSG #sensors :!stats` or
+        # `:hub!~u@host PRIVMSG tftbot :\x01STATS\x01` (CTCP)
+        if (i := self._stats_key(msg)) < 0:
+            if self._privmsg_handler is not None:
+                self._privmsg_handler(msg)
+            return
+        if i < len(self.chans):
+            self.send('PRIVMSG %s :%s\r\n' % (self.chans[i],
+                self._stats_handler()))
+        elif (prefix := msg.prefix()) is not None:
+            # CTCP replies go back to the sender's nick as a NOTICE (so
+            # without a prefix, there's nobody to reply to)
+            sender = prefix[1:].split('!', 1)[0]
+            self.send('NOTICE %s :\x01STATS %s\x01\r\n' % (sender,
+                self._stats_handler()))
 
     def close(self):
-        self.sock.close()
+        # This leaves joined alone, so the caller can still tell whether the
+        # connection made it that far. It gets cleared at the next connect.
+        # Closing a connection counts against its server's backoff, which
+        # starts over if the connection got as far as joining.
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+            if (i := self.server_i) >= 0:
+                if self.joined:
+                    self.servers.worked(i)
+                self.servers.failed(i, time.monotonic())
+        self._abort()
         self.connected = False
         self.registered = False
+        self._ping_sent = 0
+        self._tx_reset()
+        if self.link != LINK_DEAD:
+            self._set_link(LINK_DOWN)
 
-    def connect(self):
+    def retry_delay(self):
+        # Seconds until the backoff runs out for one of the servers
+        return self.servers.delay(time.monotonic())
+
+    def _race_start(self):
+        # Start over with a race between the servers whose backoff has run
+        # out. See _race_step().
+        self.close()
+        now = time.monotonic()
+        self._order = self.servers.ready(now)
+        self._next_try = now
+        self._race_end = now + self.connect_timeout
+
+    def _race_step(self):
+        # Start the next connection attempt if it's time for one, then check
+        # on the ones in progress. Returns seconds to wait before the next
+        # step, or -1 when the race is over (see connected for how it went).
+        # Attempts start stagger_s apart, or right away if the others have
+        # all failed, so a server that answers slowly or not at all only
+        # delays the backups by stagger_s rather than connect_timeout.
+        now = time.monotonic()
+        if self._order and (now >= self._next_try or not self._pending):
+            self._try(self._order.pop(0))
+            self._next_try = now + self.stagger_s
+        if (won := self._poll()) is not None:
+            self._adopt(*won)
+            return -1
+        if now >= self._race_end:
+            self._give_up()
+            return -1
+        if not (self._pending or self._order):
+            return -1
+        return _CONNECT_POLL_S
+
+    def _failback(self):
+        # While on a backup server, try the more preferred servers as their
+        # backoff runs out, one at a time, and switch to the first one that
+        # connects. Returns seconds until this needs to be called again.
+        now = time.monotonic()
+        if not self._pending:
+            if not (ready := self.servers.ready(now, self.server_i)):
+                return self.servers.delay(now, self.server_i)
+            self._try(ready[0])
+            self._race_end = now + self.connect_timeout
+        if (won := self._poll()) is not None:
+            # Hang up on the backup and register with the winner. The
+            # network task is waiting in recv_msg(), which picks up the new
+            # socket.
+            (i, sock) = won
+            print('IRC switching back to %s:%d' % self.servers.addrs[i])
+            self.close()
+            self._adopt(i, sock)
+            self._register()
+            return 0
+        if now >= self._race_end:
+            self._give_up()
+            return 0
+        return _CONNECT_POLL_S
+
+    def _try(self, i):
+        # Start a non-blocking connect to server i
+        addr = self.servers.addrs[i]
         try:
-            self.sock.settimeout(self.connect_timeout)
-            self.sock.connect((self.server, self.port))
-            self._recv_line_iterator = self._recv_line_gen()
-            self.connected = True
+            sock = self.pool.socket()      # defaults to IP + TCP
         except OSError as e:
-            # Exceptions I've seen trigger this (bad port, bad IP, etc):
-            # - OSError: [Errno 104] ECONNRESET
-            # - OSError: [Errno 116] ETIMEDOUT
-            # - OSError: [Errno 118] EHOSTUNREACH
-            # - OSError: [Errno 120] EALREADY
-            # - OSError: [Errno 128] ENOTCONN
-            print('ERR connect: "%s", errno=%d', e, e.errno)
-            self.connected = False
+            print('ERR socket: "%s", errno=%d' % (e, e.errno))
+            self.servers.failed(i, time.monotonic())
+            return
+        sock.settimeout(0)
+        attempt = [i, sock, False]
+        self._pending.append(attempt)
+        self._check(attempt)
+
+    def _check(self, attempt):
+        # Check on a connection attempt by calling connect() again. Returns
+        # True once it's connected. Failed attempts count against their
+        # server's backoff and get dropped from _pending.
+        (i, sock, done) = attempt
+        if done:
+            return True
+        try:
+            sock.connect(self.servers.addrs[i])
+            attempt[2] = True
+        except OSError as e:
+            if e.errno == _EISCONN:
+                attempt[2] = True
+            elif e.errno not in _CONNECTING:
+                # Exceptions I've seen trigger this (bad port, bad IP, etc):
+                # - OSError: [Errno 104] ECONNRESET
+                # - OSError: [Errno 111] ECONNREFUSED
+                # - OSError: [Errno 118] EHOSTUNREACH
+                # - OSError: [Errno 128] ENOTCONN
+                print('ERR connect %s:%d: "%s", errno=%d'
+                    % (self.servers.addrs[i] + (e, e.errno)))
+                sock.close()
+                self._pending.remove(attempt)
+                self.servers.failed(i, time.monotonic())
+        return attempt[2]
 
-    def register(self, timeout=30):
+    def _poll(self):
+        # Check on the attempts in progress. If one has connected, close the
+        # others (they were only slower, so their backoff stays as is) and
+        # return (server index, socket) for the winner. Otherwise, None.
+        for attempt in self._pending[:]:
+            if self._check(attempt):
+                self._pending.remove(attempt)
+                self._abort()
+                return (attempt[0], attempt[1])
+        return None
+
+    def _abort(self):
+        # Close the attempts in progress without counting them as failures
+        for attempt in self._pending:
+            attempt[1].close()
+        self._pending.clear()
+
+    def _give_up(self):
+        # The attempts in progress took longer than connect_timeout
+        now = time.monotonic()
+        for attempt in self._pending:
+            attempt[1].close()
+            self.servers.failed(attempt[0], now)
+            print('ERR connect %s:%d: timed out'
+                % self.servers.addrs[attempt[0]])
+        self._pending.clear()
+
+    def _adopt(self, i, sock):
+        # Make sock, a connection to server i, the bot's connection
+        self.joined = False
+        self.misses = 0
+        self.ping_s = self.ping_min_s
+        self._make_keys()
+        self.sock = sock
+        self._timeout = 0
+        self.server_i = i
+        (self.server, self.port) = self.servers.addrs[i]
+        self._rx_reset()
+        self.last_rx = time.monotonic()
+        self.connected = True
+        stats.count(CNT_CONNECTS)
+        if self.recorder:
+            self.recorder.write(b'')    # mark start of connection
+        print('IRC connected to %s:%d' % (self.server, self.port))
+
+    def send(self, msg):
+        # Queue msg (a string of one or more CRLF terminated IRC lines) for
+        # flush() to send. Returns False if it doesn't fit in tx_buf.
         if not self.connected:
             return False
-        self.sock.settimeout(timeout)
+        data = msg.encode()
+        n = len(data)
+        end = self._tx_end
+        if len(self.tx_buf) - end < n:
+            # Not enough room at the end, so move unsent bytes to the front
+            start = self._tx_start
+            self.tx_mv[:end-start] = self.tx_mv[start:end]
+            self._tx_paid -= start
+            self._tx_start = 0
+            self._tx_end = end = end - start
+            if len(self.tx_buf) - end < n:
+                stats.count(CNT_TX_DROPS)
+                return False
+        self.tx_mv[end:end+n] = data
+        self._tx_end = end + n
+        return True
+
+    def flush(self):
+        # Write as much of the outbound queue as flood control and the socket
+        # allow, without blocking. Returns the number of bytes still queued.
+        start = self._tx_start
+        end = self._tx_end
+        if start == end or not self.connected:
+            return 0
+        if (paid := self._tx_paid) < end:
+            # Refill the token bucket, then spend a token per whole message
+            now = time.monotonic()
+            tokens = min(self.tx_burst,
+                self._tokens + (now - self._tokens_t) * self.tx_rate)
+            self._tokens_t = now
+            while tokens >= 1 and paid < end:
+                crlf = self.tx_buf.find(b'\r\n', paid, end)
+                paid = end if crlf < 0 else crlf + 2
+                tokens -= 1
+            self._tokens = tokens
+            self._tx_paid = paid
+        if paid == start:
+            return end - start
         try:
-            msg = (
-                'NICK {0}\r\n'
-                'USER {0} 0 * :{0}\r\n'
-                'JOIN {1}\r\n'
-                ).format(self.nick, self.chan)
-            self.sock.sendall(msg.encode())
-            # This might fail, but for now assume it worked
-            self.registered = True
+            self._settimeout(0)
+            n = self.sock.send(self.tx_mv[start:paid])
         except OSError as e:
-            print('ERR register: "%s", errno=%d', e, e.errno)
+            # EAGAIN means the socket's send buffer is full, so try later
+            if e.errno != 11:
+                print('ERR send: "%s", errno=%d' % (e, e.errno))
+                self.close()
+                return 0
+            n = 0
+        stats.count(CNT_SENT, n)
+        if (start := start + n) == end:
+            self._tx_start = self._tx_paid = self._tx_end = 0
+            return 0
+        self._tx_start = start
+        return end - start
+
+    def _register(self):
+        # Send NICK, USER, and JOIN. This might fail, but for now assume it
+        # worked.
+        if not self.connected or not self.send(self._register_msg()):
             return False
+        self.flush()
+        self.registered = True
+        self.last_rx = time.monotonic()
+        self._set_link(LINK_UP)
         return True
 
-    def _recv_line_gen(self, timeout=1):
-        # This generator wraps Socket.recv_into() to provide line buffering
-        if not self.connected:
-            return None
-        self.sock.settimeout(timeout)
+    def _register_msg(self):
+        return (
+            'NICK {0}\r\n'
+            'USER {0} 0 * :{0}\r\n'
+            'JOIN {1}\r\n'
+            ).format(self.nick, ','.join(self.chans))
+
+    def _frame(self):
+        # Find the next line in rx_buf without copying or allocating. If there
+        # is a full line, set _line_start and _line_end to its bounds (without
+        # the CRLF) and return True. Otherwise, return False.
+        #
+        # CAUTION!!! Line bounds are only valid until the next call to
+        # _frame() or _recv().
+        #
+        # Lines longer than max_line get truncated to max_line bytes, and the
+        # rest of the line is discarded up to its CRLF.
         buf = self.rx_buf
-        line = self.line_buf
-        bufmv = memoryview(buf)
-        linemv = memoryview(line)
-        max_line = len(line)
-        buf_start = 0
-        line_end = 0
-        while True:
-            # Try to get some TCP bytes (maybe a full line, maybe less)
-            try:
-                size = self.sock.recv_into(buf)
-            except OSError as e:
-                # Exceptions I've seen trigger this:
-                # - OSError: [Errno 116] ETIMEDOUT
-                if e.errno == 116:
-                    pass  # timeout is fine
-                else:
-                    print('ERR recv_into: "%s", errno=%d', e, e.errno)
-                # ---
-                yield None                    # no data yet -> yield nothing
-                # ---
+        max_line = self.max_line
+        start = self._rx_start
+        scan = self._rx_scan
+        end = self._rx_end
+        # Assume there may be multiple CRLF terminated lines in rx buffer
+        while (crlf := buf.find(b'\r\n', scan, end)) > -1:
+            line_start = start
+            start = scan = crlf + 2
+            if self._rx_skip:
+                # End of an over-long line, so drop its tail
+                self._rx_skip = False
                 continue
-            # BEGIN full line parsing
-            # Assume there may be multiple CRLF terminated lines in rx buffer
-            # and that line buffer may already have some accumulated data...
-            while (crlf := buf.find(b'\r\n', buf_start, size)) > -1:
-                line_buf_space = max_line - line_end
-                line_len = crlf - buf_start
-                # Got a CRLF line ending
-                if line_len < line_buf_space:
-                    # Got newline and line will fit in the line buffer
-                    line[line_end:line_end+line_len] = bufmv[buf_start:crlf]
-                    line_end += line_len
-                else:
-                    # Got newline but line is too long, so truncate it
-                    limit = min(0, max_line - line_end)
-                    line[line_end:max_line] = bufmv[buf_start:buf_start+limit]
-                    line_end = max_line
-                # ---
-                yield bytes(linemv[:line_end]).decode()       # Yield line
-                # ---
-                line_end = 0                       # Clear line buffer
-                buf_start = crlf + 2               # Adjust rx buffer pointer
-            if buf_start >= size:
-                # RX buffer is empty, so start over with new packet
-                buf_start = 0
+            self._rx_start = self._rx_scan = start
+            self._line_start = line_start
+            self._line_end = min(crlf, line_start + max_line)
+            return True
+        # Resume searching at the last byte in case it's a CR whose LF is
+        # still on its way in the next packet
+        scan = max(start, end - 1)
+        found = False
+        if end - start > max_line:
+            # Partial line is too long -> return it truncated to max_line,
+            # then discard the rest except for a possible trailing CR
+            if not self._rx_skip:
+                self._line_start = start
+                self._line_end = start + max_line
+                self._rx_skip = True
+                found = True
+            start = scan = (end - 1) if buf[end-1] == 0x0d else end
+        self._rx_start = start
+        self._rx_scan = scan
+        return found
+
+    def _next_line(self):
+        # Return the next line from rx_buf as a memoryview slice, or None if
+        # there isn't a full one. See CAUTION for _frame().
+        if self._frame():
+            return self.rx_mv[self._line_start:self._line_end]
+        return None
+
+    def _recv(self, timeout):
+        # Receive TCP bytes straight into the rx_buf ring. Returns the number
+        # of bytes received (0 for timeout or no data yet).
+        start = self._rx_start
+        end = self._rx_end
+        if start >= end:
+            # RX buffer is empty, so start over at the front (but keep the
+            # skip flag, because an over-long line may still be arriving)
+            self._rx_start = self._rx_scan = self._rx_end = end = 0
+        elif len(self.rx_buf) - end < self.max_line:
+            # Not enough room left for a full line, so move the partial line
+            # to the front of the ring
+            part_len = end - start
+            self.rx_mv[:part_len] = self.rx_mv[start:end]
+            self._rx_scan -= start
+            self._rx_start = 0
+            self._rx_end = end = part_len
+        if self._tx_end > self._tx_start:
+            # Send queued messages first, and don't block for long if some
+            # of them have to wait for the socket or flood control
+            if self.flush() and timeout > _TX_POLL_S:
+                timeout = _TX_POLL_S
+            if not self.connected:
+                return 0
+        try:
+            self._settimeout(timeout)
+            if _PROFILE:
+                t = time.monotonic_ns()
+            size = self.sock.recv_into(self.rx_mv[end:])
+            if _PROFILE and timeout == 0:
+                # Only time non-blocking reads, since the blocking ones are
+                # mostly waiting
+                stats.span(SPAN_RECV, t)
+        except OSError as e:
+            # Exceptions I've seen trigger this:
+            # - OSError: [Errno 11] EAGAIN (non-blocking, no data yet)
+            # - OSError: [Errno 116] ETIMEDOUT
+            if e.errno not in (11, 116):
+                print('ERR recv_into: "%s", errno=%d' % (e, e.errno))
+            return 0
+        if size == 0:
+            # Zero bytes means the server closed the connection
+            self.close()
+            return 0
+        if self.recorder:
+            self.recorder.write(self.rx_mv[end:end+size])
+        stats.count(CNT_BYTES, size)
+        self._rx_end = end + size
+        return size
+
+    def _parse_next(self):
+        # Return the next parsed IRCMessage already in rx_buf, or None. Lines
+        # that don't pass the pre-filter get counted and skipped.
+        msg = self.msg
+        while True:
+            if _PROFILE:
+                t = time.monotonic_ns()
+            if not self._frame():
+                return None
+            if _PROFILE:
+                t = stats.span(SPAN_FRAME, t)
+            found = msg.parse(self.rx_buf, self._line_start, self._line_end)
+            if _PROFILE:
+                stats.span(SPAN_PARSE, t)
+            if found is None:
+                continue    # Skip blank lines
+            stats.count(CNT_LINES)
+            # Any traffic at all means the link is alive
+            self.last_rx = time.monotonic()
+            if self.filter and not self._allow(msg):
+                code = msg.cmd
+                self.drops[code] = self.drops.get(code, 0) + 1
+                stats.count(CNT_DROPS)
                 continue
-            # END full line parsing
-            # BEGIN partial line parsing
-            line_buf_space = max_line - line_end
-            part_len = size - buf_start
-            if part_len < line_buf_space:
-                # Partial line fits in line buffer -> copy it
-                line[line_end:line_end+part_len] = bufmv[buf_start:size]
-                line_end += part_len
-            else:
-                # Partial line is too long -> truncate it
-                limit = min(0, max_line - line_end)
-                line[line_end:max_line] = bufmv[buf_start:buf_start+limit]
-                line_end += limit
-            # Clear the RX buffer
-            buf_start = 0
-            # END partial line parsing
+            return msg
 
-    def recv_line(self):
-        # Return a line from the TCP stream buffer (includes auto-PONG)
+
+class AsyncIRCBot(_IRCBotBase):
+    # asyncio version of the IRC bot for use with asyncio.run()
+    #
+    # Socketpool sockets can't be awaited, so reads first try a non-blocking
+    # recv_into(). When that comes up empty, the bot yields once to let the
+    # other tasks run, then blocks in recv_into() for up to idle_timeout
+    # seconds (or as long as the on_idle() handler says). That way, the
+    # radio wakes the bot as soon as data arrives, but an idle connection
+    # only costs a few wakeups per second, or fewer with an on_idle()
+    # handler that knows when the other tasks need to run.
+
+    def __init__(self, nick, chans, server, port=6667, pool=None,
+            retry_s=5, retry_max_s=180):
+        super().__init__(nick, chans, server, port, pool, retry_s,
+            retry_max_s)
+        self.idle_timeout = 0.5
+
+    async def connect(self):
+        # Race connections to the servers (see _race_step()). The connects
+        # don't block, so the other tasks keep running while this waits.
+        self._race_start()
+        while (t := self._race_step()) >= 0:
+            await asyncio.sleep(t)
+
+    async def register(self):
+        ok = self._register()
+        await asyncio.sleep(0)
+        return ok
+
+    async def _wait(self):
+        # Wait for more bytes to arrive in rx_buf (see comment above)
+        if self._recv(0) == 0 and self.connected:
+            await asyncio.sleep(0)
+            if self.connected:
+                timeout = self.idle_timeout
+                if self._idle_handler is not None:
+                    if (t := self._idle_handler()) is not None:
+                        timeout = t
+                if self._recv(timeout) == 0 and timeout > 0:
+                    stats.count(CNT_WAKES)
+
+    async def readline(self):
+        # Wait for the next line (a memoryview slice of rx_buf, see CAUTION
+        # for _next_line()). Returns None when the connection closes.
+        while self.connected:
+            if (line := self._next_line()) is not None:
+                self.last_rx = time.monotonic()
+                return line
+            await self._wait()
+        return None
+
+    async def recv_msg(self):
+        # Wait for the next IRCMessage. Returns None when the connection
+        # closes. See CAUTION for IRCBot.recv_msg().
+        while self.connected:
+            if (msg := self._parse_next()) is not None:
+                return msg
+            await self._wait()
+        return None
+
+    async def pong(self, params):
+        # Queue a PONG to keep the connection alive (params type is string)
+        self.send('PONG {}\r\n'.format(params))
+        await asyncio.sleep(0)
+
+
+class IRCBot(_IRCBotBase):
+    # Synchronous version of the IRC bot. This is a thin wrapper around the
+    # shared framing and parsing code that uses blocking socket calls.
+
+    def __init__(self, nick, chans, server, port=6667, pool=None,
+            retry_s=5, retry_max_s=180):
+        super().__init__(nick, chans, server, port, pool, retry_s,
+            retry_max_s)
+        # recv_line() callers from before the pre-filter expect to see every
+        # line, so it starts off here. Set filter to True to use it.
+        self.filter = False
+
+    def connect(self):
+        self._race_start()
+        while (t := self._race_step()) >= 0:
+            time.sleep(t)
+
+    def register(self):
+        return self._register()
+
+    def recv_msg(self, timeout=1):
+        # Return the next IRCMessage from the TCP stream buffer, or None.
         #
-        # CAUTION!!! group(n) returns matches as strings, not type bytes.
-        # If you want to use them as bytes, you'll need to do .encode().
+        # CAUTION!!! The returned IRCMessage object gets reused for the next
+        # message, and its fields are offsets into rx_buf. Decode anything you
+        # want to keep before calling recv_msg() again.
         #
-        it = self._recv_line_iterator
-        if it and (line := next(it)):
-            # Got a line, so parse it with regex match
-            m = self.irc_re.match(line)
-            prefix  = m.group(2)
-            command = m.group(3)
-            params  = m.group(4)
-            return (prefix, command, params)
+        if not self.connected:
+            return None
+        if (msg := self._parse_next()) is None and self._recv(timeout) > 0:
+            msg = self._parse_next()
+        return msg
+
+    def recv_line(self):
+        # Return a (prefix, command, params) tuple of strings from the TCP
+        # stream buffer, or None. This is the same as recv_msg(), except that
+        # it decodes everything.
+        if (msg := self.recv_msg()) is not None:
+            return (msg.prefix(), msg.command(), msg.params())
         return None
 
     def pong(self, params):
-        # Send a PONG to keep the connection alive (params type is string)
-        try:
-            msg = 'PONG {}\r\n'.format(params)
-            self.sock.sendall(msg.encode())
-        except OSError as e:
-            print('ERR pong: "%s", errno=%d', e, e.errno)
+        # Queue a PONG to keep the connection alive (params type is string)
+        self.send('PONG {}\r\n'.format(params))
 
     # Context handlers
 
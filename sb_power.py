@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# CPU clock and idle policy for the main loop. With the adaptive policy, the
+# clock goes up while there's work to do (a burst of IRC lines, a display
+# refresh, a reconnect) and back down once the bot runs out of work and is
+# about to wait on the socket. The waits also get as long as possible: the
+# other tasks sleep and wait for events through the policy, so it knows when
+# they next need to run, and the network task's blocking recv_into() only
+# lasts until the earliest of those. So an idle connection only wakes the CPU
+# for a timer or for incoming data, rather than polling several times a
+# second.
+#
+# The fixed policy is the old behavior: one clock speed for the whole
+# session, and recv waits of AsyncIRCBot.idle_timeout.
+#
+# CircuitPython's alarm.light_sleep_until_alarms() can't wake up for socket
+# data and it stops the asyncio loop, so light sleep isn't used here. While
+# the network task blocks in recv_into(), the CPU already idles until the
+# radio or the timeout wakes it.
+#
+import asyncio
+from micropython import const
+import time
+
+from sb_stats import stats, CNT_BOOSTS
+
+
+# Tasks that sleep or wait with PowerPolicy (index into wakes)
+WAKE_DISPLAY = const(0)
+WAKE_KEEPALIVE = const(1)
+WAKE_PAGE = const(2)
+WAKE_TOUCH = const(3)
+WAKES = const(4)
+
+POLICIES = ('fixed', 'adaptive')
+
+
+class PowerPolicy:
+
+    def __init__(self, cpu=None, policy='adaptive', idle_mhz=80,
+            busy_mhz=240, boost_s=0.25, idle_s=30):
+        # cpu is microcontroller.cpu, or None if the clock shouldn't be
+        # changed (e.g. boards other than the ESP32-S3). With the adaptive
+        # policy, the clock stays at busy_mhz until boost_s seconds after
+        # the last busy() call. idle_s is the longest recv wait.
+        if policy not in POLICIES:
+            print('power: unknown policy %s, using fixed' % policy)
+            policy = 'fixed'
+        self.cpu = cpu
+        self.adaptive = policy == 'adaptive'
+        self.idle_hz = idle_mhz * 1_000_000
+        self.busy_hz = busy_mhz * 1_000_000
+        self.boost_s = boost_s
+        self.idle_s = idle_s
+        self.boosted = False
+        self._until = 0            # when the boost can end
+        self.wakes = [0] * WAKES   # wakeup time for each sleeping task
+        self._clock(self.idle_hz)
+
+    def _clock(self, hz):
+        if self.cpu is None or self.cpu.frequency == hz:
+            return
+        try:
+            self.cpu.frequency = hz
+        except ValueError as e:
+            # Not a frequency this chip supports, so stop trying
+            print('power: can\'t set %d MHz (%s)' % (hz // 1_000_000, e))
+            self.cpu = None
+
+    def busy(self):
+        # Call this when work arrives. Boosts the clock (adaptive policy).
+        if not self.adaptive:
+            return
+        self._until = time.monotonic() + self.boost_s
+        if not self.boosted:
+            self.boosted = True
+            stats.count(CNT_BOOSTS)
+            self._clock(self.busy_hz)
+
+    async def sleep(self, task, seconds):
+        # asyncio.sleep() for timer task (one of the WAKE_* constants) that
+        # lets idle() know when the task needs to run again
+        self.wakes[task] = time.monotonic() + seconds
+        await asyncio.sleep(seconds)
+        self.wakes[task] = 0
+
+    def wake(self, task, event):
+        # Set event to wake up a task waiting in wait(). Until that task
+        # runs, idle() won't let the bot block on the socket.
+        if not event.is_set():
+            self.wakes[task] = time.monotonic()
+            event.set()
+
+    async def wait(self, task, event):
+        # event.wait() for a task that gets woken up with wake()
+        await event.wait()
+        self.wakes[task] = 0
+
+    def idle(self):
+        # Call this when there's nothing to do but wait for the socket (see
+        # AsyncIRCBot.on_idle()). Drops the clock if the boost has run out,
+        # and returns how many seconds to wait, or None for the bot's usual
+        # idle_timeout.
+        if not self.adaptive:
+            return None
+        now = time.monotonic()
+        if self.boosted and now >= self._until:
+            self.boosted = False
+            self._clock(self.idle_hz)
+        # Wait until the next task wakeup. One that's already due (but the
+        # task hasn't run yet) means don't wait at all.
+        timeout = self.idle_s
+        if self.boosted:
+            timeout = self._until - now
+        for when in self.wakes:
+            if when and when - now < timeout:
+                timeout = max(when - now, 0)
+        return timeout
@@ -0,0 +1,171 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# Numeric time series for `!kv` dashboard topics like
+# `!kv temp=21.5C hum=40% co2=612`. Each key gets a ring of the last
+# `samples` values in one preallocated array('f'), so a dashboard can run
+# for days with dozens of keys without the heap growing. The only per-update
+# allocations are the float values and the latest value text for display,
+# which replace the previous ones.
+#
+# Slots belong to a pane, so two channels that both send `temp=` get
+# separate series, while all panes share the one array. Once all the slots
+# are taken, a new key takes over the slot of a key that isn't in its
+# pane's latest topic any more (e.g. a renamed sensor), so keys can come and
+# go for as long as the bot runs.
+#
+from array import array
+
+
+# Characters that can be part of the number at the start of a value (the
+# rest is units, like the C in 21.5C)
+_NUMERIC = '+-.0123456789eE'
+
+
+class SeriesStore:
+
+    def __init__(self, max_keys=32, samples=256):
+        self.max_keys = max_keys
+        self.samples = samples
+        # Build the value array from zeroed bytes rather than a list, to
+        # avoid a temporary list as big as the array
+        self.values = array('f', bytes(4 * max_keys * samples))
+        self.counts = array('L', [0] * max_keys)   # samples ever added
+        self.panes = array('B', bytes(max_keys))   # pane of each slot
+        self.seen = array('L', [0] * max_keys)     # tick of last sample
+        self.keys = []         # key name for each slot
+        self.text = []         # latest value text for each slot
+        self.dropped = 0       # fields ignored because all slots were used
+        self.reused = 0        # slots taken over by new keys
+        self.tick = 0          # count of scans with add=True
+        self.ticks = {}        # pane -> tick of its latest scan
+        self._next = 0         # likely slot of the next key (see _slot)
+        self._full = False     # a new key found no free slot
+        self._reuse = False    # take over stale slots for new keys
+
+    def _slot(self, text, start, end, add, pane):
+        # Return pane's slot for the key text[start:end], or -1. Compares in
+        # place, so known keys don't cost a string slice. Topics usually list
+        # their keys in the same order every time, so the slot after the last
+        # one found gets checked first.
+        n = end - start
+        keys = self.keys
+        panes = self.panes
+        i = self._next
+        if (i < len(keys) and panes[i] == pane and len(keys[i]) == n
+                and text.startswith(keys[i], start)):
+            self._next = i + 1
+            return i
+        for (i, key) in enumerate(keys):
+            if (panes[i] == pane and len(key) == n
+                    and text.startswith(key, start)):
+                self._next = i + 1
+                return i
+        if not add or n == 0:
+            return -1
+        if (i := len(keys)) < self.max_keys:
+            keys.append(text[start:end])
+            self.text.append('')
+        elif self._reuse and (i := self._stale()) >= 0:
+            # The new key starts a new series in the old key's slot
+            keys[i] = text[start:end]
+            self.text[i] = ''
+            self.counts[i] = 0
+            self.reused += 1
+        else:
+            if self._reuse:
+                self.dropped += 1
+            self._full = True
+            return -1
+        panes[i] = pane
+        self._next = i + 1
+        return i
+
+    def _stale(self):
+        # Return the least recently updated slot whose key wasn't in its
+        # pane's latest topic, or -1 if every key is still in use
+        seen = self.seen
+        panes = self.panes
+        ticks = self.ticks
+        found = -1
+        for i in range(len(self.keys)):
+            if seen[i] != ticks[panes[i]] and (found < 0
+                    or seen[i] < seen[found]):
+                found = i
+        return found
+
+    def scan(self, text, out=None, add=True, pane=0):
+        # Parse space separated `key=value` fields from text for a pane's
+        # dashboard. With add=True, append each value to its key's ring
+        # (making slots for new keys). If out is an array, the slot of each
+        # field gets written to it in order. Returns the number of fields
+        # found.
+        if add:
+            self.tick = (self.tick + 1) & 0xffffffff
+            self.ticks[pane] = self.tick
+        self._full = self._reuse = False
+        found = self._scan(text, out, add, pane)
+        if self._full:
+            # Out of slots, so go again now that every key still in this
+            # topic is marked as seen, and let the new keys take over slots
+            # of keys that are gone
+            self._reuse = True
+            found = self._scan(text, out, add, pane)
+        return found
+
+    def _scan(self, text, out, add, pane):
+        found = 0
+        i = 0
+        n = len(text)
+        while i < n:
+            end = text.find(' ', i)
+            if end < 0:
+                end = n
+            eq = text.find('=', i, end)
+            if eq > i and (slot := self._slot(text, i, eq, add, pane)) >= 0:
+                if add and self.seen[slot] != self.tick:
+                    # First sample for this key in this topic
+                    self.seen[slot] = self.tick
+                    self._add(slot, text, eq + 1, end)
+                if out is not None and found < len(out):
+                    out[found] = slot
+                found += 1
+            i = end + 1
+        return found
+
+    def _add(self, slot, text, start, end):
+        # Append the value in text[start:end] (a number with optional units)
+        num = start
+        while num < end and text[num] in _NUMERIC:
+            num += 1
+        try:
+            value = float(text[start:num])
+        except ValueError:
+            return
+        if value - value != 0:
+            # inf or nan, which would break sparkline scaling
+            return
+        k = self.counts[slot]
+        self.values[slot * self.samples + k % self.samples] = value
+        self.counts[slot] = k + 1
+        self.text[slot] = text[start:end]
+
+    def value(self, slot, k):
+        # Return sample k (counting from 0 for the first ever) of slot. Only
+        # the last `samples` samples are still in the ring.
+        return self.values[slot * self.samples + k % self.samples]
+
+    def range(self, slot, first, end):
+        # Return (min, max) of samples first..end-1 of slot
+        base = slot * self.samples
+        s = self.samples
+        lo = hi = self.values[base + first % s]
+        for k in range(first + 1, end):
+            v = self.values[base + k % s]
+            if v < lo:
+                lo = v
+            elif v > hi:
+                hi = v
+        return (lo, hi)
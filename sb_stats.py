@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# Lightweight profiling for the hot paths in sb_ircbot and sb_chardisplay:
+# timing spans, event counters, and gc.mem_free() watermarks. Everything
+# lives in fixed arrays that get allocated once, so recording a span or a
+# count doesn't add to the heap (beyond the time.monotonic_ns() long int).
+#
+# Timing spans are wrapped in `if _PROFILE:` blocks in each module that uses
+# them. _PROFILE is a const, so setting it to 0 makes the compiler drop those
+# blocks completely. The bundle builder does that for you when you set
+# `profile: no` in the [build] section of bundle_manifest.cfg. Counters and
+# watermarks stay on either way, since they're just array updates.
+#
+from array import array
+import gc
+from micropython import const
+import time
+
+
+# Timing spans (index into Stats span arrays)
+SPAN_RECV = const(0)      # non-blocking socket recv_into()
+SPAN_FRAME = const(1)     # finding a line in the rx ring
+SPAN_PARSE = const(2)     # IRCMessage.parse()
+SPAN_DISPATCH = const(3)  # handler lookup and call
+SPAN_WRAP = const(4)      # topic wrapping
+SPAN_LABEL = const(5)     # status or topic text update
+SPAN_REFRESH = const(6)   # display.refresh()
+SPANS = const(7)
+SPAN_NAMES = ('recv', 'frame', 'parse', 'disp', 'wrap', 'label', 'refr')
+
+# Counters (index into Stats.counts)
+CNT_LINES = const(0)      # non-blank lines received
+CNT_BYTES = const(1)      # bytes received
+CNT_DROPS = const(2)      # lines dropped by the pre-filter
+CNT_CONNECTS = const(3)   # successful connects
+CNT_REFRESHES = const(4)  # display refreshes
+CNT_PINGS = const(5)      # keepalive PINGs sent
+CNT_MISSES = const(6)     # keepalive PINGs that went unanswered
+CNT_SENT = const(7)       # bytes sent
+CNT_TX_DROPS = const(8)   # outbound messages dropped because tx_buf was full
+CNT_WAKES = const(9)      # idle socket waits that ended without data
+CNT_BOOSTS = const(10)    # CPU clock boosts (see sb_power.py)
+COUNTS = const(11)
+CNT_NAMES = ('lines', 'bytes', 'drops', 'conns', 'refrs', 'pings', 'miss',
+    'sent', 'txfull', 'wakes', 'boosts')
+
+# gc.mem_free() is CircuitPython only, so watermarks stay at 0 on a host
+_mem_free = getattr(gc, 'mem_free', None)
+
+
+class Stats:
+
+    def __init__(self):
+        self.span_n = array('L', [0] * SPANS)     # samples per span
+        self.span_us = array('L', [0] * SPANS)    # total microseconds
+        self.span_max = array('L', [0] * SPANS)   # longest sample
+        self.counts = array('L', [0] * COUNTS)
+        self.mem_hi = 0
+        self.mem_lo = 0
+        self.start = time.monotonic()
+
+    def reset(self):
+        for i in range(SPANS):
+            self.span_n[i] = self.span_us[i] = self.span_max[i] = 0
+        for i in range(COUNTS):
+            self.counts[i] = 0
+        self.mem_hi = self.mem_lo = 0
+        self.start = time.monotonic()
+
+    def span(self, i, t0):
+        # Record the time since t0 (from time.monotonic_ns()) for span i.
+        # Returns the current time, so back to back spans can share one
+        # clock read.
+        now = time.monotonic_ns()
+        us = (now - t0) // 1000
+        n = self.span_n[i] + 1
+        total = self.span_us[i] + us
+        if total > 0x7fffffff:
+            # Halve the sample count and total rather than overflow, so the
+            # average stays meaningful
+            n >>= 1
+            total >>= 1
+        self.span_n[i] = n
+        self.span_us[i] = total
+        if us > self.span_max[i]:
+            self.span_max[i] = us
+        return now
+
+    def count(self, i, n=1):
+        self.counts[i] = (self.counts[i] + n) & 0xffffffff
+
+    def mem(self):
+        # Sample free heap to update the high and low watermarks
+        if _mem_free is not None:
+            free = _mem_free()
+            if free > self.mem_hi:
+                self.mem_hi = free
+            if free < self.mem_lo or self.mem_lo == 0:
+                self.mem_lo = free
+
+    def summary(self):
+        # Compact one line summary, short enough for an IRC reply. Spans are
+        # average/max microseconds.
+        out = ['up %ds' % (time.monotonic() - self.start)]
+        for i in range(COUNTS):
+            out.append('%s %d' % (CNT_NAMES[i], self.counts[i]))
+        if self.mem_hi:
+            out.append('free %d-%dk' % (self.mem_lo >> 10, self.mem_hi >> 10))
+        for i in range(SPANS):
+            if n := self.span_n[i]:
+                out.append('%s %d/%dus' % (SPAN_NAMES[i],
+                    self.span_us[i] // n, self.span_max[i]))
+        return ' '.join(out)
+
+
+# Shared instance for all the modules that record stats
+stats = Stats()
@@ -0,0 +1,272 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# Display backends for text-only displays: an HD44780 character LCD (with
+# the adafruit_character_lcd library, over the I2C backpack or GPIO) and an
+# ANSI terminal, which can also run headless as a plain framebuffer. These
+# plug into CharDisplay in place of the TFT backend (see TFTBackend in
+# sb_chardisplay.py for the interface).
+#
+# Grids and groups work like the displayio ones the TFT backend uses, so the
+# topic panes and dashboards don't need to know which backend they're on.
+# But rather than rendering pixels, refresh() copies the visible grids into a
+# frame of characters and compares that with the frame that's on the display.
+# Only the cells that changed get sent, as runs of neighboring cells in a
+# row, each of which costs one cursor move. On the I2C backpack, every byte
+# sent to the LCD (command or character) takes a dozen or so I2C register
+# writes, so rewriting a whole 20x4 screen takes most of a second.
+#
+from micropython import const
+
+
+# Character for anything the displays can't show (control characters and
+# non-ASCII)
+_UNKNOWN = const(63)
+
+
+def text_layouts(cols, rows):
+    # Return pane layouts like LAYOUTS in sb_chardisplay.py, but in cells,
+    # for a cols x rows display with the status line on the top row. Panes
+    # get stacked if there are enough rows, otherwise they go side by side.
+    out = {}
+    body = max(1, rows - 1)
+    for n in range(1, 5):
+        across = (n + body - 1) // body
+        down = (n + across - 1) // across
+        w = cols // across
+        h = max(1, body // down)
+        # The bottom panes get any rows left over
+        last = max(h, body - h * (down - 1))
+        out[n] = tuple((i % across * w, 1 + i // across * h, w,
+            last if i // across == down - 1 else h, 1) for i in range(n))
+    return out
+
+
+class TextGrid:
+    # Text backend version of CellGrid: a block of cols x rows characters at
+    # cell (x, y). Each grid keeps its own cells, so a hidden grid (like the
+    # other pages of a long topic) keeps its text for when it's shown again.
+
+    def __init__(self, cols, rows, x, y, color):
+        self.cols = cols
+        self.rows = rows
+        self.x = x
+        self.y = y
+        self.color = color     # only for the API, these are one color
+        self.hidden = False
+        self.cells = bytearray(b' ' * (cols * rows))
+        self.mv = memoryview(self.cells)
+        self.group = self      # grids go in groups directly
+
+    def set_lines(self, text, offsets, first=0, align_right=False,
+            rows=None):
+        # Same as CellGrid.set_lines()
+        data = text.encode()
+        ascii_only = len(data) == len(text)
+        cells = self.cells
+        cols = self.cols
+        (top, bottom) = rows or (0, self.rows)
+        changed = 0
+        i = top * cols
+        for row in range(top, bottom):
+            k = 2 * (first + row)
+            if k + 1 < len(offsets):
+                a = offsets[k]
+                b = min(offsets[k+1], a + cols)
+            else:
+                a = b = 0
+            pad = cols - (b - a) if align_right else 0
+            for col in range(cols):
+                pos = a + col - pad
+                if col < pad or pos >= b:
+                    c = 32
+                else:
+                    c = data[pos] if ascii_only else ord(text[pos])
+                    if not 32 <= c < 127:
+                        c = _UNKNOWN
+                if cells[i] != c:
+                    cells[i] = c
+                    changed += 1
+                i += 1
+        return changed
+
+    def set_text(self, text, align_right=False):
+        # Show text on the first row, with the other rows blank
+        n = len(text)
+        return self.set_lines(text, (max(0, n - self.cols) if align_right
+            else 0, n), align_right=align_right)
+
+    def set_row(self, row, text):
+        # Same as CellGrid.set_row()
+        return self.set_lines(text, (0, len(text)), -row, rows=(row, row + 1))
+
+    def dump(self):
+        # Return what the grid is showing, one line per row (for debugging)
+        return '\n'.join(str(self.cells[r*self.cols:(r+1)*self.cols],
+            'utf-8').rstrip() for r in range(self.rows))
+
+
+class TextGroup:
+    # Stand-in for displayio.Group: grids and groups that can be hidden
+    # together
+
+    def __init__(self):
+        self.hidden = False
+        self.children = []
+
+    def append(self, child):
+        self.children.append(child)
+
+
+class TextBackend:
+    # Base for the text backends. Subclasses implement _send() to write a
+    # run of characters at a cell, and set gap to how many unchanged cells a
+    # run can include: if rewriting a few unchanged cells costs less than
+    # another cursor move, neighboring changes get sent as one run.
+    touch = False              # no touch panel to scroll topics with
+
+    def __init__(self, cols, rows, gap=1):
+        self.cols = cols
+        self.rows = rows
+        self.gap = gap
+        self.cell = (1, 1)     # layouts are in cells
+        self.layouts = text_layouts(cols, rows)
+        self.status = (cols, 0, 0)
+        self.root = TextGroup()
+        self.blank = b' ' * (cols * rows)
+        self.frame = bytearray(self.blank)     # frame being composed
+        self.shown = bytearray(self.blank)     # frame on the display
+        self.runs = 0          # runs sent (for benchmarks)
+        self.sent = 0          # cells sent, including gaps
+
+    def group(self):
+        return TextGroup()
+
+    def grid(self, cols, rows, x, y, scale, color):
+        # scale is ignored, since a text display only has one size
+        return TextGrid(cols, rows, x, y, color)
+
+    def sparkline(self, width, height, x, y, color):
+        # No graphics, so `!kv` dashboards just show names and values
+        return None
+
+    def _compose(self, node):
+        # Copy the visible grids under node into the frame, clipped to the
+        # screen, with later ones on top
+        if node.hidden:
+            return
+        if not isinstance(node, TextGrid):
+            for child in node.children:
+                self._compose(child)
+            return
+        cols = self.cols
+        w = min(node.cols, cols - node.x)
+        for r in range(min(node.rows, self.rows - node.y)):
+            i = (node.y + r) * cols + node.x
+            self.frame[i:i+w] = node.mv[r*node.cols:r*node.cols+w]
+
+    def refresh(self):
+        # Send the cells that differ from what's on the display. Returns
+        # True if anything got sent.
+        frame = self.frame
+        shown = self.shown
+        frame[:] = self.blank
+        self._compose(self.root)
+        if frame == shown:
+            return False
+        cols = self.cols
+        gap = self.gap
+        for row in range(self.rows):
+            base = row * cols
+            col = 0
+            while col < cols:
+                if frame[base+col] == shown[base+col]:
+                    col += 1
+                    continue
+                # Start of a run. It ends at the last changed cell before
+                # more than gap unchanged ones in a row.
+                start = col
+                end = col = col + 1
+                while col < cols and col - end <= gap:
+                    if frame[base+col] != shown[base+col]:
+                        end = col + 1
+                    col += 1
+                run = frame[base+start:base+end]
+                self._send(row, start, run)
+                shown[base+start:base+end] = run
+                self.runs += 1
+                self.sent += end - start
+                col = end
+        return True
+
+    def release(self):
+        pass
+
+    def dump(self):
+        # Return what's on the display, one line per row (for debugging)
+        return '\n'.join(str(self.shown[r*self.cols:(r+1)*self.cols],
+            'utf-8').rstrip() for r in range(self.rows))
+
+
+class CharLCDBackend(TextBackend):
+    # HD44780 character LCD through an adafruit_character_lcd object, like
+    # Character_LCD_I2C for the I2C backpack or Character_LCD_Mono for GPIO
+    # wiring. Each run is a cursor command plus one write per character.
+    # Rewriting one unchanged cell costs the same as the cursor command for
+    # a new run, so runs span gaps of 1.
+
+    def __init__(self, lcd, cols=20, rows=4):
+        lcd.clear()
+        super().__init__(cols, rows, gap=1)
+        self.lcd = lcd
+
+    def _send(self, row, col, data):
+        # The message setter starts with a cursor command for the current
+        # (column, row), so setting those directly rather than calling
+        # cursor_position() saves sending it twice
+        lcd = self.lcd
+        lcd.column = col
+        lcd.row = row
+        lcd.message = str(data, 'utf-8')
+
+
+class TermBackend(TextBackend):
+    # ANSI terminal on the stream out (e.g. sys.stdout for the serial
+    # console), or with out=None, a headless framebuffer that only keeps the
+    # frame for dump(). The frame goes at the top of the screen, and the
+    # rest of the screen becomes a scroll region so console output scrolls
+    # below the frame rather than over it. A cursor move is up to 8 bytes,
+    # so runs span gaps of up to 6 cells.
+
+    def __init__(self, cols=40, rows=12, out=None):
+        super().__init__(cols, rows, gap=6)
+        self.out = out
+        self.bytes = 0         # bytes written (for benchmarks)
+        self.parts = []
+        # Clear the screen, set the scroll region, and move the cursor there
+        self._write('\x1b[2J\x1b[%d;r\x1b[%d;1H' % (rows + 2, rows + 2))
+
+    def _write(self, text):
+        self.bytes += len(text)
+        if self.out is not None:
+            self.out.write(text)
+
+    def _send(self, row, col, data):
+        self.parts.append('\x1b[%d;%dH%s' % (row + 1, col + 1,
+            str(data, 'utf-8')))
+
+    def refresh(self):
+        # Send all the runs in one write, between saving and restoring the
+        # cursor position in the scroll region
+        self.parts.append('\x1b7')
+        if changed := super().refresh():
+            self.parts.append('\x1b8')
+            self._write(''.join(self.parts))
+        self.parts.clear()
+        return changed
+
+    def release(self):
+        # Put the scroll region back to the whole screen
+        self._write('\x1b[r\x1b[%d;1H' % (self.rows + 2))
@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# Touch input for topic scrollback. The 2.8" TFT Touch Shield v2 has an
+# STMPE610 resistive touch controller on the same SPI bus as the display,
+# with its chip select on D8. Gestures turns a stream of touch points into
+# strokes, and each finished stroke into a scrollback gesture:
+# - swipe right, or tap the left third of a pane: back to an older topic
+# - swipe left, or tap the right third of a pane: forward to a newer topic
+# - tap the middle of a pane: back to the live topic
+#
+import board
+from micropython import const
+
+
+GESTURE_NONE = const(0)
+GESTURE_BACK = const(1)
+GESTURE_FORWARD = const(2)
+GESTURE_LIVE = const(3)
+GESTURE_TAP = const(4)     # from update(), use tap() to classify it
+
+
+def open_touch(width=320, height=240, rotation=180):
+    # Return the shield's touch controller, or None if there isn't one (e.g.
+    # the non-touch version of the shield, or the library is missing)
+    try:
+        from adafruit_stmpe610 import Adafruit_STMPE610_SPI
+        import digitalio
+        cs = digitalio.DigitalInOut(board.D8)
+        # Calibration is the raw (x, y) range from Adafruit's examples for
+        # this shield
+        return Adafruit_STMPE610_SPI(board.SPI(), cs,
+            calibration=((357, 3812), (390, 3555)), size=(width, height),
+            disp_rotation=rotation, touch_flip=(False, False))
+    except (ImportError, RuntimeError, ValueError) as e:
+        print('touch: not available (%s)' % e)
+        return None
+
+
+class Gestures:
+    # A stroke starts at the first touch point and ends after release_polls
+    # polls in a row with no touch, since resistive touch readings can drop
+    # out for a poll in the middle of a stroke. Strokes that move at least
+    # swipe_px sideways are swipes. Anything shorter is a tap.
+
+    def __init__(self, swipe_px=60, release_polls=2):
+        self.swipe_px = swipe_px
+        self.release_polls = release_polls
+        self.down = False
+        self.x0 = 0            # where the stroke started
+        self.y0 = 0
+        self.x = 0             # last point of the stroke
+        self.y = 0
+        self._misses = 0
+
+    def update(self, point):
+        # Feed one poll of touch_point ((x, y, pressure) or None). Returns
+        # GESTURE_BACK, GESTURE_FORWARD, or GESTURE_TAP when a stroke ends,
+        # otherwise GESTURE_NONE.
+        if point is not None:
+            (x, y) = (point[0], point[1])
+            if not self.down:
+                self.down = True
+                self.x0 = x
+                self.y0 = y
+            self.x = x
+            self.y = y
+            self._misses = 0
+            return GESTURE_NONE
+        if not self.down:
+            return GESTURE_NONE
+        self._misses += 1
+        if self._misses < self.release_polls:
+            return GESTURE_NONE
+        self.down = False
+        dx = self.x - self.x0
+        if dx >= self.swipe_px:
+            return GESTURE_BACK
+        if dx <= -self.swipe_px:
+            return GESTURE_FORWARD
+        return GESTURE_TAP
+
+    def tap(self, left, width):
+        # Classify the last tap by which third of the left..left+width range
+        # it landed in (e.g. the pane where the stroke started)
+        third = (self.x - left) * 3 // max(width, 1)
+        if third <= 0:
+            return GESTURE_BACK
+        if third >= 2:
+            return GESTURE_FORWARD
+        return GESTURE_LIVE
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: MIT
+# SPDX-FileCopyrightText: Copyright 2025 Sam Blenny
+#
+# See NOTES.md for documentation links and pinout info.
+#
+# Warm start state kept in microcontroller.nvm: the last topic shown in each
+# pane (with its wrap mode), and the channel and BSSID of the last wifi
+# access point. After a reset, code.py can draw the old topics right away
+# (marked as stale) and rejoin wifi without a full scan.
+#
+# NVM layout (little-endian), starting at offset:
+# - 5-byte MAGIC
+# - uint8 wifi channel (0 = unknown), 6-byte BSSID, uint8 SSID length, SSID
+# - uint8 pane count, then for each pane: uint8 wrap mode, uint16 length,
+#   and that many bytes of UTF-8 topic text
+#
+# Flash has limited write endurance, so save() only writes when something
+# changed and at most once per save_s seconds.
+#
+from micropython import const
+import struct
+import time
+
+
+MAGIC = b'IRCW\x01'
+_MAX_TOPIC = const(512)
+_WRAPS = (None, 'word', 'hard', 'pre', 'kv')
+
+
+class WarmStart:
+
+    def __init__(self, nvm, offset=0, size=2560, save_s=60):
+        self.nvm = nvm
+        self.offset = offset
+        self.size = size
+        self.save_s = save_s
+        self.last_save = time.monotonic() - save_s
+        self.dirty = False
+        self.ssid = ''
+        self.channel = 0
+        self.bssid = None
+        self.topics = []       # (text, wrap) for each pane, or None
+
+    def load(self):
+        # Read saved state from nvm. Returns True if there was any. A bad or
+        # missing record just leaves everything empty.
+        try:
+            self._unpack(bytes(self.nvm[self.offset:self.offset+self.size]))
+            return True
+        except ValueError:
+            self.ssid = ''
+            self.channel = 0
+            self.bssid = None
+            self.topics = []
+            return False
+
+    def _unpack(self, buf):
+        # Parse the NVM layout. Raises ValueError if buf doesn't hold a
+        # complete, valid record.
+        n = len(MAGIC)
+        if buf[:n] != MAGIC or len(buf) < n + 8:
+            raise ValueError('no warm start data')
+        self.channel = buf[n]
+        self.bssid = buf[n+1:n+7] if self.channel else None
+        i = n + 8 + buf[n+7]
+        if i >= len(buf):
+            raise ValueError('bad ssid')
+        self.ssid = str(buf[n+8:i], 'utf-8')
+        panes = buf[i]
+        i += 1
+        topics = []
+        for _ in range(panes):
+            if i + 3 > len(buf) or buf[i] >= len(_WRAPS):
+                raise ValueError('bad pane')
+            (wrap, size) = struct.unpack_from('<BH', buf, i)
+            i += 3
+            if i + size > len(buf):
+                raise ValueError('bad pane')
+            topics.append((str(buf[i:i+size], 'utf-8'), _WRAPS[wrap])
+                if size else None)
+            i += size
+        self.topics = topics
+
+    def _pack(self):
+        ssid = self.ssid.encode()[:255]
+        out = bytearray(MAGIC)
+        out.append(self.channel)
+        out.extend(self.bssid if self.channel else bytes(6))
+        out.append(len(ssid))
+        out.extend(ssid)
+        out.append(len(self.topics))
+        for t in self.topics:
+            if t is None:
+                out.extend(b'\x00\x00\x00')
+                continue
+            data = t[0].encode()[:_MAX_TOPIC]
+            out.extend(struct.pack('<BH', _WRAPS.index(t[1]), len(data)))
+            out.extend(data)
+        return out
+
+    def wifi(self, ssid):
+        # Return (channel, bssid) of the last access point for ssid, or
+        # (0, None) if there isn't one
+        if self.channel and ssid == self.ssid:
+            return (self.channel, self.bssid)
+        return (0, None)
+
+    def set_wifi(self, ssid, channel, bssid):
+        if (ssid, channel, bssid) != (self.ssid, self.channel, self.bssid):
+            self.ssid = ssid
+            self.channel = channel
+            self.bssid = bytes(bssid) if channel else None
+            self.dirty = True
+
+    def set_topic(self, pane, text, wrap):
+        while len(self.topics) <= pane:
+            self.topics.append(None)
+        if self.topics[pane] != (text, wrap):
+            self.topics[pane] = (text, wrap)
+            self.dirty = True
+
+    def save(self, force=False):
+        # Write changes to nvm, but no more than once per save_s seconds
+        # unless force=True. Returns True if it wrote to nvm.
+        now = time.monotonic()
+        if not self.dirty or (not force and now - self.last_save <
+                self.save_s):
+            return False
+        self.dirty = False
+        self.last_save = now
+        data = self._pack()
+        if len(data) > self.size:
+            print('ERR warm start: %d bytes is too big' % len(data))
+            return False
+        start = self.offset
+        if bytes(self.nvm[start:start+len(data)]) == data:
+            return False
+        self.nvm[start:start+len(data)] = data
+        return True